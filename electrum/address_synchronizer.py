@@ -22,18 +22,17 @@
 # SOFTWARE.
 
 import asyncio
-import copy
+import bisect
 import dataclasses
 import threading
 import itertools
 from collections import defaultdict
 from typing import TYPE_CHECKING, Dict, Optional, Set, Tuple, NamedTuple, Sequence, List
 
-from .crypto import sha256
 from . import bitcoin, util
 from .bitcoin import COINBASE_MATURITY
 from .util import profiler, bfh, TxMinedInfo, UnrelatedTransactionException, with_lock, OldTaskGroup
-from .transaction import Transaction, TxOutput, TxInput, PartialTxInput, TxOutpoint, PartialTransaction, tx_from_any
+from .transaction import Transaction, TxOutput, TxInput, PartialTxInput, TxOutpoint, tx_from_any
 from .synchronizer import Synchronizer
 from .verifier import SPV
 from .blockchain import hash_header, Blockchain
@@ -74,6 +73,222 @@ class HistoryItem(NamedTuple):
     balance: int
 
 
+class _HistoryEntry(NamedTuple):
+    key: Tuple[int, int, str]  # sort height, txpos, txid
+    delta: int
+    fee: Optional[int]
+    is_settled: bool  # SPV-verified
+
+
+class _HistoryIndex:
+    """Sorted history of the txs touching a domain of addresses, with running balances.
+
+    It is maintained incrementally: the AddressSynchronizer marks txs as dirty when
+    their inputs/outputs or their verified status change, and these are re-positioned
+    on the next query. The mined status of unverified txs can change in many ways,
+    so their entries are re-checked on every query; there should be few of them.
+    Running balances are only recomputed from the first changed position onward.
+    Access with adb.lock.
+    """
+
+    MAX_DOMAIN_CHANGE = 100  # more changed addresses than that, and we rebuild from scratch
+
+    def __init__(self, adb: 'AddressSynchronizer'):
+        self.adb = adb
+        self.reset()
+
+    def reset(self) -> None:
+        self.domain = None  # type: Optional[Set[str]]
+        self._keys = []  # type: List[Tuple[int, int, str]]  # sorted
+        self._entries = {}  # type: Dict[str, _HistoryEntry]
+        self._balances = []  # type: List[int]  # running balance after each tx in _keys
+        self._balances_valid_upto = 0  # _balances[:_balances_valid_upto] are up-to-date
+        self._dirty = set()  # type: Set[str]
+        self._unsettled = set()  # type: Set[str]
+
+    def mark_dirty(self, txid: str) -> None:
+        if self.domain is not None:
+            self._dirty.add(txid)
+
+    def can_switch_domain(self, domain: Set[str]) -> bool:
+        return self.domain is None or len(domain ^ self.domain) <= self.MAX_DOMAIN_CHANGE
+
+    def set_domain(self, domain: Set[str]) -> None:
+        if self.domain is None:
+            changed_addrs = domain
+        else:
+            changed_addrs = domain ^ self.domain
+        for addr in changed_addrs:
+            self._dirty |= self.adb._history_local.get(addr, set())
+        self.domain = domain
+
+    def _compute_entry(self, txid: str) -> Optional[_HistoryEntry]:
+        adb = self.adb
+        addrs = set(itertools.chain(adb.db.get_txi_addresses(txid), adb.db.get_txo_addresses(txid)))
+        addrs &= self.domain
+        if not addrs:
+            return None
+        delta = sum(adb.get_tx_delta(txid, addr) for addr in addrs)
+        tx_mined_status = adb.get_tx_height(txid)
+        key = (adb.tx_height_to_sort_height(tx_mined_status.height()), tx_mined_status.txpos or -1, txid)
+        return _HistoryEntry(
+            key=key,
+            delta=delta,
+            fee=adb.get_tx_fee(txid),
+            is_settled=adb.db.is_in_verified_tx(txid))
+
+    def _refresh(self) -> None:
+        todo = self._dirty | self._unsettled
+        self._dirty = set()
+        if not todo:
+            return
+        changed = {}  # type: Dict[str, Optional[_HistoryEntry]]
+        for txid in todo:
+            entry = self._compute_entry(txid)
+            if entry != self._entries.get(txid):
+                changed[txid] = entry
+        if len(changed) > len(self._keys) // 8 + 16:
+            # many changes (e.g. initial build): sorting everything is faster
+            for txid, entry in changed.items():
+                self._set_entry(txid, entry)
+            self._keys = sorted(entry.key for entry in self._entries.values())
+            self._balances_valid_upto = 0
+            return
+        for txid, entry in changed.items():
+            old_entry = self._entries.get(txid)
+            if old_entry is not None:
+                pos = bisect.bisect_left(self._keys, old_entry.key)
+                assert self._keys[pos] == old_entry.key
+                del self._keys[pos]
+                self._balances_valid_upto = min(self._balances_valid_upto, pos)
+            if entry is not None:
+                pos = bisect.bisect_left(self._keys, entry.key)
+                self._keys.insert(pos, entry.key)
+                self._balances_valid_upto = min(self._balances_valid_upto, pos)
+            self._set_entry(txid, entry)
+
+    def _set_entry(self, txid: str, entry: Optional[_HistoryEntry]) -> None:
+        if entry is None:
+            self._entries.pop(txid, None)
+            self._unsettled.discard(txid)
+            return
+        self._entries[txid] = entry
+        if entry.is_settled:
+            self._unsettled.discard(txid)
+        else:
+            self._unsettled.add(txid)
+
+    def _update_balances(self) -> None:
+        start = self._balances_valid_upto
+        del self._balances[start:]
+        balance = self._balances[-1] if self._balances else 0
+        entries = self._entries
+        for key in itertools.islice(self._keys, start, None):
+            balance += entries[key[2]].delta
+            self._balances.append(balance)
+        self._balances_valid_upto = len(self._keys)
+
+    def get_balance(self) -> int:
+        self._refresh()
+        self._update_balances()
+        return self._balances[-1] if self._balances else 0
+
+    def __len__(self):
+        self._refresh()
+        return len(self._keys)
+
+    def get_items(
+            self, *,
+            from_sort_height: Optional[int] = None,
+            to_sort_height: Optional[int] = None,
+            offset: int = 0,
+            limit: Optional[int] = None,
+    ) -> List[HistoryItem]:
+        self._refresh()
+        self._update_balances()
+        start, stop = 0, len(self._keys)
+        if from_sort_height is not None:
+            start = bisect.bisect_left(self._keys, (from_sort_height,))
+        if to_sort_height is not None:
+            stop = bisect.bisect_left(self._keys, (to_sort_height,))
+        start += offset
+        if limit is not None:
+            stop = min(stop, start + limit)
+        items = []
+        for pos in range(start, stop):
+            txid = self._keys[pos][2]
+            entry = self._entries[txid]
+            items.append(HistoryItem(
+                txid=txid,
+                tx_mined_status=self.adb.get_tx_height(txid),
+                delta=entry.delta,
+                fee=entry.fee,
+                balance=self._balances[pos]))
+        return items
+
+
+class _TxoInfo(NamedTuple):
+    txid: str
+    address: str
+    value: int
+    is_coinbase: bool
+
+
+class _UtxoIndex:
+    """Live set of the is_mine txos, keyed by outpoint, with per-address aggregates.
+
+    It follows adb._history_local: whenever a tx enters or leaves the local history
+    of an address, the txi/txo entries of that tx for that address are (un)indexed.
+    Heights are not stored, they are looked up when coins are requested, so that
+    SPV verification and new blocks do not need to touch the index.
+    Access with adb.lock.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.txos = {}  # type: Dict[str, _TxoInfo]  # outpoint -> txo
+        self.spent = {}  # type: Dict[str, str]  # outpoint -> spending txid
+        self.addr_txos = defaultdict(dict)  # type: Dict[str, Dict[str, None]]  # addr -> outpoints (ordered set)
+        self.addr_utxos = defaultdict(dict)  # type: Dict[str, Dict[str, None]]  # addr -> unspent outpoints
+        self.addr_received = defaultdict(int)  # type: Dict[str, int]  # addr -> total value ever received
+        self.addr_num_spends = defaultdict(int)  # type: Dict[str, int]  # addr -> number of txos spent
+
+    def add_tx(self, db: 'WalletDB', txid: str, addr: str) -> None:
+        for n, (v, is_cb) in db.get_txo_addr(txid, addr).items():
+            prevout = f"{txid}:{n}"
+            if prevout in self.txos:
+                continue
+            self.txos[prevout] = _TxoInfo(txid=txid, address=addr, value=v, is_coinbase=is_cb)
+            self.addr_txos[addr][prevout] = None
+            self.addr_received[addr] += v
+            if prevout not in self.spent:
+                self.addr_utxos[addr][prevout] = None
+        for prevout, v in db.get_txi_addr(txid, addr):
+            if prevout in self.spent:
+                continue
+            self.spent[prevout] = txid
+            self.addr_num_spends[addr] += 1
+            self.addr_utxos[addr].pop(prevout, None)
+
+    def remove_tx(self, db: 'WalletDB', txid: str, addr: str) -> None:
+        for prevout, v in db.get_txi_addr(txid, addr):
+            if self.spent.get(prevout) != txid:
+                continue
+            del self.spent[prevout]
+            self.addr_num_spends[addr] -= 1
+            if prevout in self.txos:
+                self.addr_utxos[addr][prevout] = None
+        for n, (v, is_cb) in db.get_txo_addr(txid, addr).items():
+            prevout = f"{txid}:{n}"
+            if self.txos.pop(prevout, None) is None:
+                continue
+            self.addr_txos[addr].pop(prevout, None)
+            self.addr_received[addr] -= v
+            self.addr_utxos[addr].pop(prevout, None)
+
+
 class AddressSynchronizer(Logger, EventListener):
     """ address database """
 
@@ -100,16 +315,8 @@ class AddressSynchronizer(Logger, EventListener):
         # thread local storage for caching stuff
         self.threadlocal_cache = threading.local()
 
-        self._get_balance_cache = {}
-        self._get_utxos_cache = {}
-
         self.load_and_cleanup()
 
-    @with_lock
-    def invalidate_cache(self):
-        self._get_balance_cache.clear()
-        self._get_utxos_cache.clear()
-
     def diagnostic_name(self):
         return self.name or ""
 
@@ -191,6 +398,21 @@ class AddressSynchronizer(Logger, EventListener):
             return tx.outputs()[prevout_n].value
         return None
 
+    def _get_prevout_value(self, prevout: TxOutpoint) -> Optional[int]:
+        """Like get_txin_value, but avoids deserializing the parent tx."""
+        prevout_hash = prevout.txid.hex()
+        prevout_n = prevout.out_idx
+        for addr in self.db.get_txo_addresses(prevout_hash):
+            d = self.db.get_txo_addr(prevout_hash, addr)
+            if prevout_n in d:
+                v, cb = d[prevout_n]
+                return v
+        tx = self.db.get_transaction(prevout_hash)
+        if tx:
+            output_values = tx.get_prevouts_and_output_values()[1]
+            return output_values[prevout_n]
+        return None
+
     @with_lock
     def load_unverified_transactions(self):
         # review transactions that are in the history
@@ -214,7 +436,6 @@ class AddressSynchronizer(Logger, EventListener):
     @event_listener
     @with_lock
     def on_event_blockchain_updated(self, *args):
-        self.invalidate_cache()
         self._update_stored_local_height()
 
     async def stop(self):
@@ -232,8 +453,8 @@ class AddressSynchronizer(Logger, EventListener):
                 self.network = None
 
     def add_address(self, address: str) -> None:
-        if address not in self.db.history:
-            self.db.history[address] = []
+        if not self.db.is_addr_in_history(address):
+            self.db.set_addr_history(address, [])
         if self.synchronizer:
             self.synchronizer.add(address)
         self.up_to_date_changed()
@@ -346,7 +567,6 @@ class AddressSynchronizer(Logger, EventListener):
                         pass
                     else:
                         self.db.add_txi_addr(tx_hash, addr, ser, v)
-                        self.invalidate_cache()
             for txi in tx.inputs():
                 if txi.is_coinbase_input():
                     continue
@@ -364,7 +584,6 @@ class AddressSynchronizer(Logger, EventListener):
                 addr = txo.address
                 if addr and self.is_mine(addr):
                     self.db.add_txo_addr(tx_hash, addr, n, v, is_coinbase)
-                    self.invalidate_cache()
                     # give v to txi that spends me
                     next_tx = self.db.get_spent_outpoint(tx_hash, n)
                     if next_tx is not None:
@@ -415,7 +634,6 @@ class AddressSynchronizer(Logger, EventListener):
             tx = self.db.remove_transaction(tx_hash)
             remove_from_spent_outpoints()
             self._remove_tx_from_local_history(tx_hash)
-            self.invalidate_cache()
             self.db.remove_txi(tx_hash)
             self.db.remove_txo(tx_hash)
             self.db.remove_tx_fee(tx_hash)
@@ -457,6 +675,7 @@ class AddressSynchronizer(Logger, EventListener):
                 self.unverified_tx.pop(tx_hash, None)
                 self.unconfirmed_tx.pop(tx_hash, None)
                 self.db.remove_verified_tx(tx_hash)
+                self._history_index.mark_dirty(tx_hash)
                 if self.verifier:
                     self.verifier.remove_spv_proof_for_tx(tx_hash)
         self.db.set_addr_history(addr, hist)
@@ -482,6 +701,8 @@ class AddressSynchronizer(Logger, EventListener):
     @profiler
     def load_local_history(self):
         self._history_local = {}  # type: Dict[str, Set[str]]  # address -> set(txid)
+        self._history_index = _HistoryIndex(self)
+        self._utxo_index = _UtxoIndex()
         self._address_history_changed_events = defaultdict(asyncio.Event)  # address -> Event
         for txid in itertools.chain(self.db.list_txi(), self.db.list_txo()):
             self._add_tx_to_local_history(txid)
@@ -505,15 +726,18 @@ class AddressSynchronizer(Logger, EventListener):
     @with_lock
     def remove_local_transactions_we_dont_have(self):
         for txid in itertools.chain(self.db.list_txi(), self.db.list_txo()):
+            if self.db.has_transaction(txid):
+                continue
             tx_height = self.get_tx_height(txid).height()
-            if tx_height == TX_HEIGHT_LOCAL and not self.db.get_transaction(txid):
+            if tx_height == TX_HEIGHT_LOCAL:
                 self.remove_transaction(txid)
 
     @with_lock
     def clear_history(self):
         self.db.clear_history()
         self._history_local.clear()
-        self.invalidate_cache()
+        self._history_index.reset()
+        self._utxo_index.reset()
 
     @with_lock
     def _get_tx_sort_key(self, tx_hash: str) -> Tuple[int, int]:
@@ -553,40 +777,46 @@ class AddressSynchronizer(Logger, EventListener):
 
     @with_lock
     @with_local_height_cached
-    def get_history(self, domain) -> Sequence[HistoryItem]:
+    def get_history(
+            self,
+            domain,
+            *,
+            from_height: Optional[int] = None,  # [from_height, to_height[
+            to_height: Optional[int] = None,
+            offset: int = 0,
+            limit: Optional[int] = None,
+    ) -> Sequence[HistoryItem]:
+        """Returns the history of the txs touching domain, sorted, with running balances.
+        from_height and to_height filter on the sort height (see tx_height_to_sort_height),
+        so unconfirmed txs are kept by from_height and dropped by to_height.
+        offset and limit paginate what is left.
+        """
         domain = set(domain)
-        # 1. Get the history of each address in the domain, maintain the
-        #    delta of a tx as the sum of its deltas on domain addresses
-        tx_deltas = defaultdict(int)  # type: Dict[str, int]
-        for addr in domain:
-            h = self.get_address_history(addr).items()
-            for tx_hash, height in h:
-                tx_deltas[tx_hash] += self.get_tx_delta(tx_hash, addr)
-        # 2. create sorted history
-        history = []
-        for tx_hash in tx_deltas:
-            delta = tx_deltas[tx_hash]
-            tx_mined_status = self.get_tx_height(tx_hash)
-            fee = self.get_tx_fee(tx_hash)
-            history.append((tx_hash, tx_mined_status, delta, fee))
-        history.sort(key = lambda x: self._get_tx_sort_key(x[0]))
-        # 3. add balance
-        h2 = []
-        balance = 0
-        for tx_hash, tx_mined_status, delta, fee in history:
-            balance += delta
-            h2.append(HistoryItem(
-                txid=tx_hash,
-                tx_mined_status=tx_mined_status,
-                delta=delta,
-                fee=fee,
-                balance=balance))
+        index = self._get_history_index(domain)
+        h = index.get_items(
+            from_sort_height=from_height, to_sort_height=to_height, offset=offset, limit=limit)
         # sanity check
         c, u, x = self.get_balance(domain)
+        balance = index.get_balance()
         if balance != c + u + x:
             self.logger.error(f'sanity check failed! c={c},u={u},x={x} while history balance={balance}')
             raise Exception("wallet.get_history() failed balance sanity-check")
-        return h2
+        return h
+
+    @with_lock
+    def get_history_len(self, domain) -> int:
+        return len(self._get_history_index(set(domain)))
+
+    def _get_history_index(self, domain: Set[str]) -> _HistoryIndex:
+        index = self._history_index
+        if not index.can_switch_domain(domain):
+            if len(domain) < len(index.domain):
+                # e.g. a single address: build a throwaway index, and keep the one of the wallet
+                index = _HistoryIndex(self)
+            else:
+                index.reset()
+        index.set_domain(domain)
+        return index
 
     @with_lock
     def _add_tx_to_local_history(self, txid):
@@ -594,11 +824,14 @@ class AddressSynchronizer(Logger, EventListener):
             cur_hist = self._history_local.get(addr, set())
             cur_hist.add(txid)
             self._history_local[addr] = cur_hist
+            self._utxo_index.add_tx(self.db, txid, addr)
             self._mark_address_history_changed(addr)
+        self._history_index.mark_dirty(txid)
 
     @with_lock
     def _remove_tx_from_local_history(self, txid):
         for addr in itertools.chain(self.db.get_txi_addresses(txid), self.db.get_txo_addresses(txid)):
+            self._utxo_index.remove_tx(self.db, txid, addr)
             cur_hist = self._history_local.get(addr, set())
             try:
                 cur_hist.remove(txid)
@@ -607,6 +840,7 @@ class AddressSynchronizer(Logger, EventListener):
             else:
                 self._history_local[addr] = cur_hist
                 self._mark_address_history_changed(addr)
+        self._history_index.mark_dirty(txid)
 
     def _mark_address_history_changed(self, addr: str) -> None:
         def set_and_clear():
@@ -634,12 +868,15 @@ class AddressSynchronizer(Logger, EventListener):
             if tx_height <= 0:
                 # tx was previously SPV-verified but now in mempool (probably reorg)
                 self.db.remove_verified_tx(tx_hash)
+                self._history_index.mark_dirty(tx_hash)
                 self.unconfirmed_tx[tx_hash] = tx_height
                 if self.verifier:
                     self.verifier.remove_spv_proof_for_tx(tx_hash)
         else:
             if tx_height > 0:
                 self.unverified_tx[tx_hash] = tx_height
+                if self.verifier:
+                    self.verifier.wake_up()
             else:
                 self.unconfirmed_tx[tx_hash] = tx_height
 
@@ -648,13 +885,17 @@ class AddressSynchronizer(Logger, EventListener):
         new_height = self.unverified_tx.get(tx_hash)
         if new_height == tx_height:
             self.unverified_tx.pop(tx_hash, None)
+            if self.synchronizer:
+                self.synchronizer.wake_up()  # is_up_to_date might have changed
 
     def add_verified_tx(self, tx_hash: str, info: TxMinedInfo):
         # Remove from the unverified map and add to the verified map
         with self.lock:
             self.unverified_tx.pop(tx_hash, None)
             self.db.add_verified_tx(tx_hash, info)
-            self.invalidate_cache()
+            self._history_index.mark_dirty(tx_hash)
+        if self.synchronizer:
+            self.synchronizer.wake_up()  # is_up_to_date might have changed
         util.trigger_callback('adb_added_verified_tx', self, tx_hash)
 
     @with_lock
@@ -673,6 +914,7 @@ class AddressSynchronizer(Logger, EventListener):
                     header = blockchain.read_header(tx_height)
                     if not header or hash_header(header) != info.header_hash:
                         self.db.remove_verified_tx(tx_hash)
+                        self._history_index.mark_dirty(tx_hash)
                         # NOTE: we should add these txns to self.unverified_tx,
                         # but with what height?
                         # If on the new fork after the reorg, the txn is at the
@@ -744,8 +986,7 @@ class AddressSynchronizer(Logger, EventListener):
                 # Having only a partial tx is another variant of this.
                 # FIXME in fact even if we have a complete tx saved, the server might have
                 #       a different tx if only the witness differs. We should compare wtxids.
-                tx = self.db.get_transaction(tx_hash)
-                if tx is None or isinstance(tx, PartialTransaction):
+                if not self.db.has_complete_transaction(tx_hash):
                     return TxMinedInfo(_height=TX_HEIGHT_LOCAL, conf=0)
             return tx_mined_info
 
@@ -819,29 +1060,28 @@ class AddressSynchronizer(Logger, EventListener):
             # trust server if tx is unconfirmed and not mine
             if num_ismine_inputs < num_all_inputs:
                 return None if confirmed else self.db.get_tx_fee(txid, trust_server=True)
-        # lookup tx and deserialize it.
-        # note that deserializing is expensive, hence above hacks
+        # lookup tx. we only parse the prevouts and output values,
+        # as fully deserializing is expensive, hence above hacks
         tx = self.db.get_transaction(txid)
         if not tx:
             return None
+        prevouts, output_values = tx.get_prevouts_and_output_values()
         # compute fee if possible
-        v_in = v_out = 0
-        for txin in tx.inputs():
-            addr = self.get_txin_address(txin)
-            value = self.get_txin_value(txin, address=addr)
+        v_in = 0
+        for prevout in prevouts:
+            value = self._get_prevout_value(prevout)
             if value is None:
                 v_in = None
-            elif v_in is not None:
-                v_in += value
-        for txout in tx.outputs():
-            v_out += txout.value
+                break
+            v_in += value
+        v_out = sum(output_values)
         if v_in is not None:
             fee = v_in - v_out
         else:
             fee = None
         # save result
         self.db.add_tx_fee_we_calculated(txid, fee)
-        self.db.add_num_inputs_to_tx(txid, len(tx.inputs()))
+        self.db.add_num_inputs_to_tx(txid, len(prevouts))
         return fee
 
     @with_lock
@@ -860,38 +1100,40 @@ class AddressSynchronizer(Logger, EventListener):
                 sent[txi] = tx_hash, height, txpos
         return received, sent
 
+    def _make_coin(self, prevout_str: str, txo: _TxoInfo) -> PartialTxInput:
+        tx_mined_info = self.get_tx_height(txo.txid)
+        utxo = PartialTxInput(prevout=TxOutpoint.from_str(prevout_str), is_coinbase_output=txo.is_coinbase)
+        utxo._trusted_address = txo.address
+        utxo._trusted_value_sats = txo.value
+        utxo.block_height = tx_mined_info.height()
+        utxo.block_txpos = tx_mined_info.txpos if tx_mined_info.txpos is not None else -1
+        spent_txid = self._utxo_index.spent.get(prevout_str)
+        utxo.spent_txid = spent_txid
+        utxo.spent_height = self.get_tx_height(spent_txid).height() if spent_txid is not None else None
+        return utxo
+
+    @with_lock
+    @with_local_height_cached
     def get_addr_outputs(self, address: str) -> Dict[TxOutpoint, PartialTxInput]:
-        received, sent = self.get_addr_io(address)
         out = {}
-        for prevout_str, v in received.items():
-            tx_height, tx_pos, value, is_cb = v
-            prevout = TxOutpoint.from_str(prevout_str)
-            utxo = PartialTxInput(prevout=prevout, is_coinbase_output=is_cb)
-            utxo._trusted_address = address
-            utxo._trusted_value_sats = value
-            utxo.block_height = tx_height
-            utxo.block_txpos = tx_pos
-            if prevout_str in sent:
-                txid, height, pos = sent[prevout_str]
-                utxo.spent_txid = txid
-                utxo.spent_height = height
-            else:
-                utxo.spent_txid = None
-                utxo.spent_height = None
-            out[prevout] = utxo
+        for prevout_str in self._utxo_index.addr_txos.get(address, ()):
+            utxo = self._make_coin(prevout_str, self._utxo_index.txos[prevout_str])
+            out[utxo.prevout] = utxo
         return out
 
+    @with_lock
+    @with_local_height_cached
     def get_addr_utxo(self, address: str) -> Dict[TxOutpoint, PartialTxInput]:
-        out = self.get_addr_outputs(address)
-        for k, v in list(out.items()):
-            if v.spent_height is not None:
-                out.pop(k)
+        out = {}
+        for prevout_str in self._utxo_index.addr_utxos.get(address, ()):
+            utxo = self._make_coin(prevout_str, self._utxo_index.txos[prevout_str])
+            out[utxo.prevout] = utxo
         return out
 
     # return the total amount ever received by an address
+    @with_lock
     def get_addr_received(self, address):
-        received, sent = self.get_addr_io(address)
-        return sum([value for height, pos, value, is_cb in received.values()])
+        return self._utxo_index.addr_received.get(address, 0)
 
     @with_lock
     @with_local_height_cached
@@ -909,55 +1151,40 @@ class AddressSynchronizer(Logger, EventListener):
             excluded_coins = set()
         assert isinstance(excluded_coins, set), f"excluded_coins should be set, not {type(excluded_coins)}"
 
-        cache_key = sha256(','.join(sorted(domain)) + ';'
-                           + ','.join(sorted(excluded_coins)))
-        cached_value = self._get_balance_cache.get(cache_key)
-        if cached_value:
-            return cached_value
-
-        coins = {}
-        for address in domain:
-            coins.update(self.get_addr_outputs(address))
-
+        txos = self._utxo_index.txos
         c = u = x = 0
         mempool_height = self.get_local_height() + 1  # height of next block
-        for utxo in coins.values():  # type: PartialTxInput
-            if utxo.spent_height is not None:
-                continue
-            if utxo.prevout.to_str() in excluded_coins:
-                continue
-            v = utxo.value_sats()
-            tx_height = utxo.block_height
-            is_cb = utxo.is_coinbase_output()
-            if is_cb and tx_height + COINBASE_MATURITY > mempool_height:
-                x += v
-            elif tx_height > 0:
-                c += v
-            else:
-                txid = utxo.prevout.txid.hex()
-                tx = self.db.get_transaction(txid)
-                assert tx is not None # txid comes from get_addr_io
-                # we look at the outputs that are spent by this transaction
-                # if those outputs are ours and confirmed, we count this coin as confirmed
-                confirmed_spent_amount = 0
-                for txin in tx.inputs():
-                    if txin.prevout in coins:
-                        coin = coins[txin.prevout]
-                        if coin.block_height > 0:
-                            confirmed_spent_amount += coin.value_sats()
-                # Compare amount, in case tx has confirmed and unconfirmed inputs, or is a coinjoin.
-                # (fixme: tx may have multiple change outputs)
-                if confirmed_spent_amount >= v:
+        for address in domain:
+            for prevout_str in self._utxo_index.addr_utxos.get(address, ()):
+                if prevout_str in excluded_coins:
+                    continue
+                txo = txos[prevout_str]
+                v = txo.value
+                tx_height = self.get_tx_height(txo.txid).height()
+                if txo.is_coinbase and tx_height + COINBASE_MATURITY > mempool_height:
+                    x += v
+                elif tx_height > 0:
                     c += v
                 else:
-                    c += confirmed_spent_amount
-                    u += v - confirmed_spent_amount
-        result = c, u, x
-        # cache result.
-        # Cache needs to be invalidated if a transaction is added to/
-        # removed from history; or on new blocks (maturity...)
-        self._get_balance_cache[cache_key] = result
-        return result
+                    tx = self.db.get_transaction(txo.txid)
+                    assert tx is not None  # txid comes from the local history
+                    # we look at the outputs that are spent by this transaction
+                    # if those outputs are ours and confirmed, we count this coin as confirmed
+                    confirmed_spent_amount = 0
+                    for txin in tx.inputs():
+                        prev_txo = txos.get(txin.prevout.to_str())
+                        if prev_txo is None or prev_txo.address not in domain:
+                            continue
+                        if self.get_tx_height(prev_txo.txid).height() > 0:
+                            confirmed_spent_amount += prev_txo.value
+                    # Compare amount, in case tx has confirmed and unconfirmed inputs, or is a coinjoin.
+                    # (fixme: tx may have multiple change outputs)
+                    if confirmed_spent_amount >= v:
+                        c += v
+                    else:
+                        c += confirmed_spent_amount
+                        u += v - confirmed_spent_amount
+        return c, u, x
 
     @with_lock
     @with_local_height_cached
@@ -984,16 +1211,14 @@ class AddressSynchronizer(Logger, EventListener):
         if excluded_addresses:
             domain = set(domain) - set(excluded_addresses)
         mempool_height = block_height + 1  # height of next block
-        cache_key = sha256(
-            ','.join(sorted(domain))
-            + f";{mature_only};{confirmed_funding_only};{confirmed_spending_only};{nonlocal_only};{block_height}"
-        )
-        cached = self._get_utxos_cache.get(cache_key)
-        if cached is not None:
-            return copy.deepcopy(cached)
         for addr in domain:
-            txos = self.get_addr_outputs(addr)
-            for txo in txos.values():
+            if confirmed_spending_only:
+                # txos whose spending tx is not mined yet (at block_height) are included
+                prevouts = self._utxo_index.addr_txos.get(addr, ())
+            else:
+                prevouts = self._utxo_index.addr_utxos.get(addr, ())
+            for prevout_str in prevouts:
+                txo = self._make_coin(prevout_str, self._utxo_index.txos[prevout_str])
                 if txo.spent_height is not None:
                     if not confirmed_spending_only:
                         continue
@@ -1007,22 +1232,20 @@ class AddressSynchronizer(Logger, EventListener):
                         and txo.block_height + COINBASE_MATURITY > mempool_height):
                     continue
                 coins.append(txo)
-                continue
-        self._get_utxos_cache[cache_key] = copy.deepcopy(coins)
         return coins
 
     def is_used(self, address: str) -> bool:
         """Whether any tx ever touched `address`."""
         return self.get_address_history_len(address) != 0
 
+    @with_lock
     def is_used_as_from_address(self, address: str) -> bool:
         """Whether any tx ever spent from `address`."""
-        received, sent = self.get_addr_io(address)
-        return len(sent) > 0
+        return self._utxo_index.addr_num_spends.get(address, 0) > 0
 
+    @with_lock
     def is_empty(self, address: str) -> bool:
-        coins = self.get_addr_utxo(address)
-        return not bool(coins)
+        return not self._utxo_index.addr_utxos.get(address)
 
     @with_lock
     @with_local_height_cached
@@ -4,6 +4,7 @@
 
 import binascii
 import hashlib
+import hmac
 import struct
 from typing import List, Tuple, NamedTuple, Union, Iterable, Sequence, Optional
 
@@ -101,6 +102,34 @@ def _CKD_pub(parent_pubkey: bytes, parent_chaincode: bytes, child_index: bytes)
     return child_pubkey, child_chaincode
 
 
+def CKD_pub_batch(parent_pubkey: bytes, parent_chaincode: bytes, start: int, count: int) -> List[bytes]:
+    """Derives the public keys of 'count' consecutive non-hardened children,
+    starting at child index 'start'. Same as calling CKD_pub for each index,
+    but the parent point and the HMAC key schedule are only set up once.
+    """
+    if start < 0 or count < 0: raise ValueError('the bip32 index needs to be non-negative')
+    if count > 0 and start + count - 1 >= BIP32_PRIME:
+        raise Exception('not possible to derive hardened child from parent pubkey')
+    parent_point = ecc.ECPubkey(parent_pubkey)
+    parent_pubkey = parent_point.get_public_key_bytes(compressed=True)
+    mac = hmac.new(parent_chaincode, parent_pubkey, hashlib.sha512)
+    child_pubkeys = []
+    for child_index in range(start, start + count):
+        h = mac.copy()
+        h.update(int.to_bytes(child_index, length=4, byteorder="big", signed=False))
+        I = h.digest()
+        try:
+            pubkey = ecc.ECPrivkey(I[0:32]) + parent_point
+            if pubkey.is_at_infinity():
+                raise ecc.InvalidECPointException()
+        except ecc.InvalidECPointException:
+            # astronomically unlikely. let CKD_pub handle it, for consistent behaviour
+            child_pubkeys.append(CKD_pub(parent_pubkey, parent_chaincode, child_index)[0])
+            continue
+        child_pubkeys.append(pubkey.get_public_key_bytes(compressed=True))
+    return child_pubkeys
+
+
 def xprv_header(xtype: str, *, net=None) -> bytes:
     if net is None:
         net = constants.net
@@ -282,6 +311,13 @@ class BIP32Node(NamedTuple):
                          fingerprint=fingerprint,
                          child_number=child_number)
 
+    def derive_child_pubkeys(self, start: int, count: int) -> List[bytes]:
+        """Returns the compressed public keys of the non-hardened children
+        start, start+1, ..., start+count-1 of this node.
+        """
+        pubkey = self.eckey.get_public_key_bytes(compressed=True)
+        return CKD_pub_batch(pubkey, self.chaincode, start, count)
+
     def calc_fingerprint_of_this_node(self) -> bytes:
         """Returns the fingerprint of this node.
         Note that self.fingerprint is of the *parent*.
@@ -3,7 +3,6 @@
 # file LICENCE or http://www.opensource.org/licenses/mit-license.php
 
 from typing import TYPE_CHECKING, Optional
-import itertools
 
 from . import bitcoin
 from .constants import BIP39_WALLET_FORMATS
@@ -48,16 +47,14 @@ async def scan_for_active_accounts(network: 'Network', get_account_xpub, wallet_
 
 async def account_has_history(network: 'Network', account_node: BIP32Node, script_type: str) -> bool:
     # note: scan both receiving and change addresses. some wallets send change across accounts.
-    path_suffixes = itertools.chain(
-        itertools.product((0,), range(20)),  # ad-hoc gap limits
-        itertools.product((1,), range(10)),
-    )
+    pubkeys = []
+    for for_change, gap_limit in ((0, 20), (1, 10)):  # ad-hoc gap limits
+        chain_node = account_node.subkey_at_public_derivation((for_change,))
+        pubkeys.extend(chain_node.derive_child_pubkeys(0, gap_limit))
     async with OldTaskGroup() as group:
         get_history_tasks = []
-        for path_suffix in path_suffixes:
-            address_node = account_node.subkey_at_public_derivation(path_suffix)
-            pubkey = address_node.eckey.get_public_key_hex()
-            address = bitcoin.pubkey_to_address(script_type, pubkey)
+        for pubkey in pubkeys:
+            address = bitcoin.pubkey_to_address(script_type, pubkey.hex())
             script = bitcoin.address_to_script(address)
             scripthash = bitcoin.script_to_scripthash(script)
             get_history = network.get_history_for_scripthash(scripthash)
@@ -20,10 +20,15 @@
 # ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+import functools
+import hashlib
+import mmap
 import os
 import threading
 import time
-from typing import Optional, Dict, Mapping, Sequence, TYPE_CHECKING
+from concurrent.futures import Executor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Dict, Mapping, Sequence, TYPE_CHECKING, List, Any
 
 from . import util
 from .bitcoin import hash_encode
@@ -95,6 +100,57 @@ def hash_raw_header(header: bytes) -> str:
 pow_hash_header = hash_header
 
 
+def verify_raw_headers(
+    data: bytes,
+    *,
+    start_height: int,
+    prev_hash: bytes,
+    target: int,
+    check_pow: bool,
+    expected_headers: Mapping[int, bytes] = None,
+    expected_hashes: Mapping[int, bytes] = None,
+) -> bytes:
+    """Verifies consecutive raw headers, as Blockchain.verify_header does,
+    but without deserializing them: hashes are compared as bytes, and the
+    proof of work as integers.
+    prev_hash is the hash of the header at start_height - 1, in internal
+    byte order (i.e. not reversed like the hex hashes elsewhere).
+    expected_headers and expected_hashes map heights to what we already know.
+    Returns the hash of the last header. Raises InvalidHeader.
+    This only depends on its arguments, so it can run in a worker process.
+    """
+    if len(data) % HEADER_SIZE != 0:
+        raise InvalidHeader(f'Invalid headers length: {len(data)}')
+    bits = Blockchain.target_to_bits(target)
+    sha256 = hashlib.sha256
+    data = memoryview(data)
+    for i in range(len(data) // HEADER_SIZE):
+        height = start_height + i
+        raw_header = data[i*HEADER_SIZE:(i+1)*HEADER_SIZE]
+        _hash = sha256(sha256(raw_header).digest()).digest()
+        if expected_headers and (expected := expected_headers.get(height)) is not None and expected != raw_header:
+            raise InvalidHeader("header mismatches with expected at height {}".format(height))
+        if expected_hashes and (expected := expected_hashes.get(height)) is not None and expected != _hash:
+            raise InvalidHeader("hash mismatches with expected: {} vs {}".format(
+                hash_encode(expected), hash_encode(_hash)))
+        if raw_header[4:36] != prev_hash:
+            raise InvalidHeader("prev hash mismatch: %s vs %s" % (
+                hash_encode(prev_hash), hash_encode(bytes(raw_header[4:36]))))
+        if check_pow:
+            header_bits = int.from_bytes(raw_header[72:76], byteorder='little')
+            if bits != header_bits:
+                raise InvalidHeader("bits mismatch: %s vs %s" % (bits, header_bits))
+            pow_hash_as_num = int.from_bytes(_hash, byteorder='little')
+            if pow_hash_as_num > target:
+                raise InvalidHeader(f"insufficient proof of work: {pow_hash_as_num} vs target {target}")
+        prev_hash = _hash
+    return prev_hash
+
+
+def _verify_raw_headers_kwargs(kwargs: Mapping[str, Any]) -> bytes:
+    return verify_raw_headers(**kwargs)
+
+
 # key: blockhash hex at forkpoint
 # the chain at some key is the best chain that includes the given hash
 blockchains = {}  # type: Dict[str, Blockchain]
@@ -206,6 +262,9 @@ class Blockchain(Logger):
         self._forkpoint_hash = forkpoint_hash  # blockhash at forkpoint. "first hash"
         self._prev_hash = prev_hash  # blockhash immediately before forkpoint
         self.lock = threading.RLock()
+        # read-only mapping of the headers file, created on first read.
+        # Access with self.lock. It is dropped whenever the file is written to.
+        self._mmap = None  # type: Optional[mmap.mmap]
         self.update_size()
 
     @property
@@ -302,6 +361,27 @@ class Blockchain(Logger):
     def update_size(self) -> None:
         p = self.path()
         self._size = os.path.getsize(p)//HEADER_SIZE if os.path.exists(p) else 0
+        self._unmap()  # file changed, remap on next read
+
+    @with_lock
+    def _get_mmap(self) -> Optional[mmap.mmap]:
+        if self._mmap is None:
+            if self._size == 0:
+                return None  # cannot map an empty file
+            filename = self.path()
+            self.assert_headers_file_available(filename)
+            with open(filename, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    @with_lock
+    def _unmap(self) -> None:
+        if self._mmap is None:
+            return
+        # note: we never hand out views into the mapping, so this cannot fail with BufferError,
+        #       and nothing can access the file through it after it gets truncated or replaced.
+        self._mmap.close()
+        self._mmap = None
 
     @classmethod
     def verify_header(cls, header: dict, prev_hash: str, target: int, expected_header_hash: str=None) -> None:
@@ -320,21 +400,48 @@ class Blockchain(Logger):
         if pow_hash_as_num > target:
             raise InvalidHeader(f"insufficient proof of work: {pow_hash_as_num} vs target {target}")
 
-    def verify_chunk(self, index: int, data: bytes) -> None:
+    def get_chunk_verification_params(
+        self,
+        index: int,
+        data: bytes,
+        *,
+        prev_chunk: bytes = None,
+    ) -> Dict[str, Any]:
+        """Returns the arguments for verify_raw_headers, to verify chunk `index`.
+        prev_chunk can be given as the raw headers of chunk index-1, if they are
+        not saved yet. Raises MissingHeader.
+        """
         num = len(data) // HEADER_SIZE
         start_height = index * CHUNK_SIZE
-        prev_hash = self.get_hash(start_height - 1)
-        target = self.get_target(index-1)
-        for i in range(num):
+        if prev_chunk is None:
+            prev_hash = bfh(self.get_hash(start_height - 1))[::-1]
+        else:
+            prev_hash = sha256d(prev_chunk[-HEADER_SIZE:])
+        target = self.get_target(index-1, chunk=prev_chunk)
+        existing_headers = self.read_headers(range(start_height, start_height + num))
+        expected_headers = {}
+        expected_hashes = {}
+        for i, raw_header in enumerate(existing_headers):
             height = start_height + i
-            try:
-                expected_header_hash = self.get_hash(height)
-            except MissingHeader:
-                expected_header_hash = None
-            raw_header = data[i*HEADER_SIZE : (i+1)*HEADER_SIZE]
-            header = deserialize_header(raw_header, index*CHUNK_SIZE + i)
-            self.verify_header(header, prev_hash, target, expected_header_hash)
-            prev_hash = hash_header(header)
+            if raw_header is not None:
+                expected_headers[height] = raw_header
+            else:
+                try:
+                    expected_hashes[height] = bfh(self.get_hash(height))[::-1]  # e.g. checkpoint
+                except MissingHeader:
+                    pass
+        return dict(
+            data=data,
+            start_height=start_height,
+            prev_hash=prev_hash,
+            target=target,
+            check_pow=not constants.net.TESTNET,
+            expected_headers=expected_headers,
+            expected_hashes=expected_hashes,
+        )
+
+    def verify_chunk(self, index: int, data: bytes) -> None:
+        verify_raw_headers(**self.get_chunk_verification_params(index, data))
 
     @with_lock
     def path(self):
@@ -423,6 +530,9 @@ class Blockchain(Logger):
         self._forkpoint_hash, parent._forkpoint_hash = parent._forkpoint_hash, hash_raw_header(parent_data[:HEADER_SIZE])
         self._prev_hash, parent._prev_hash = parent._prev_hash, self._prev_hash
         # parent's new name
+        # (the files must not be mapped while being replaced, e.g. on Windows)
+        self._unmap()
+        parent._unmap()
         os.replace(child_old_name, parent.path())
         self.update_size()
         parent.update_size()
@@ -448,6 +558,7 @@ class Blockchain(Logger):
     def write(self, data: bytes, offset: int, truncate: bool = True, *, fsync: bool = True) -> None:
         filename = self.path()
         self.assert_headers_file_available(filename)
+        self._unmap()  # we might truncate the file
         with open(filename, 'rb+') as f:
             if truncate and offset != self._size * HEADER_SIZE:
                 f.seek(offset)
@@ -479,17 +590,39 @@ class Blockchain(Logger):
         if height > self.height():
             return
         delta = height - self.forkpoint
-        name = self.path()
-        self.assert_headers_file_available(name)
-        with open(name, 'rb') as f:
-            f.seek(delta * HEADER_SIZE)
-            h = f.read(HEADER_SIZE)
-            if len(h) < HEADER_SIZE:
-                raise Exception('Expected to read a full header. This was only {} bytes'.format(len(h)))
+        h = self._get_mmap()[delta * HEADER_SIZE:(delta + 1) * HEADER_SIZE]
+        if len(h) < HEADER_SIZE:
+            raise Exception('Expected to read a full header. This was only {} bytes'.format(len(h)))
         if h == bytes([0])*HEADER_SIZE:
             return None
         return deserialize_header(h, height)
 
+    @with_lock
+    def read_headers(self, heights: range) -> List[Optional[bytes]]:
+        """Returns the raw headers at the given heights,
+        or None where we don't have the header.
+        """
+        assert heights.step > 0, heights
+        # the first heights might be stored by our parent
+        below_forkpoint = range(heights.start, min(heights.stop, self.forkpoint), heights.step)
+        if len(below_forkpoint) > 0 and self.parent is not None:
+            headers = self.parent.read_headers(below_forkpoint)
+        else:
+            headers = [None] * len(below_forkpoint)
+        m = self._get_mmap()
+        if m is None:
+            return headers + [None] * (len(heights) - len(below_forkpoint))
+        empty_header = bytes(HEADER_SIZE)
+        height_of_tip = self.height()
+        for height in heights[len(below_forkpoint):]:
+            if height > height_of_tip:
+                headers.append(None)
+                continue
+            delta = height - self.forkpoint
+            h = m[delta * HEADER_SIZE:(delta + 1) * HEADER_SIZE]  # copies: the file might get truncated later
+            headers.append(h if h != empty_header else None)
+        return headers
+
     def header_at_tip(self) -> Optional[dict]:
         """Return latest header."""
         height = self.height()
@@ -529,8 +662,9 @@ class Blockchain(Logger):
                 raise MissingHeader(height)
             return hash_header(header)
 
-    def get_target(self, index: int) -> int:
+    def get_target(self, index: int, *, chunk: bytes = None) -> int:
         # compute target from chunk x, used in chunk x+1
+        # the raw headers of chunk x can be given, if they are not saved yet
         if constants.net.TESTNET:
             return 0
         if index == -1:
@@ -539,8 +673,14 @@ class Blockchain(Logger):
             h, t = self.checkpoints[index]
             return t
         # new target
-        first = self.read_header(index * CHUNK_SIZE)
-        last = self.read_header((index+1) * CHUNK_SIZE - 1)
+        if chunk is not None:
+            if len(chunk) != CHUNK_SIZE * HEADER_SIZE:
+                raise MissingHeader()
+            first = deserialize_header(chunk[:HEADER_SIZE], index * CHUNK_SIZE)
+            last = deserialize_header(chunk[-HEADER_SIZE:], (index+1) * CHUNK_SIZE - 1)
+        else:
+            first = self.read_header(index * CHUNK_SIZE)
+            last = self.read_header((index+1) * CHUNK_SIZE - 1)
         if not first or not last:
             raise MissingHeader()
         bits = last.get('bits')
@@ -660,6 +800,46 @@ class Blockchain(Logger):
             self.logger.info(f'verify_chunk idx {idx} failed: {repr(e)}')
             return False
 
+    def connect_chunks(self, index0: int, chunks: Sequence[bytes], *, executor: Executor = None) -> int:
+        """Verifies and saves consecutive chunks, starting at chunk index0.
+        Returns the number of chunks connected; we stop at the first chunk that fails,
+        whatever the error. Raises BrokenProcessPool if the executor died,
+        so that the caller can retry without it.
+        A chunk can be verified given only the raw headers of the previous one,
+        so with an executor, all chunks are verified in parallel.
+        """
+        assert index0 >= 0, index0
+        params = []
+        for i, data in enumerate(chunks):
+            try:
+                params.append(self.get_chunk_verification_params(
+                    index0 + i, data, prev_chunk=chunks[i-1] if i > 0 else None))
+            except Exception as e:
+                self.logger.info(f'verify_chunk idx {index0 + i} failed: {repr(e)}')
+                break
+        futures = []
+        if executor is not None and len(params) > 1:
+            futures = [executor.submit(_verify_raw_headers_kwargs, p) for p in params]
+            results = (future.result for future in futures)
+        else:
+            results = (functools.partial(verify_raw_headers, **p) for p in params)
+        num_connected = 0
+        try:
+            for i, result in enumerate(results):
+                try:
+                    result()
+                    self.save_chunk(index0 + i, chunks[i])
+                except BrokenProcessPool:
+                    raise
+                except Exception as e:
+                    self.logger.info(f'verify_chunk idx {index0 + i} failed: {repr(e)}')
+                    break
+                num_connected += 1
+        finally:
+            for future in futures:
+                future.cancel()
+        return num_connected
+
     def get_checkpoints(self):
         # for each chunk, store the hash of the last block and the target after the chunk
         cp = []
@@ -27,6 +27,8 @@ import ipaddress
 import time
 import random
 import os
+import mmap
+import struct
 from collections import defaultdict
 from typing import Sequence, List, Tuple, Optional, Dict, NamedTuple, TYPE_CHECKING, Set
 import binascii
@@ -316,7 +318,7 @@ def get_mychannel_info(short_channel_id: ShortChannelID,
         return
     raw_msg, _ = chan.construct_channel_announcement_without_sigs()
     ci = ChannelInfo.from_raw_msg(raw_msg)
-    return ci._replace(capacity_sat=chan.constraints.capacity)
+    return ci._replace(capacity_sat=chan.get_capacity())
 
 
 def get_mychannel_policy(short_channel_id: bytes, node_id: bytes,
@@ -342,6 +344,23 @@ def get_mychannel_policy(short_channel_id: bytes, node_id: bytes,
 class _LoadDataAborted(Exception): pass
 
 
+class GraphListener:
+    """Interface for objects that get notified when the public graph in ChannelDB changes.
+    Methods may be called from any thread, so implementations should be cheap.
+    """
+
+    def on_channel_changed(self, short_channel_id: ShortChannelID) -> None:
+        """The channel was added or removed, or one of its policies changed."""
+        pass
+
+    def on_node_changed(self, node_id: bytes) -> None:
+        pass
+
+    def on_graph_reset(self) -> None:
+        """The graph was (re)loaded wholesale."""
+        pass
+
+
 create_channel_info = """
 CREATE TABLE IF NOT EXISTS channel_info (
 short_channel_id BLOB(8),
@@ -372,15 +391,165 @@ msg BLOB,
 PRIMARY KEY(node_id)
 )"""
 
+create_snapshot = """
+CREATE TABLE IF NOT EXISTS snapshot (
+token BLOB(32)
+)"""
+
+
+# Binary snapshot of the decoded gossip graph.
+# The file consists of a header, three arrays of fixed-width records (channels, policies, nodes),
+# and a blob area holding the variable-length fields (raw messages, aliases, feature bits).
+# Offsets stored in the records are relative to the start of the blob area.
+# The snapshot is only valid if its token matches the one stored in the sql db:
+# the token is deleted from the db on the first write after a snapshot was taken.
+SNAPSHOT_MAGIC = b'ELGOSSIP'
+SNAPSHOT_VERSION = 1
+_SNAPSHOT_HEADER = struct.Struct('>8sH32sIII')
+# scid, node1_id, node2_id, capacity_sat, raw_offset, raw_len
+_SNAPSHOT_CHANNEL = struct.Struct('>8s33s33sQQI')
+# key, cltv_delta, htlc_minimum_msat, htlc_maximum_msat, fee_base_msat, fee_proportional_millionths,
+# channel_flags, message_flags, timestamp, raw_offset, raw_len
+_SNAPSHOT_POLICY = struct.Struct('>41sHQQIIBBIQI')
+# node_id, timestamp, features_offset, features_len, alias_offset, alias_len, raw_offset, raw_len
+_SNAPSHOT_NODE = struct.Struct('>33sIQIQIQI')
+_SNAPSHOT_NONE = 2**64 - 1  # placeholder for Optional[int] fields
+
+
+class GossipSnapshotError(Exception): pass
+
+
+def write_gossip_snapshot(
+        path: str,
+        token: bytes,
+        channels: Dict[ShortChannelID, ChannelInfo],
+        policies: Dict[Tuple[bytes, ShortChannelID], Policy],
+        nodes: Dict[bytes, NodeInfo],
+) -> None:
+    """Serializes the in-memory graph into a snapshot file, atomically replacing the old one."""
+    blob = bytearray()
+
+    def add_to_blob(data: Optional[bytes]) -> Tuple[int, int]:
+        data = data or b''
+        offset = len(blob)
+        blob.extend(data)
+        return offset, len(data)
+
+    records = bytearray()
+    for ci in channels.values():
+        capacity_sat = ci.capacity_sat if ci.capacity_sat is not None else _SNAPSHOT_NONE
+        records += _SNAPSHOT_CHANNEL.pack(
+            ci.short_channel_id, ci.node1_id, ci.node2_id, capacity_sat, *add_to_blob(ci.raw))
+    for p in policies.values():
+        htlc_maximum_msat = p.htlc_maximum_msat if p.htlc_maximum_msat is not None else _SNAPSHOT_NONE
+        records += _SNAPSHOT_POLICY.pack(
+            p.key, p.cltv_delta, p.htlc_minimum_msat, htlc_maximum_msat, p.fee_base_msat,
+            p.fee_proportional_millionths, p.channel_flags, p.message_flags, p.timestamp,
+            *add_to_blob(p.raw))
+    for n in nodes.values():
+        features = n.features.to_bytes((n.features.bit_length() + 7) // 8, 'big')
+        records += _SNAPSHOT_NODE.pack(
+            n.node_id, n.timestamp, *add_to_blob(features), *add_to_blob(n.alias.encode('utf8')),
+            *add_to_blob(n.raw))
+    header = _SNAPSHOT_HEADER.pack(
+        SNAPSHOT_MAGIC, SNAPSHOT_VERSION, token, len(channels), len(policies), len(nodes))
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(header)
+        f.write(records)
+        f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def read_gossip_snapshot(path: str, token: bytes) -> Tuple[
+        Dict[ShortChannelID, ChannelInfo],
+        Dict[Tuple[bytes, ShortChannelID], Policy],
+        Dict[bytes, NodeInfo]]:
+    """Loads a snapshot written by write_gossip_snapshot.
+    Raises GossipSnapshotError if the file is missing, stale or malformed.
+    """
+    channels = {}  # type: Dict[ShortChannelID, ChannelInfo]
+    policies = {}  # type: Dict[Tuple[bytes, ShortChannelID], Policy]
+    nodes = {}  # type: Dict[bytes, NodeInfo]
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        raise GossipSnapshotError('no snapshot file')
+    with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        try:
+            magic, version, file_token, n_chans, n_policies, n_nodes = _SNAPSHOT_HEADER.unpack_from(mm, 0)
+        except struct.error:
+            raise GossipSnapshotError('truncated header')
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise GossipSnapshotError(f'unexpected magic/version: {magic!r}/{version}')
+        if file_token != token:
+            raise GossipSnapshotError('stale snapshot')
+        chans_start = _SNAPSHOT_HEADER.size
+        policies_start = chans_start + n_chans * _SNAPSHOT_CHANNEL.size
+        nodes_start = policies_start + n_policies * _SNAPSHOT_POLICY.size
+        blob_start = nodes_start + n_nodes * _SNAPSHOT_NODE.size
+        if blob_start > len(mm):
+            raise GossipSnapshotError('truncated records')
+
+        def from_blob(offset: int, length: int) -> bytes:
+            start = blob_start + offset
+            if start + length > len(mm):
+                raise GossipSnapshotError('truncated blob')
+            return mm[start:start + length]
+
+        for scid, node1_id, node2_id, capacity_sat, raw_offset, raw_len in \
+                _SNAPSHOT_CHANNEL.iter_unpack(mm[chans_start:policies_start]):
+            scid = ShortChannelID(scid)
+            channels[scid] = ChannelInfo(
+                short_channel_id=scid,
+                node1_id=node1_id,
+                node2_id=node2_id,
+                capacity_sat=capacity_sat if capacity_sat != _SNAPSHOT_NONE else None,
+                raw=from_blob(raw_offset, raw_len) or None,
+            )
+        for (key, cltv_delta, htlc_minimum_msat, htlc_maximum_msat, fee_base_msat, fee_proportional_millionths,
+             channel_flags, message_flags, timestamp, raw_offset, raw_len) in \
+                _SNAPSHOT_POLICY.iter_unpack(mm[policies_start:nodes_start]):
+            p = Policy(
+                key=key,
+                cltv_delta=cltv_delta,
+                htlc_minimum_msat=htlc_minimum_msat,
+                htlc_maximum_msat=htlc_maximum_msat if htlc_maximum_msat != _SNAPSHOT_NONE else None,
+                fee_base_msat=fee_base_msat,
+                fee_proportional_millionths=fee_proportional_millionths,
+                channel_flags=channel_flags,
+                message_flags=message_flags,
+                timestamp=timestamp,
+                raw=from_blob(raw_offset, raw_len) or None,
+            )
+            policies[(p.start_node, p.short_channel_id)] = p
+        for node_id, timestamp, features_offset, features_len, alias_offset, alias_len, raw_offset, raw_len in \
+                _SNAPSHOT_NODE.iter_unpack(mm[nodes_start:blob_start]):
+            nodes[node_id] = NodeInfo(
+                node_id=node_id,
+                features=int.from_bytes(from_blob(features_offset, features_len), 'big'),
+                timestamp=timestamp,
+                alias=from_blob(alias_offset, alias_len).decode('utf8'),
+                raw=from_blob(raw_offset, raw_len) or None,
+            )
+    return channels, policies, nodes
+
 
 class ChannelDB(SqlDB):
 
     NUM_MAX_RECENT_PEERS = 20
     PRIVATE_CHAN_UPD_CACHE_TTL_NORMAL = 600
     PRIVATE_CHAN_UPD_CACHE_TTL_SHORT = 120
+    SNAPSHOT_WRITE_INTERVAL = 3600  # seconds
 
     def __init__(self, network: 'Network'):
         path = self.get_file_path(network.config)
+        self.snapshot_path = path + '.snapshot'
+        # note: the following two are only accessed from the SQL thread
+        self._snapshot_dirty = False
+        self._snapshot_last_write = 0
         super().__init__(network.asyncio_loop, path, commit_interval=100)
         self.lock = threading.RLock()
         self.num_nodes = 0
@@ -404,6 +573,8 @@ class ChannelDB(SqlDB):
         self._chans_with_0_policies = set()  # type: Set[ShortChannelID]
         self._chans_with_1_policies = set()  # type: Set[ShortChannelID]
         self._chans_with_2_policies = set()  # type: Set[ShortChannelID]
+        # objects that mirror parts of the graph and want to hear about changes (e.g. lnrouter.RoutingGraph)
+        self._graph_listeners = []  # type: List[GraphListener]
 
         self.forwarding_lock = threading.RLock()
         self.fwd_channels = []  # type: List[GossipForwardingMessage]
@@ -418,6 +589,17 @@ class ChannelDB(SqlDB):
     def get_file_path(cls, config: 'SimpleConfig') -> str:
         return os.path.join(get_headers_dir(config), 'gossip_db')
 
+    def add_graph_listener(self, listener: 'GraphListener') -> None:
+        self._graph_listeners.append(listener)
+
+    def _notify_channel_changed(self, short_channel_id: ShortChannelID) -> None:
+        for listener in self._graph_listeners:
+            listener.on_channel_changed(short_channel_id)
+
+    def _notify_node_changed(self, node_id: bytes) -> None:
+        for listener in self._graph_listeners:
+            listener.on_node_changed(node_id)
+
     def update_counts(self):
         self.num_nodes = len(self._nodes)
         self.num_channels = len(self._channels)
@@ -506,6 +688,7 @@ class ChannelDB(SqlDB):
             self._channels_for_node[channel_info.node1_id].add(channel_info.short_channel_id)
             self._channels_for_node[channel_info.node2_id].add(channel_info.short_channel_id)
         self._update_num_policies_for_chan(channel_info.short_channel_id)
+        self._notify_channel_changed(channel_info.short_channel_id)
         if 'raw' in msg:
             self._db_save_channel(channel_info.short_channel_id, msg['raw'])
         with self.forwarding_lock:
@@ -574,6 +757,7 @@ class ChannelDB(SqlDB):
         with self.lock:
             self._policies[key] = policy
         self._update_num_policies_for_chan(short_channel_id)
+        self._notify_channel_changed(short_channel_id)
         if 'raw' in payload:
             self._db_save_policy(policy.key, payload['raw'])
         if old_policy and not self.policy_changed(old_policy, policy, verbose):
@@ -617,16 +801,80 @@ class ChannelDB(SqlDB):
         c.execute(create_address)
         c.execute(create_policy)
         c.execute(create_channel_info)
+        c.execute(create_snapshot)
+        self.conn.commit()
+
+    def _invalidate_snapshot(self):
+        # called from the SQL thread on every write that changes the graph
+        if self._snapshot_dirty:
+            return
+        c = self.conn.cursor()
+        c.execute("""DELETE FROM snapshot""")
+        self.conn.commit()
+        self._snapshot_dirty = True
+
+    def _write_snapshot(self):
+        if not self._snapshot_dirty or not self.data_loaded.is_set():
+            return
+        t0 = time.monotonic()
+        token = os.urandom(32)
+        with self.lock:
+            channels = self._channels.copy()
+            policies = self._policies.copy()
+            nodes = self._nodes.copy()
+        try:
+            write_gossip_snapshot(self.snapshot_path, token, channels, policies, nodes)
+        except OSError as e:
+            self.logger.warning(f"failed to write gossip snapshot: {e!r}")
+            return
+        c = self.conn.cursor()
+        c.execute("""DELETE FROM snapshot""")
+        c.execute("""INSERT INTO snapshot (token) VALUES (?)""", (token,))
         self.conn.commit()
+        self._snapshot_dirty = False
+        self._snapshot_last_write = time.monotonic()
+        self.logger.info(f"wrote gossip snapshot in {self._snapshot_last_write - t0:.2f} sec")
+
+    @sql
+    def write_snapshot(self, *, force: bool = False):
+        """Persists the in-memory graph so that the next load_data can skip parsing gossip.
+        Does nothing if the db has not changed, or if we wrote recently (unless force is set).
+        """
+        if not force and time.monotonic() - self._snapshot_last_write < self.SNAPSHOT_WRITE_INTERVAL:
+            return
+        self._write_snapshot()
+
+    def before_close(self):
+        self._write_snapshot()
+
+    def _load_snapshot(self) -> bool:
+        c = self.conn.cursor()
+        c.execute("""SELECT token FROM snapshot""")
+        row = c.fetchone()
+        if row is None:
+            self.logger.info("no valid gossip snapshot")
+            return False
+        try:
+            channels, policies, nodes = read_gossip_snapshot(self.snapshot_path, row[0])
+        except (GossipSnapshotError, OSError, ValueError, struct.error) as e:
+            self.logger.info(f"cannot use gossip snapshot: {e!r}")
+            return False
+        self._channels.update(channels)
+        self._policies.update(policies)
+        self._nodes.update(nodes)
+        self._snapshot_last_write = time.monotonic()
+        return True
 
     @sql
     def _db_save_policy(self, key: bytes, msg: bytes):
         # 'msg' is a 'channel_update' message
+        self._invalidate_snapshot()
         c = self.conn.cursor()
         c.execute("""REPLACE INTO policy (key, msg) VALUES (?,?)""", [key, msg])
 
     @sql
     def _db_delete_policy(self, node_id: bytes, short_channel_id: ShortChannelID):
+        self._invalidate_snapshot()
         key = short_channel_id + node_id
         c = self.conn.cursor()
         c.execute("""DELETE FROM policy WHERE key=?""", (key,))
@@ -634,17 +882,20 @@ class ChannelDB(SqlDB):
     @sql
     def _db_save_channel(self, short_channel_id: ShortChannelID, msg: bytes):
         # 'msg' is a 'channel_announcement' message
+        self._invalidate_snapshot()
         c = self.conn.cursor()
         c.execute("REPLACE INTO channel_info (short_channel_id, msg) VALUES (?,?)", [short_channel_id, msg])
 
     @sql
     def _db_delete_channel(self, short_channel_id: ShortChannelID):
+        self._invalidate_snapshot()
         c = self.conn.cursor()
         c.execute("""DELETE FROM channel_info WHERE short_channel_id=?""", (short_channel_id,))
 
     @sql
     def _db_save_node_info(self, node_id: bytes, msg: bytes):
         # 'msg' is a 'node_announcement' message
+        self._invalidate_snapshot()
         c = self.conn.cursor()
         c.execute("REPLACE INTO node_info (node_id, msg) VALUES (?,?)", [node_id, msg])
 
@@ -713,6 +964,7 @@ class ChannelDB(SqlDB):
             # save
             with self.lock:
                 self._nodes[node_id] = node_info
+            self._notify_node_changed(node_id)
             if 'raw' in msg_payload:
                 self._db_save_node_info(node_id, msg_payload['raw'])
             with self.lock:
@@ -742,6 +994,7 @@ class ChannelDB(SqlDB):
                     self._policies.pop(key)
                 self._db_delete_policy(*key)
                 self._update_num_policies_for_chan(scid)
+                self._notify_channel_changed(scid)
             self.update_counts()
             self.logger.info(f'Deleting {len(old_policies)} old policies')
 
@@ -805,6 +1058,7 @@ class ChannelDB(SqlDB):
                 self._channels_for_node[channel_info.node1_id].remove(channel_info.short_channel_id)
                 self._channels_for_node[channel_info.node2_id].remove(channel_info.short_channel_id)
         self._update_num_policies_for_chan(short_channel_id)
+        self._notify_channel_changed(short_channel_id)
         # delete from database
         self._db_delete_channel(short_channel_id)
 
@@ -832,7 +1086,8 @@ class ChannelDB(SqlDB):
         if self.data_loaded.is_set():
             return
 
-        # Note: this method takes several seconds... mostly due to lnmsg.decode_msg being slow.
+        # Note: the slow path takes several seconds... mostly due to lnmsg.decode_msg being slow.
+        #       If a valid snapshot of the decoded graph exists, we use that instead.
         def maybe_abort():
             if self.stopping:
                 self.logger.info("load_data() was asked to stop. exiting early.")
@@ -855,6 +1110,28 @@ class ChannelDB(SqlDB):
             return newest_ts
         sorted_node_ids = sorted(self._addresses.keys(), key=newest_ts_for_node_id, reverse=True)
         self._recent_peers = sorted_node_ids[:self.NUM_MAX_RECENT_PEERS]
+        if self._load_snapshot():
+            self.logger.info("loaded gossip from snapshot")
+        else:
+            self._load_data_from_messages(maybe_abort)
+            self._snapshot_dirty = True
+        for channel_info in self._channels.values():
+            self._channels_for_node[channel_info.node1_id].add(channel_info.short_channel_id)
+            self._channels_for_node[channel_info.node2_id].add(channel_info.short_channel_id)
+            self._update_num_policies_for_chan(channel_info.short_channel_id)
+        self.logger.info(f'data loaded. {len(self._channels)} chans. {len(self._policies)} policies. '
+                         f'{len(self._channels_for_node)} nodes.')
+        self.update_counts()
+        (nchans_with_0p, nchans_with_1p, nchans_with_2p) = self.get_num_channels_partitioned_by_policy_count()
+        self.logger.info(f'num_channels_partitioned_by_policy_count. '
+                         f'0p: {nchans_with_0p}, 1p: {nchans_with_1p}, 2p: {nchans_with_2p}')
+        for listener in self._graph_listeners:
+            listener.on_graph_reset()
+        self.asyncio_loop.call_soon_threadsafe(self.data_loaded.set)
+        util.trigger_callback('gossip_db_loaded')
+
+    def _load_data_from_messages(self, maybe_abort):
+        c = self.conn.cursor()
         c.execute("""SELECT * FROM channel_info""")
         for short_channel_id, msg in c:
             maybe_abort()
@@ -884,18 +1161,6 @@ class ChannelDB(SqlDB):
             except FailedToParseMsg:
                 continue
             self._policies[(p.start_node, p.short_channel_id)] = p
-        for channel_info in self._channels.values():
-            self._channels_for_node[channel_info.node1_id].add(channel_info.short_channel_id)
-            self._channels_for_node[channel_info.node2_id].add(channel_info.short_channel_id)
-            self._update_num_policies_for_chan(channel_info.short_channel_id)
-        self.logger.info(f'data loaded. {len(self._channels)} chans. {len(self._policies)} policies. '
-                         f'{len(self._channels_for_node)} nodes.')
-        self.update_counts()
-        (nchans_with_0p, nchans_with_1p, nchans_with_2p) = self.get_num_channels_partitioned_by_policy_count()
-        self.logger.info(f'num_channels_partitioned_by_policy_count. '
-                         f'0p: {nchans_with_0p}, 1p: {nchans_with_1p}, 2p: {nchans_with_2p}')
-        self.asyncio_loop.call_soon_threadsafe(self.data_loaded.set)
-        util.trigger_callback('gossip_db_loaded')
 
     def _update_num_policies_for_chan(self, short_channel_id: ShortChannelID) -> None:
         channel_info = self.get_channel_info(short_channel_id)
@@ -1181,3 +1446,48 @@ class ChannelDB(SqlDB):
         # need to use json_normalize otherwise json encoding in rpc server fails
         graph = json_normalize(graph)
         return graph
+
+
+class ChannelDBSnapshot:
+    """A read-only copy of the in-memory graph of a ChannelDB.
+
+    Raw gossip messages are left out, and the object can be pickled, so that
+    path finding can be done in another process. It implements the read-only
+    accessors of ChannelDB that LNPathFinder uses.
+    """
+
+    def __init__(self, channel_db: ChannelDB):
+        if not channel_db.data_loaded.is_set():
+            raise ChannelDBNotLoaded("channelDB data not loaded yet!")
+        with channel_db.lock:
+            self._channels = {k: v._replace(raw=None) for k, v in channel_db._channels.items()}
+            self._policies = {k: v._replace(raw=None) for k, v in channel_db._policies.items()}
+            self._nodes = {k: v._replace(raw=None) for k, v in channel_db._nodes.items()}
+            self._channels_for_node = {k: set(v) for k, v in channel_db._channels_for_node.items()}
+            self._channel_updates_for_private_channels = dict(channel_db._channel_updates_for_private_channels)
+        self._init_runtime_state()
+
+    def _init_runtime_state(self):
+        self.lock = threading.RLock()
+        self.data_loaded = threading.Event()
+        self.data_loaded.set()
+        self._graph_listeners = []  # type: List[GraphListener]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ('lock', 'data_loaded', '_graph_listeners'):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_runtime_state()
+
+    # the snapshot never changes, so listeners are never notified
+    add_graph_listener = ChannelDB.add_graph_listener
+    get_policy_for_node = ChannelDB.get_policy_for_node
+    get_channel_info = ChannelDB.get_channel_info
+    get_channels_for_node = ChannelDB.get_channels_for_node
+    get_endnodes_for_chan = ChannelDB.get_endnodes_for_chan
+    get_node_info_for_node_id = ChannelDB.get_node_info_for_node_id
+    _get_channel_update_for_private_channel = ChannelDB._get_channel_update_for_private_channel
@@ -22,9 +22,12 @@
 # ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+import itertools
+import time
 from collections import defaultdict
 from math import floor, log10
-from typing import NamedTuple, List, Callable, Sequence, Dict, Tuple, Mapping, Type, TYPE_CHECKING
+from typing import (NamedTuple, List, Callable, Sequence, Dict, Tuple, Mapping, MutableMapping, Type, Optional,
+                    TYPE_CHECKING)
 from decimal import Decimal
 
 from .bitcoin import sha256, COIN, is_address
@@ -86,8 +89,85 @@ class Bucket(NamedTuple):
 
 class ScoredCandidate(NamedTuple):
     penalty: float
-    tx: PartialTransaction
     buckets: List[Bucket]
+    change: List[PartialTxOutput]  # change outputs of the tx spending the buckets
+
+
+class SelectionParams(NamedTuple):
+    input_value: int                     # value of the fixed inputs. in satoshis
+    spent_amount: int                    # value the selected coins need to cover. in satoshis
+    base_weight: int                     # weight of the tx without selected coins and without change
+    change_output_weight: Optional[int]  # weight of a single change output, if known in advance
+    dust_threshold: int
+    fee_estimator_w: Callable[[int], int]
+
+
+def branch_and_bound(
+    values: Sequence[int],
+    *,
+    target: int,
+    window: int,
+    is_match: Callable[[List[int]], bool] = None,
+    max_tries: int = 100_000,
+    deadline: float = None,
+) -> Optional[List[int]]:
+    '''Depth-first search for a subset of values whose sum is in [target, target + window].
+    Returns the indices (into values) of the subset with the smallest excess found,
+    or None if there is none, or the search ran out of tries/time before finding one.
+    values are expected to be positive. is_match can be used to reject candidates
+    based on more precise criteria. deadline is compared to time.monotonic().
+    '''
+    order = sorted(range(len(values)), key=lambda idx: values[idx], reverse=True)
+    vals = [values[idx] for idx in order]
+    n = len(vals)
+    # remaining[i] is the sum of vals[i:], an upper bound of what can still be added
+    remaining = [0] * (n + 1)
+    for i in reversed(range(n)):
+        remaining[i] = remaining[i + 1] + vals[i]
+    if remaining[0] < target:
+        return None
+    best = None
+    best_excess = None
+    selected = []  # type: List[int]  # positions in vals, increasing
+    curr_sum = 0
+    i = 0
+    for tries in range(max_tries):
+        if deadline is not None and tries % 256 == 0 and time.monotonic() > deadline:
+            break
+        if curr_sum + remaining[i] < target or curr_sum > target + window:
+            backtrack = True
+        elif curr_sum >= target:
+            backtrack = True
+            excess = curr_sum - target
+            if best_excess is None or excess < best_excess:
+                candidate = [order[pos] for pos in selected]
+                if is_match is None or is_match(candidate):
+                    best, best_excess = candidate, excess
+                    if excess == 0:
+                        break
+        else:
+            backtrack = False
+        if backtrack:
+            if not selected:
+                break  # search space exhausted
+            # exclude the last included value, and continue with the next one
+            pos = selected.pop()
+            curr_sum -= vals[pos]
+            i = pos + 1
+            # skip equal values: excluding one of them and including the next
+            # would explore the same sums again
+            while i < n and vals[i] == vals[pos]:
+                i += 1
+        else:
+            selected.append(i)
+            curr_sum += vals[i]
+            i += 1
+    return best
+
+
+def _bip69_input_sort_key(txin: PartialTxInput):
+    # same as in PartialTransaction.BIP69_sort
+    return txin.prevout.txid, txin.prevout.out_idx
 
 
 def strip_unneeded(bkts: List[Bucket], sufficient_funds: Callable) -> List[Bucket]:
@@ -106,9 +186,26 @@ def strip_unneeded(bkts: List[Bucket], sufficient_funds: Callable) -> List[Bucke
 
 class CoinChooserBase(Logger):
 
-    def __init__(self, *, enable_output_value_rounding: bool):
+    def __init__(
+        self,
+        *,
+        enable_output_value_rounding: bool,
+        input_weight_cache: MutableMapping[Tuple[str, str], Tuple[int, bool]] = None,
+    ):
         Logger.__init__(self)
         self.enable_output_value_rounding = enable_output_value_rounding
+        # (prevout, address) -> (weight in a non-segwit tx, is_segwit).
+        # Can be shared between coin choosers, to avoid estimating the size of
+        # the same coins again e.g. when the fee rate changes.
+        self._input_weight_cache = input_weight_cache if input_weight_cache is not None else {}
+
+    def _get_input_weight(self, coin: PartialTxInput) -> Tuple[int, bool]:
+        key = (coin.prevout.to_str(), coin.address)
+        if (cached := self._input_weight_cache.get(key)) is None:
+            is_segwit = coin.is_segwit(guess_for_address=True)
+            weight = Transaction.estimated_input_weight(coin, False)
+            cached = self._input_weight_cache[key] = (weight, is_segwit)
+        return cached
 
     def keys(self, coins: Sequence[PartialTxInput]) -> Sequence[str]:
         raise NotImplementedError
@@ -128,11 +225,12 @@ class CoinChooserBase(Logger):
         constant_fee = fee_estimator_vb(2000) == fee_estimator_vb(200)
 
         def make_Bucket(desc: str, coins: List[PartialTxInput]):
-            witness = any(coin.is_segwit(guess_for_address=True) for coin in coins)
+            weights = [self._get_input_weight(coin) for coin in coins]
+            witness = any(is_segwit for _, is_segwit in weights)
             # note that we're guessing whether the tx uses segwit based
-            # on this single bucket
-            weight = sum(Transaction.estimated_input_weight(coin, witness)
-                         for coin in coins)
+            # on this single bucket.
+            # In a segwit tx, non-segwit inputs have an empty witness (1 wu).
+            weight = sum(weight + (witness and not is_segwit) for weight, is_segwit in weights)
             value = sum(coin.value_sats() for coin in coins)
             min_height = min(coin.block_height for coin in coins)
             assert min_height is not None
@@ -160,20 +258,22 @@ class CoinChooserBase(Logger):
         self,
         base_tx: Transaction,
         *,
-        tx_from_buckets: Callable[[List[Bucket]], Tuple[PartialTransaction, List[PartialTxOutput]]],
+        change_from_buckets: Callable[[List[Bucket]], List[PartialTxOutput]],
     ) -> Callable[[List[Bucket]], ScoredCandidate]:
         raise NotImplementedError
 
-    def _change_amounts(self, tx: PartialTransaction, count: int, fee_estimator_numchange) -> List[int]:
+    def _change_amounts(self, *, output_amounts: Sequence[int], fee: int, count: int,
+                        fee_estimator_numchange) -> List[int]:
+        """fee is the fee of the tx without change, i.e. the amount to be split."""
         # Break change up if bigger than max_change
-        output_amounts = [o.value for o in tx.outputs()]
+        output_amounts = list(output_amounts)
         # Don't split change of less than 0.02 BTC
         max_change = max([0.02 * COIN] + output_amounts) * 1.25
 
         # Use N change outputs
         for n in range(1, count + 1):
             # How much is left if we add this many change outputs?
-            change_amount = max(0, tx.get_fee() - fee_estimator_numchange(n))
+            change_amount = max(0, fee - fee_estimator_numchange(n))
             if change_amount // n <= max_change:
                 break
 
@@ -221,9 +321,11 @@ class CoinChooserBase(Logger):
 
         return amounts
 
-    def _change_outputs(self, tx: PartialTransaction, change_addrs, fee_estimator_numchange,
-                        dust_threshold) -> List[PartialTxOutput]:
-        amounts = self._change_amounts(tx, len(change_addrs), fee_estimator_numchange)
+    def _change_outputs(self, *, output_amounts: Sequence[int], fee: int, change_addrs,
+                        fee_estimator_numchange, dust_threshold) -> List[PartialTxOutput]:
+        amounts = self._change_amounts(
+            output_amounts=output_amounts, fee=fee, count=len(change_addrs),
+            fee_estimator_numchange=fee_estimator_numchange)
         assert min(amounts) >= 0
         assert len(change_addrs) >= len(amounts)
         assert all([isinstance(amt, int) for amt in amounts])
@@ -236,33 +338,52 @@ class CoinChooserBase(Logger):
             c.is_change = True
         return change
 
-    def _construct_tx_from_selected_buckets(
+    def _change_for_selected_buckets(
             self, *, buckets: Sequence[Bucket],
-            base_tx: PartialTransaction, change_addrs,
+            base_inputs: Sequence[PartialTxInput],
+            output_amounts: Sequence[int],
+            input_value: int,
+            change_addrs,
+            change_output_weight: Optional[int],
             fee_estimator_w, dust_threshold,
             base_weight,
             BIP69_sort: bool,
-    ) -> Tuple[PartialTransaction, List[PartialTxOutput]]:
-        # make a copy of base_tx so it won't get mutated
-        tx = PartialTransaction.from_io(base_tx.inputs()[:], base_tx.outputs()[:], BIP69_sort=BIP69_sort)
-
-        tx.add_inputs([coin for b in buckets for coin in b.coins], BIP69_sort=BIP69_sort)
+    ) -> List[PartialTxOutput]:
+        """Returns the change outputs of the tx that would spend the given buckets.
+        Only uses the precomputed bucket values and weights, the tx is not constructed.
+        """
         tx_weight = self._get_tx_weight(buckets, base_weight=base_weight)
 
         # change is sent back to sending address unless specified
         if not change_addrs:
-            change_addrs = [tx.inputs()[0].address]
+            inputs = itertools.chain(base_inputs, (coin for b in buckets for coin in b.coins))
+            first_input = min(inputs, key=_bip69_input_sort_key) if BIP69_sort else next(inputs)
+            change_addrs = [first_input.address]
             # note: this is not necessarily the final "first input address"
             # because the inputs had not been sorted at this point
             assert is_address(change_addrs[0])
+            change_output_weight = None
+        if change_output_weight is None:
+            change_output_weight = 4 * Transaction.estimated_output_size_for_address(change_addrs[0])
 
         # This takes a count of change outputs and returns a tx fee
-        output_weight = 4 * Transaction.estimated_output_size_for_address(change_addrs[0])
-        fee_estimator_numchange = lambda count: fee_estimator_w(tx_weight + count * output_weight)
-        change = self._change_outputs(tx, change_addrs, fee_estimator_numchange, dust_threshold)
-        tx.add_outputs(change, BIP69_sort=BIP69_sort)
+        fee_estimator_numchange = lambda count: fee_estimator_w(tx_weight + count * change_output_weight)
+        fee = input_value + sum(bucket.value for bucket in buckets) - sum(output_amounts)
+        return self._change_outputs(
+            output_amounts=output_amounts, fee=fee, change_addrs=change_addrs,
+            fee_estimator_numchange=fee_estimator_numchange, dust_threshold=dust_threshold)
 
-        return tx, change
+    def _construct_tx_from_selected_buckets(
+            self, *, buckets: Sequence[Bucket],
+            change: Sequence[PartialTxOutput],
+            base_tx: PartialTransaction,
+            BIP69_sort: bool,
+    ) -> PartialTransaction:
+        # make a copy of base_tx so it won't get mutated
+        tx = PartialTransaction.from_io(base_tx.inputs()[:], base_tx.outputs()[:], BIP69_sort=BIP69_sort)
+        tx.add_inputs([coin for b in buckets for coin in b.coins], BIP69_sort=BIP69_sort)
+        tx.add_outputs(list(change), BIP69_sort=BIP69_sort)
+        return tx
 
     def _get_tx_weight(self, buckets: Sequence[Bucket], *, base_weight: int) -> int:
         """Given a collection of buckets, return the total weight of the
@@ -346,16 +467,33 @@ class CoinChooserBase(Logger):
             total_weight = self._get_tx_weight(buckets, base_weight=base_weight)
             return total_input >= spent_amount + fee_estimator_w(total_weight)
 
-        def tx_from_buckets(buckets):
-            return self._construct_tx_from_selected_buckets(
+        if change_addrs:
+            change_output_weight = 4 * Transaction.estimated_output_size_for_address(change_addrs[0])
+        else:
+            change_output_weight = None  # change goes to the address of the first input
+        output_amounts = [o.value for o in base_tx.outputs()]
+
+        def change_from_buckets(buckets):
+            return self._change_for_selected_buckets(
                 buckets=buckets,
-                base_tx=base_tx,
+                base_inputs=base_tx.inputs(),
+                output_amounts=output_amounts,
+                input_value=input_value,
                 change_addrs=change_addrs,
+                change_output_weight=change_output_weight,
                 fee_estimator_w=fee_estimator_w,
                 dust_threshold=dust_threshold,
                 base_weight=base_weight,
                 BIP69_sort=BIP69_sort,
             )
+        params = SelectionParams(
+            input_value=input_value,
+            spent_amount=spent_amount,
+            base_weight=base_weight,
+            change_output_weight=change_output_weight,
+            dust_threshold=dust_threshold,
+            fee_estimator_w=fee_estimator_w,
+        )
         # Collect the coins into buckets
         all_buckets = self.bucketize_coins(coins, fee_estimator_vb=fee_estimator_vb)
         # Filter some buckets out. Only keep those that have positive effective value.
@@ -365,8 +503,14 @@ class CoinChooserBase(Logger):
         all_buckets = list(filter(lambda b: b.effective_value > 0, all_buckets))
         # Choose a subset of the buckets
         scored_candidate = self.choose_buckets(all_buckets, sufficient_funds,
-                                               self.penalty_func(base_tx, tx_from_buckets=tx_from_buckets))
-        tx = scored_candidate.tx
+                                               self.penalty_func(base_tx, change_from_buckets=change_from_buckets),
+                                               params=params)
+        tx = self._construct_tx_from_selected_buckets(
+            buckets=scored_candidate.buckets,
+            change=scored_candidate.change,
+            base_tx=base_tx,
+            BIP69_sort=BIP69_sort,
+        )
 
         self.logger.info(f"using {len(tx.inputs())} inputs")
         self.logger.info(f"using buckets: {[bucket.desc for bucket in scored_candidate.buckets]}")
@@ -375,8 +519,9 @@ class CoinChooserBase(Logger):
 
     def choose_buckets(self, buckets: List[Bucket],
                        sufficient_funds: Callable,
-                       penalty_func: Callable[[List[Bucket]], ScoredCandidate]) -> ScoredCandidate:
-        raise NotImplemented('To be subclassed')
+                       penalty_func: Callable[[List[Bucket]], ScoredCandidate],
+                       *, params: SelectionParams = None) -> ScoredCandidate:
+        raise NotImplementedError('To be subclassed')
 
 
 class CoinChooserRandom(CoinChooserBase):
@@ -469,7 +614,7 @@ class CoinChooserRandom(CoinChooserBase):
         candidates = [(already_selected_buckets + c) for c in candidates]
         return [strip_unneeded(c, sufficient_funds) for c in candidates]
 
-    def choose_buckets(self, buckets, sufficient_funds, penalty_func):
+    def choose_buckets(self, buckets, sufficient_funds, penalty_func, *, params=None):
         candidates = self.bucket_candidates_prefer_confirmed(buckets, sufficient_funds)
         scored_candidates = [penalty_func(cand) for cand in candidates]
         winner = min(scored_candidates, key=lambda x: x.penalty)
@@ -493,7 +638,7 @@ class CoinChooserPrivacy(CoinChooserRandom):
     def keys(self, coins):
         return [coin.scriptpubkey.hex() for coin in coins]
 
-    def penalty_func(self, base_tx, *, tx_from_buckets):
+    def penalty_func(self, base_tx, *, change_from_buckets):
         if _outputs := base_tx.outputs():
             min_change = min(o.value for o in _outputs) * 0.75
             max_change = max(o.value for o in _outputs) * 1.33
@@ -504,7 +649,7 @@ class CoinChooserPrivacy(CoinChooserRandom):
         def penalty(buckets: List[Bucket]) -> ScoredCandidate:
             # Penalize using many buckets (~inputs)
             badness = len(buckets) - 1
-            tx, change_outputs = tx_from_buckets(buckets)
+            change_outputs = change_from_buckets(buckets)
             change = sum(o.value for o in change_outputs)
             # Penalize change not roughly in output range
             if change == 0:
@@ -518,13 +663,91 @@ class CoinChooserPrivacy(CoinChooserRandom):
                 badness += (change - max_change) / (max_change + 10000)
                 # Penalize large change; 5 BTC excess ~= using 1 more input
                 badness += change / (COIN * 5)
-            return ScoredCandidate(badness, tx, buckets)
+            return ScoredCandidate(badness, buckets, change_outputs)
 
         return penalty
 
 
+class CoinChooserBnB(CoinChooserPrivacy):
+    """Looks for a transaction without change first.
+    Runs a branch-and-bound search over the effective values of the buckets,
+    for a selection that pays for the outputs and the fee, with an excess too
+    small to be worth a change output. During the search, weights and fees are
+    computed arithmetically, no transaction is built.
+    Buckets are the same as for CoinChooserPrivacy, and confirmed coins are
+    preferred in the same way. If no selection is found within the search
+    budget, the choice is left to CoinChooserPrivacy.
+    """
+
+    MAX_TRIES = 100_000
+    TIME_BUDGET = 0.5  # in seconds, for all attempts together
+
+    def choose_buckets(self, buckets, sufficient_funds, penalty_func, *, params=None):
+        if params is not None and params.change_output_weight is not None:
+            selected = self._choose_buckets_changeless(buckets, sufficient_funds, params)
+            if selected is not None:
+                scored_candidate = penalty_func(selected)
+                if not scored_candidate.change:
+                    self.logger.info(f"branch-and-bound: found changeless selection of {len(selected)} buckets")
+                    return scored_candidate
+            self.logger.info("branch-and-bound: no changeless selection found")
+        return super().choose_buckets(buckets, sufficient_funds, penalty_func, params=params)
+
+    def _choose_buckets_changeless(
+        self,
+        buckets: List[Bucket],
+        sufficient_funds: Callable,
+        params: SelectionParams,
+    ) -> Optional[List[Bucket]]:
+        fee_estimator_w = params.fee_estimator_w
+
+        def is_match(selected: List[Bucket]) -> bool:
+            bucket_value_sum = sum(bucket.value for bucket in selected)
+            if not sufficient_funds(selected, bucket_value_sum=bucket_value_sum):
+                return False
+            # same computation as in _change_amounts, for a single change output
+            tx_weight = self._get_tx_weight(selected, base_weight=params.base_weight)
+            fee = fee_estimator_w(tx_weight)
+            excess = params.input_value + bucket_value_sum - params.spent_amount - fee
+            change_amount = excess - (fee_estimator_w(tx_weight + params.change_output_weight) - fee)
+            return change_amount < params.dust_threshold
+
+        # the effective values of buckets already account for their own weight
+        target = params.spent_amount - params.input_value + fee_estimator_w(params.base_weight)
+        window = fee_estimator_w(params.base_weight + params.change_output_weight) \
+            - fee_estimator_w(params.base_weight) + params.dust_threshold
+        deadline = time.monotonic() + self.TIME_BUDGET
+        # prefer confirmed coins, as in bucket_candidates_prefer_confirmed
+        conf_buckets = [bkt for bkt in buckets if bkt.min_height > 0]
+        unconf_buckets = [bkt for bkt in buckets if bkt.min_height == 0]
+        other_buckets = [bkt for bkt in buckets if bkt.min_height < 0]
+        already_selected = []  # type: List[Bucket]
+        for bkts_choose_from in (conf_buckets, unconf_buckets, other_buckets):
+            if not bkts_choose_from:
+                continue
+            indices = branch_and_bound(
+                [bkt.effective_value for bkt in bkts_choose_from],
+                target=target - sum(bkt.effective_value for bkt in already_selected),
+                window=window,
+                is_match=lambda idxs, sel=tuple(already_selected), bkts=bkts_choose_from: (
+                    is_match(list(sel) + [bkts[idx] for idx in idxs])),
+                max_tries=self.MAX_TRIES,
+                deadline=deadline,
+            )
+            if indices is not None:
+                return already_selected + [bkts_choose_from[idx] for idx in indices]
+            already_selected += bkts_choose_from
+            # only move on to less preferred coins if these are not enough even with change
+            if sufficient_funds(already_selected, bucket_value_sum=sum(bkt.value for bkt in already_selected)):
+                break
+            if time.monotonic() > deadline:
+                break
+        return None
+
+
 COIN_CHOOSERS = {
     'Privacy': CoinChooserPrivacy,
+    'BranchAndBound': CoinChooserBnB,
 }  # type: Mapping[str, Type[CoinChooserBase]]
 
 
@@ -535,7 +758,11 @@ def get_name(config: 'SimpleConfig') -> str:
     return kind
 
 
-def get_coin_chooser(config: 'SimpleConfig') -> CoinChooserBase:
+def get_coin_chooser(
+    config: 'SimpleConfig',
+    *,
+    input_weight_cache: MutableMapping[Tuple[str, str], Tuple[int, bool]] = None,
+) -> CoinChooserBase:
     klass = COIN_CHOOSERS[get_name(config)]
     # note: we enable enable_output_value_rounding by default as
     #       - for sacrificing a few satoshis
@@ -544,5 +771,6 @@ def get_coin_chooser(config: 'SimpleConfig') -> CoinChooserBase:
     #         (trying to counter the heuristic that "whole integer sat/byte feerates" are common)
     coinchooser = klass(
         enable_output_value_rounding=config.WALLET_COIN_CHOOSER_OUTPUT_ROUNDING,
+        input_weight_cache=input_weight_cache,
     )
     return coinchooser
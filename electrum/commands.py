@@ -264,6 +264,9 @@ class Commands(Logger):
             'version': ELECTRUM_VERSION,
             'fee_estimates': self.network.fee_estimates.get_data()
         }
+        if self.network.path_finder:
+            response['route_cache'] = self.network.path_finder.route_cache.get_stats()
+        response['request_concurrency'] = self.network.get_request_concurrency_stats()
         return response
 
     @command('n')
@@ -49,6 +49,8 @@ from .util import (
 from .wallet import Wallet, Abstract_Wallet
 from .storage import WalletStorage
 from .wallet_db import WalletDB, WalletUnfinished
+from .wallet_sql_db import SqlWalletDB
+from .pubkey_cache import get_pubkey_cache_path
 from .commands import known_commands, Commands
 from .simple_config import SimpleConfig
 from .exchange_rate import FxThread
@@ -552,7 +554,8 @@ class Daemon(Logger):
                 raise InvalidPassword('No password given')
             storage.decrypt(password)
         # read data, pass it to db
-        db = WalletDB(storage.read(), storage=storage, upgrade=upgrade)
+        db_class = SqlWalletDB if config.WALLET_SQL_HISTORY else WalletDB
+        db = db_class(storage.read(), storage=storage, upgrade=upgrade, lazy_load=config.WALLET_LAZY_LOAD)
         if db.get_action():
             raise WalletUnfinished(db)
         wallet = Wallet(db, config=config)
@@ -579,6 +582,9 @@ class Daemon(Logger):
         self.stop_wallet(path)
         if os.path.exists(path):
             os.unlink(path)
+            for sidecar_path in (SqlWalletDB.get_sql_path(path), get_pubkey_cache_path(path)):
+                if os.path.exists(sidecar_path):
+                    os.unlink(sidecar_path)
             self.update_recently_opened_wallets(path, remove=True)
             if self.config.CURRENT_WALLET == path:
                 self.config.CURRENT_WALLET = None
@@ -591,6 +597,9 @@ class Daemon(Logger):
         if os.path.exists(new_path):
             raise ValueError("Wallet file already exists")
         os.rename(old_path, new_path)
+        for get_sidecar_path in (SqlWalletDB.get_sql_path, get_pubkey_cache_path):
+            if os.path.exists(get_sidecar_path(old_path)):
+                os.rename(get_sidecar_path(old_path), get_sidecar_path(new_path))
         self.logger.debug(f'renamed wallet: {old_path} -> {new_path}')
         self.update_recently_opened_wallets(old_path, remove=True)
         if self.config.CURRENT_WALLET == old_path:
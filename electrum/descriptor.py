@@ -16,6 +16,7 @@
 
 from binascii import unhexlify
 import enum
+import functools
 from enum import Enum
 from typing import (
     List,
@@ -158,6 +159,14 @@ def AddChecksum(desc: str) -> str:
     return desc + "#" + DescriptorChecksum(desc)
 
 
+@functools.lru_cache(maxsize=2**16)
+def _get_child_pubkey_bytes(xpub: str, path: Tuple[int, ...]) -> bytes:
+    # Descriptors are created for every txin/txout, so the same derivations
+    # are done over and over again, e.g. when signing a large tx.
+    child_key = BIP32Node.from_xkey(xpub, allow_custom_headers=False).subkey_at_public_derivation(path)
+    return child_key.eckey.get_public_key_bytes(compressed=True)
+
+
 class PubkeyProvider(object):
     """
     A public key expression in a descriptor.
@@ -251,6 +260,8 @@ class PubkeyProvider(object):
                     assert path_str[-1] == "*"
                     path_str = path_str[:-1] + str(pos)
                 path = convert_bip32_strpath_to_intpath(path_str)
+                if not self.extkey.is_private():
+                    return _get_child_pubkey_bytes(self.pubkey, tuple(path))
                 child_key = self.extkey.subkey_at_public_derivation(path)
                 return child_key.eckey.get_public_key_bytes(compressed=compressed)
         else:
@@ -30,8 +30,9 @@ import time
 import traceback
 import asyncio
 import socket
-from typing import Tuple, Union, List, TYPE_CHECKING, Optional, Set, NamedTuple, Any, Sequence, Dict
-from collections import defaultdict
+import contextlib
+from typing import Tuple, Union, List, TYPE_CHECKING, Optional, Set, NamedTuple, Any, Sequence, Dict, Callable
+from collections import defaultdict, deque
 from ipaddress import IPv4Network, IPv6Network, ip_address, IPv6Address, IPv4Address
 import itertools
 import logging
@@ -41,7 +42,7 @@ import random
 import enum
 
 import aiorpcx
-from aiorpcx import RPCSession, Notification, NetAddress, NewlineFramer
+from aiorpcx import RPCSession, Notification, NetAddress, NewlineFramer, run_in_thread
 from aiorpcx.curio import timeout_after, TaskTimeout
 from aiorpcx.jsonrpc import JSONRPC, CodeMessageError
 from aiorpcx.rawsocket import RSClient, RSTransport
@@ -171,9 +172,16 @@ class NotificationSession(RPCSession):
         super(NotificationSession, self).__init__(*args, **kwargs)
         self.subscriptions = defaultdict(list)  # type: defaultdict[str, list[asyncio.Queue]]
         self.subs_cache = {}  # type: dict[str, Any]
+        self._subscription_calls = {}  # type: Dict[str, Tuple[str, List]]  # key -> (method, params)
+        self._pending_unsubscribes = {}  # type: Dict[str, asyncio.Task]
+        # requests that can be shared by concurrent callers (e.g. different wallets in the daemon):
+        self._shared_requests = {}  # type: Dict[Tuple[str, Optional[float]], asyncio.Future]
         self._msg_counter = itertools.count(start=1)
         self.interface = interface
         self.taskgroup = interface.taskgroup
+        # requests waiting to be sent in the next JSON-RPC batch:
+        self._pending_batch = []  # type: List[Tuple[str, Sequence, asyncio.Future]]
+        self._batch_tasks = set()  # type: Set[asyncio.Task]
         self.set_strict_resource_limits()
 
         # To log pre-processed json traffic, uncomment:
@@ -189,8 +197,10 @@ class NotificationSession(RPCSession):
                 params, result = request.args[:-1], request.args[-1]
                 key = self.get_hashable_key_for_rpc_call(request.method, params)
                 if key in self.subscriptions:
-                    self.subs_cache[key] = result
-                    for queue in self.subscriptions[key]:
+                    if self.subscriptions[key]:
+                        # note: without subscribers, the cache entry would go stale once we unsubscribed
+                        self.subs_cache[key] = result
+                    for queue in list(self.subscriptions[key]):
                         await queue.put(request.args)
                 else:
                     raise Exception(f'unexpected notification')
@@ -201,8 +211,13 @@ class NotificationSession(RPCSession):
             await self.close()
 
     async def send_request(self, *args, timeout=None, **kwargs):
-        # note: semaphores/timeouts/backpressure etc are handled by
-        # aiorpcx. the timeout arg here in most cases should not be set
+        # note: the number of requests in flight is limited by self.interface.request_limiter,
+        #       timeouts are handled by aiorpcx. the timeout arg here in most cases should not be set
+        method = args[0] if args else kwargs.get('method')
+        async with self.interface.request_limiter.slot(method):
+            return await self._send_request(*args, timeout=timeout, **kwargs)
+
+    async def _send_request(self, *args, timeout=None, **kwargs):
         msg_id = next(self._msg_counter)
         self.maybe_log(f"<-- {args} {kwargs} (id: {msg_id})")
         try:
@@ -224,6 +239,93 @@ class NotificationSession(RPCSession):
             self.maybe_log(f"--> {response} (id: {msg_id})")
             return response
 
+    async def send_request_batched(self, method: str, params: Sequence) -> Any:
+        """Like send_request, but the request might be sent to the server in a
+        JSON-RPC batch, together with other requests made in the same iteration
+        of the event loop (e.g. by concurrent tasks of the Synchronizer).
+        """
+        max_batch_size = self.interface.network.config.NETWORK_REQUEST_BATCH_SIZE
+        if max_batch_size <= 1:
+            return await self.send_request(method, params)
+        # each request in the batch takes a slot of the limiter
+        async with self.interface.request_limiter.slot(method):
+            loop = asyncio.get_running_loop()
+            fut = loop.create_future()
+            self._pending_batch.append((method, params, fut))
+            if len(self._pending_batch) >= max_batch_size:
+                self._flush_pending_batch()
+            elif len(self._pending_batch) == 1:
+                loop.call_soon(self._flush_pending_batch)
+            return await fut
+
+    async def send_request_shared(self, method: str, params: Sequence, *, batched: bool = False, timeout=None) -> Any:
+        """Like send_request (or send_request_batched), but concurrent calls with the
+        same method and params share a single request to the server. This happens e.g.
+        when several wallets loaded in the daemon watch the same address.
+        All callers get the same result object, which hence must not be mutated.
+        """
+        key = (self.get_hashable_key_for_rpc_call(method, params), timeout)
+        fut = self._shared_requests.get(key)
+        if fut is None:
+            if batched:
+                coro = self.send_request_batched(method, params)
+            else:
+                coro = self.send_request(method, params, timeout=timeout)
+            fut = asyncio.ensure_future(coro)
+            self._shared_requests[key] = fut
+            fut.add_done_callback(functools.partial(self._on_shared_request_done, key))
+        # note: shielded, so that one of the callers getting cancelled does not cancel the request for the others
+        return await asyncio.shield(fut)
+
+    def _on_shared_request_done(self, key, fut: asyncio.Future) -> None:
+        if self._shared_requests.get(key) is fut:
+            del self._shared_requests[key]
+        if not fut.cancelled():
+            fut.exception()  # mark exception as retrieved, in case all callers got cancelled
+
+    def _flush_pending_batch(self) -> None:
+        requests, self._pending_batch = self._pending_batch, []
+        if not requests:
+            return
+        # note: this is not spawned in self.taskgroup, as _send_batch must not be cancelled
+        #       by the caller that happened to create the batch
+        task = asyncio.ensure_future(self._send_batch(requests))
+        self._batch_tasks.add(task)
+        task.add_done_callback(self._batch_tasks.discard)
+
+    async def _send_batch(self, requests: Sequence[Tuple[str, Sequence, asyncio.Future]]) -> None:
+        """Sends requests as a batch, and passes the responses (or errors) to their futures.
+        Never raises.
+        """
+        msg_id = next(self._msg_counter)
+        self.maybe_log(f"<-- batch of {len(requests)}: {[(method, params) for method, params, _ in requests]} (id: {msg_id})")
+        try:
+            async with self.send_batch() as batch:
+                for method, params, fut in requests:
+                    batch.add_request(method, params)
+        except BaseException as e:
+            if isinstance(e, (TaskTimeout, asyncio.TimeoutError)):
+                self.maybe_log(f"--> batch request timed out (id: {msg_id})")
+                e = RequestTimedOut(f'batch request timed out (id: {msg_id})')
+            else:
+                self.maybe_log(f"--> {repr(e)} (id: {msg_id})")
+            for _, _, fut in requests:
+                if fut.done():
+                    continue  # caller got cancelled
+                if isinstance(e, asyncio.CancelledError):
+                    fut.cancel()
+                else:
+                    fut.set_exception(e)
+            return
+        self.maybe_log(f"--> batch response {batch.results} (id: {msg_id})")
+        for (_, _, fut), result in zip(requests, batch.results):
+            if fut.done():
+                continue
+            if isinstance(result, Exception):
+                fut.set_exception(result)
+            else:
+                fut.set_result(result)
+
     def set_default_timeout(self, timeout):
         assert hasattr(self, "sent_request_timeout")  # in base class
         self.sent_request_timeout = timeout
@@ -233,24 +335,52 @@ class NotificationSession(RPCSession):
     async def subscribe(self, method: str, params: List, queue: asyncio.Queue):
         key = self.get_hashable_key_for_rpc_call(method, params)
         # note: multiple Synchronizers (from different Wallet objects) might sub to the same key,
-        #       hence subscriptions map key->list[queue]
+        #       hence subscriptions map key->list[queue], and notifications are fanned out to all queues.
         self.subscriptions[key].append(queue)
+        self._subscription_calls[key] = (method, params)
         if key not in self.subs_cache:
-            # note: until subs_cache is written for the first time,
-            #       each 'subscribe' call might make a request on the network.
-            result = await self.send_request(method, params)
+            if unsub_task := self._pending_unsubscribes.get(key):
+                # make sure the server sees the unsubscribe before the new subscribe
+                await asyncio.wait([unsub_task])
+            # note: concurrent 'subscribe' calls for the same key share a single request
+            result = await self.send_request_shared(method, params)
             # don't override what was already set in handle_request, it might be newer than the send_request response
-            if key not in self.subs_cache:
+            if key not in self.subs_cache and self.subscriptions[key]:
                 self.subs_cache[key] = result
-        await queue.put(params + [self.subs_cache[key]])
+        else:
+            result = self.subs_cache[key]
+        await queue.put(params + [self.subs_cache.get(key, result)])
 
     def unsubscribe(self, queue):
-        """Unsubscribe a callback to free object references to enable GC."""
-        # note: we can't unsubscribe from the server, so we keep receiving
-        # subsequent notifications
-        for v in self.subscriptions.values():
-            if queue in v:
-                v.remove(queue)
+        """Unsubscribe a callback to free object references to enable GC.
+        Subscriptions are reference counted: once the last queue is gone for a
+        scripthash, we also unsubscribe from the server, if it supports that.
+        """
+        for key, queues in self.subscriptions.items():
+            if queue not in queues:
+                continue
+            queues.remove(queue)
+            if queues:
+                continue
+            # we might not be told about changes anymore, so the cached result would get stale
+            self.subs_cache.pop(key, None)
+            method, params = self._subscription_calls[key]
+            if (method == 'blockchain.scripthash.subscribe'
+                    and self.interface.active_protocol_tuple >= (1, 4, 2)
+                    and not self.is_closing()
+                    and key not in self._pending_unsubscribes):
+                # note: not spawned in self.taskgroup, as we might get called while it is being cancelled
+                task = asyncio.ensure_future(self._unsubscribe_from_server(key, 'blockchain.scripthash.unsubscribe', params))
+                self._pending_unsubscribes[key] = task
+
+    async def _unsubscribe_from_server(self, key: str, method: str, params: Sequence) -> None:
+        """Never raises."""
+        try:
+            await self.send_request(method, params)
+        except BaseException as e:
+            self.maybe_log(f"failed to unsubscribe {key}: {e!r}")
+        finally:
+            self._pending_unsubscribes.pop(key, None)
 
     @classmethod
     def get_hashable_key_for_rpc_call(cls, method, params):
@@ -314,6 +444,8 @@ class NotificationSession(RPCSession):
 
     def on_disconnect_due_to_excessive_session_cost(self):
         self.interface.logger.info(f"closing session over resource usage. cost={self.cost}")
+        # so that we are more careful when reconnecting to this server
+        self.interface.request_limiter.on_overload()
 
 
 class NetworkException(Exception): pass
@@ -595,6 +727,165 @@ def _get_cert_path_for_host(*, config: 'SimpleConfig', host: str) -> str:
     return os.path.join(config.path, 'certs', filename)
 
 
+class RequestConcurrencyLimiter:
+    """Limits the number of requests in flight to a server, adapting the limit AIMD-style
+    to what the server can handle.
+
+    The limit doubles every round-trip at first (slow start), and then grows by one
+    per round-trip, as long as responses are fast. It is cut multiplicatively on
+    timeouts and "server busy" errors, when responses get much slower than the fastest
+    ones we have seen from this server for the same method, and when we get close to
+    the session cost limit.
+    """
+
+    INITIAL_LIMIT = 10
+    MIN_LIMIT = 1
+    DECREASE_FACTOR = 0.5  # on timeouts and errors
+    LATENCY_DECREASE_FACTOR = 0.9  # on slow responses
+    # responses slower than this multiple of the fastest one are considered slow:
+    LATENCY_TOLERANCE = 4
+    MIN_LATENCY_TARGET = 0.5  # seconds. so that jitter on very fast servers does not count as slow
+    LATENCY_BASELINE_DRIFT = 0.01  # the fastest latency slowly drifts up, to forget old samples
+    COST_BACKOFF_FRACTION = 0.5  # of the session cost_hard_limit
+    # methods whose latency mostly depends on the size of the response, not on the load of the server.
+    # they do not count as slow responses.
+    SIZE_DEPENDENT_LATENCY_METHODS = {
+        'blockchain.block.headers',
+        'blockchain.transaction.get',
+        'blockchain.scripthash.get_history',
+        'blockchain.scripthash.listunspent',
+    }
+
+    def __init__(
+            self,
+            *,
+            max_limit: int,
+            initial_limit: Optional[int] = None,
+            get_cost_fraction: Callable[[], float] = None,
+    ):
+        self.max_limit = max(max_limit, self.MIN_LIMIT)
+        self._slow_start = initial_limit is None
+        if initial_limit is None:
+            initial_limit = self.INITIAL_LIMIT
+        self._limit = float(min(max(initial_limit, self.MIN_LIMIT), self.max_limit))
+        self._get_cost_fraction = get_cost_fraction
+        self.in_flight = 0
+        self._waiters = deque()  # type: deque[asyncio.Future]
+        self._min_latency = {}  # type: Dict[Optional[str], float]  # method -> fastest latency
+        self._avg_latency = None  # type: Optional[float]
+        self._last_decrease_time = 0.0
+        self.num_decreases = 0
+
+    @property
+    def limit(self) -> int:
+        return max(self.MIN_LIMIT, int(self._limit))
+
+    def get_learned_limit(self) -> Optional[int]:
+        """Returns the limit to start from when reconnecting to the same server,
+        or None if we have not learned anything yet.
+        """
+        if self._slow_start and self.limit <= self.INITIAL_LIMIT:
+            return None
+        return self.limit
+
+    @contextlib.asynccontextmanager
+    async def slot(self, method: Optional[str] = None):
+        await self._acquire()
+        start_time = time.monotonic()
+        try:
+            yield
+        except RequestTimedOut:
+            self.on_overload(start_time=start_time)
+            raise
+        except CodeMessageError as e:
+            if e.code in (JSONRPC.EXCESSIVE_RESOURCE_USAGE, JSONRPC.SERVER_BUSY):
+                self.on_overload(start_time=start_time)
+            else:  # e.g. "unknown txid": the server answered fine
+                self._on_response(start_time=start_time, method=method)
+            raise
+        else:
+            self._on_response(start_time=start_time, method=method)
+        finally:
+            self.in_flight -= 1
+            self._wake_up_waiters()
+
+    async def _acquire(self) -> None:
+        while self.in_flight >= self.limit:
+            fut = asyncio.get_running_loop().create_future()
+            self._waiters.append(fut)
+            try:
+                await fut
+            except BaseException:  # e.g. cancelled
+                self._waiters.remove(fut)
+                self._wake_up_waiters()  # we might have been woken up already, pass it on
+                raise
+            self._waiters.remove(fut)
+        self.in_flight += 1
+
+    def _wake_up_waiters(self) -> None:
+        num_free = self.limit - self.in_flight
+        for fut in list(self._waiters):
+            if num_free <= 0:
+                break
+            if not fut.done():
+                fut.set_result(None)
+            num_free -= 1  # woken up waiters that have not run yet also take a slot
+
+    def _on_response(self, *, start_time: float, method: Optional[str] = None) -> None:
+        latency = time.monotonic() - start_time
+        if self._avg_latency is None:
+            self._avg_latency = latency
+        else:
+            self._avg_latency = 0.9 * self._avg_latency + 0.1 * latency
+        is_slow = False
+        if method not in self.SIZE_DEPENDENT_LATENCY_METHODS:
+            min_latency = self._min_latency.get(method)
+            if min_latency is None:
+                min_latency = latency
+            else:
+                min_latency = min(latency, min_latency * (1 + self.LATENCY_BASELINE_DRIFT))
+            self._min_latency[method] = min_latency
+            is_slow = latency > max(self.MIN_LATENCY_TARGET, self.LATENCY_TOLERANCE * min_latency)
+        if self._get_cost_fraction and self._get_cost_fraction() > self.COST_BACKOFF_FRACTION:
+            self.on_overload(start_time=start_time)
+        elif is_slow:
+            self._decrease(self.LATENCY_DECREASE_FACTOR, start_time=start_time)
+        elif self.in_flight >= self.limit or self._waiters:  # only grow if the limit is what holds us back
+            if self._slow_start:
+                self._limit += 1
+            else:
+                self._limit += 1 / self._limit
+            self._limit = min(self._limit, self.max_limit)
+            self._wake_up_waiters()
+
+    def on_overload(self, *, start_time: float = None) -> None:
+        """The server could not keep up with our requests."""
+        self._decrease(self.DECREASE_FACTOR, start_time=start_time)
+
+    def _decrease(self, factor: float, *, start_time: Optional[float]) -> None:
+        # requests sent before the last decrease do not reflect the new limit yet,
+        # so a burst of failures only counts once.
+        if start_time is not None and start_time < self._last_decrease_time:
+            return
+        self._slow_start = False
+        self._limit = max(self._limit * factor, self.MIN_LIMIT)
+        self._last_decrease_time = time.monotonic()
+        self.num_decreases += 1
+
+    def get_stats(self) -> dict:
+        def to_ms(seconds: Optional[float]) -> Optional[int]:
+            return round(seconds * 1000) if seconds is not None else None
+        return {
+            'limit': self.limit,
+            'in_flight': self.in_flight,
+            'waiting': len(self._waiters),
+            'slow_start': self._slow_start,
+            'decreases': self.num_decreases,
+            'latency_ms': to_ms(self._avg_latency),
+            'min_latency_ms': to_ms(min(self._min_latency.values(), default=None)),
+        }
+
+
 class Interface(Logger):
 
     def __init__(self, *, network: 'Network', server: ServerAddr):
@@ -610,6 +901,10 @@ class Interface(Logger):
         self._requested_chunks = set()  # type: Set[int]
         self.network = network
         self.session = None  # type: Optional[NotificationSession]
+        self.request_limiter = RequestConcurrencyLimiter(
+            max_limit=network.config.NETWORK_MAX_REQUEST_CONCURRENCY,
+            initial_limit=network.get_request_concurrency_hint(server),
+            get_cost_fraction=self._get_session_cost_fraction)
         self._ipaddr_bucket = None
         # Set up proxy.
         # - for servers running on localhost, the proxy is not used. If user runs their own server
@@ -953,13 +1248,16 @@ class Interface(Logger):
         self,
         *,
         height: int,
-    ) -> None:
+    ) -> bool:
+        """Returns whether the chunk was fetched by this call,
+        False if there was already a pending request for it.
+        """
         if not is_non_negative_integer(height):
             raise Exception(f"{repr(height)} is not a block height")
         assert height <= constants.net.max_checkpoint(), f"{height=} must be <= cp={constants.net.max_checkpoint()}"
         index = height // CHUNK_SIZE
         if index in self._requested_chunks:
-            return None
+            return False
         self.logger.debug(f"requesting chunk from height {height}")
         try:
             self._requested_chunks.add(index)
@@ -969,7 +1267,7 @@ class Interface(Logger):
         conn = self.blockchain.connect_chunk(index, data=b"".join(headers))
         if not conn:
             raise RequestCorrupted(f"chunk ({index=}, for {height=}) does not connect to blockchain")
-        return None
+        return True
 
     async def _fast_forward_chain(
         self,
@@ -988,34 +1286,19 @@ class Interface(Logger):
                 or height == 0 == constants.net.max_checkpoint()):
             raise Exception(f"{height=} must be > cp={constants.net.max_checkpoint()}")
         assert height <= tip, f"{height=} must be <= {tip=}"
-        # Request a few chunks of headers concurrently.
-        # tradeoffs:
-        # - more chunks: higher memory requirements
-        # - more chunks: higher concurrency => syncing needs fewer network round-trips
-        # - if a chunk does not connect, bandwidth for all later chunks is wasted
-        async with OldTaskGroup() as group:
-            tasks = []  # type: List[Tuple[int, asyncio.Task[Sequence[bytes]]]]
-            index0 = height // CHUNK_SIZE
-            for chunk_cnt in range(10):
-                index = index0 + chunk_cnt
-                start_height = index * CHUNK_SIZE
-                if start_height > tip:
-                    break
-                end_height = min(start_height + CHUNK_SIZE - 1, tip)
-                size = end_height - start_height + 1
-                tasks.append((index, await group.spawn(self.get_block_headers(start_height=start_height, count=size))))
-        # try to connect chunks
-        num_headers = 0
-        for index, task in tasks:
-            headers = task.result()
-            conn = self.blockchain.connect_chunk(index, data=b"".join(headers))
-            if not conn:
-                break
-            num_headers += len(headers)
+        # Request a few chunks of headers concurrently, possibly also from other servers.
+        index0 = height // CHUNK_SIZE
+        num_headers = await self.network.fast_forward_chain(self, index0=index0, tip=tip)
         # We started at a chunk boundary, instead of requested `height`. Need to correct for that.
         offset = height - index0 * CHUNK_SIZE
         return max(0, num_headers - offset)
 
+    def _get_session_cost_fraction(self) -> float:
+        session = self.session
+        if not session or not session.cost_hard_limit:
+            return 0
+        return session.cost / session.cost_hard_limit
+
     def is_main_server(self) -> bool:
         return (self.network.interface == self or
                 self.network.interface is None and self.network.default_server == self.server)
@@ -1413,7 +1696,7 @@ class Interface(Logger):
         if not is_non_negative_integer(tx_height):
             raise Exception(f"{repr(tx_height)} is not a block height")
         # do request
-        res = await self.session.send_request('blockchain.transaction.get_merkle', [tx_hash, tx_height])
+        res = await self.session.send_request_batched('blockchain.transaction.get_merkle', [tx_hash, tx_height])
         # check response
         block_height = assert_dict_contains_field(res, field_name='block_height')
         merkle = assert_dict_contains_field(res, field_name='merkle')
@@ -1431,7 +1714,14 @@ class Interface(Logger):
             raise Exception(f"{repr(tx_hash)} is not a txid")
         if rawtx_bytes := self._rawtx_cache.get(tx_hash):
             return rawtx_bytes.hex()
-        raw = await self.session.send_request('blockchain.transaction.get', [tx_hash], timeout=timeout)
+        # the on-disk cache is shared with other interfaces, and survives restarts
+        if (disk_cache := self.network.rawtx_cache) and (rawtx_bytes := await run_in_thread(disk_cache.get, tx_hash)):
+            self._rawtx_cache[tx_hash] = rawtx_bytes
+            return rawtx_bytes.hex()
+        # note: not batched, as a single tx can already be as large as network_max_incoming_msg_size
+        raw = await self.session.send_request_shared('blockchain.transaction.get', [tx_hash], timeout=timeout)
+        if rawtx_bytes := self._rawtx_cache.get(tx_hash):
+            return rawtx_bytes.hex()  # another caller sharing the request already validated it
         # validate response
         if not is_hex_str(raw):
             raise RequestCorrupted(f"received garbage (non-hex) as tx data (txid {tx_hash}): {raw!r}")
@@ -1443,6 +1733,8 @@ class Interface(Logger):
         if tx.txid() != tx_hash:
             raise RequestCorrupted(f"received tx does not match expected txid {tx_hash} (got {tx.txid()})")
         self._rawtx_cache[tx_hash] = bytes.fromhex(raw)
+        if disk_cache := self.network.rawtx_cache:
+            await run_in_thread(disk_cache.put, tx_hash, self._rawtx_cache[tx_hash])
         return raw
 
     async def broadcast_transaction(self, tx: 'Transaction', *, timeout=None) -> None:
@@ -1507,7 +1799,7 @@ class Interface(Logger):
         if not is_hash256_str(sh):
             raise Exception(f"{repr(sh)} is not a scripthash")
         # do request
-        res = await self.session.send_request('blockchain.scripthash.get_history', [sh])
+        res = await self.session.send_request_shared('blockchain.scripthash.get_history', [sh], batched=True)
         # check response
         assert_list_or_tuple(res)
         prev_height = 1
@@ -25,7 +25,7 @@
 import threading
 import copy
 import json
-from typing import TYPE_CHECKING, Optional, Sequence, List, Union, Dict, Any
+from typing import TYPE_CHECKING, Optional, Sequence, List, Union, Dict, Any, Set
 
 import jsonpatch
 import jsonpointer
@@ -33,7 +33,7 @@ import jsonpointer
 from . import util
 from .util import WalletFileException, profiler, sticky_property
 from .logging import Logger
-from .stored_dict import StoredDict, _FLEX_KEY, registered_names, registered_keys, _convert_dict_key, _convert_dict_value
+from .stored_dict import StoredDict, LazyStoredDict, _FLEX_KEY, registered_names, registered_keys, _convert_dict_key, _convert_dict_value
 
 
 if TYPE_CHECKING:
@@ -94,6 +94,7 @@ class JsonDB(Logger):
         storage: Optional['WalletStorage'] = None,
         encoder=None,
         upgrader=None,
+        lazy_sections: Sequence[str] = (),
     ):
         Logger.__init__(self)
         self.lock = threading.RLock()
@@ -101,6 +102,10 @@ class JsonDB(Logger):
         self.encoder = encoder
         self.pending_changes = []  # type: List[str]
         self._modified = False
+        # top-level sections that are converted on first access, see LazyStoredDict
+        self._lazy_sections = frozenset(lazy_sections)
+        self._touched_lazy_sections = set()  # type: Set[str]
+        self._dumping = False
         # load data
         data = self.load_data(s)
         if upgrader:
@@ -247,12 +252,36 @@ class JsonDB(Logger):
         """Serializes the DB as a string.
         'human_readable': makes the json indented and sorted, but this is ~2x slower
         """
-        return json.dumps(
-            self.data,
-            indent=4 if human_readable else None,
-            sort_keys=bool(human_readable),
-            cls=self.encoder,
-        )
+        return self._dump(self.data, human_readable=human_readable)
+
+    def _dump(self, data: dict, *, human_readable: bool) -> str:
+        self._dumping = True
+        try:
+            return json.dumps(
+                data,
+                indent=4 if human_readable else None,
+                sort_keys=bool(human_readable),
+                cls=self.encoder,
+            )
+        finally:
+            self._dumping = False
+
+    def _dump_for_storage(self, *, human_readable: bool) -> str:
+        """Serializes what goes into the storage file."""
+        return self.dump(human_readable=human_readable)
+
+    def is_dumping(self) -> bool:
+        return self._dumping
+
+    def _on_lazy_section_touched(self, name: str) -> None:
+        if name not in self._touched_lazy_sections:
+            self.logger.debug(f"materializing lazy section {name!r}")
+            self._touched_lazy_sections.add(name)
+
+    @locked
+    def get_touched_lazy_sections(self) -> Set[str]:
+        """Returns the lazy sections in which at least one item was accessed."""
+        return set(self._touched_lazy_sections)
 
     def _should_convert_to_stored_dict(self, key) -> bool:
         return True
@@ -272,6 +301,9 @@ class JsonDB(Logger):
         d = {}
         for k, v in list(data.items()):
             child_path = path + [k]
+            if not path and k in self._lazy_sections and type(v) is dict:
+                d[k] = LazyStoredDict(v, self, json_path=child_path)
+                continue
             k = self._convert_dict_key(path, k)
             v = self._convert_dict_value(child_path, v)
             d[k] = v
@@ -303,7 +335,7 @@ class JsonDB(Logger):
             raise Exception('daemon thread cannot write db')
         if not self.modified():
             return
-        json_str = self.dump(human_readable=not self.storage.is_encrypted())
+        json_str = self._dump_for_storage(human_readable=not self.storage.is_encrypted())
         self.storage.write(json_str)
         self.pending_changes = []
         self.set_modified(False)
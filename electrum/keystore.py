@@ -25,7 +25,7 @@ from unicodedata import normalize
 import hashlib
 import re
 import copy
-from typing import Tuple, TYPE_CHECKING, Union, Sequence, Optional, Dict, List, NamedTuple, Any, Type
+from typing import Tuple, TYPE_CHECKING, Union, Sequence, Optional, Dict, List, NamedTuple, Any, Type, Mapping
 from functools import wraps
 from abc import ABC, abstractmethod
 
@@ -237,15 +237,24 @@ class Software_KeyStore(KeyStore):
         # Raise if password is not correct.
         self.check_password(password)
         # Add private keys
-        keypairs = {}
         pubkey_to_deriv_map = self._get_tx_derivations(tx)
-        for pubkey, deriv in pubkey_to_deriv_map.items():
-            privkey, is_compressed = self.get_private_key(deriv, password)
-            keypairs[pubkey] = privkey
+        keypairs = self._get_private_keys(pubkey_to_deriv_map, password)
         # Sign
         if keypairs:
             tx.sign(keypairs)
 
+    def _get_private_keys(
+            self,
+            pubkey_to_deriv_map: Mapping[bytes, 'AddressIndexGeneric'],
+            password,
+    ) -> Dict[bytes, bytes]:
+        """Returns pubkey -> privkey. Subclasses can override this to derive keys in a batch."""
+        keypairs = {}
+        for pubkey, deriv in pubkey_to_deriv_map.items():
+            privkey, is_compressed = self.get_private_key(deriv, password)
+            keypairs[pubkey] = privkey
+        return keypairs
+
     @abstractmethod
     def update_password(self, old_password, new_password) -> None:
         pass
@@ -411,8 +420,27 @@ class Deterministic_KeyStore(Software_KeyStore):
 
 class MasterPublicKeyMixin(ABC):
 
+    PUBKEY_CACHE_MIN_SIZE = 10**4
+
     def __init__(self):
-        self._pubkey_cache = LRUCache(maxsize=10**4)  # type: LRUCache[Sequence[int], bytes]  # path->pubkey
+        self._pubkey_cache = LRUCache(maxsize=self.PUBKEY_CACHE_MIN_SIZE)  # type: LRUCache[Sequence[int], bytes]  # path->pubkey
+
+    def set_pubkey_cache_size(self, num_pubkeys: int) -> None:
+        """Grows the pubkey cache so that it can hold at least num_pubkeys entries."""
+        maxsize = max(num_pubkeys, self.PUBKEY_CACHE_MIN_SIZE)
+        if maxsize <= self._pubkey_cache.maxsize:
+            return
+        new_cache = LRUCache(maxsize=maxsize)
+        for key, pubkey in self._pubkey_cache.items():
+            new_cache[key] = pubkey
+        self._pubkey_cache = new_cache
+
+    def get_cached_pubkeys(self) -> Dict[Tuple[int, int], bytes]:
+        return dict(self._pubkey_cache.items())
+
+    def add_cached_pubkeys(self, pubkeys: Dict[Tuple[int, int], bytes]) -> None:
+        for key, pubkey in pubkeys.items():
+            self._pubkey_cache[key] = pubkey
 
     @abstractmethod
     def get_master_public_key(self) -> str:
@@ -463,6 +491,30 @@ class MasterPublicKeyMixin(ABC):
         """
         pass
 
+    def derive_pubkeys(self, for_change: int, start: int, count: int) -> List[bytes]:
+        """Returns the pubkeys at paths (for_change, start), ..., (for_change, start+count-1)."""
+        pubkeys = {}
+        missing = []
+        for n in range(start, start + count):
+            key = (for_change, n)
+            if key in self._pubkey_cache:
+                pubkeys[n] = self._pubkey_cache[key]
+            else:
+                missing.append(n)
+        if missing:
+            first = missing[0]
+            derived = self._derive_pubkeys(for_change, first, missing[-1] - first + 1)
+            for n, pubkey in enumerate(derived, start=first):
+                pubkeys[n] = pubkey
+                self._pubkey_cache[(for_change, n)] = pubkey
+        return [pubkeys[n] for n in range(start, start + count)]
+
+    def _derive_pubkeys(self, for_change: int, start: int, count: int) -> List[bytes]:
+        """Batch version of _derive_pubkey. Subclasses can override this, if
+        deriving consecutive keys at once is faster than one at a time.
+        """
+        return [self._derive_pubkey(for_change, n) for n in range(start, start + count)]
+
     def get_pubkey_derivation(
             self,
             pubkey: bytes,
@@ -528,6 +580,7 @@ class Xpub(MasterPublicKeyMixin):
         self.xpub_receive = None
         self.xpub_change = None
         self._xpub_bip32_node = None  # type: Optional[BIP32Node]
+        self._chain_bip32_nodes = {}  # type: Dict[int, BIP32Node]  # for_change -> node
 
         # "key origin" info (subclass should persist these):
         self._derivation_prefix = derivation_prefix  # type: Optional[str]
@@ -631,19 +684,27 @@ class Xpub(MasterPublicKeyMixin):
             self._derivation_prefix = derivation_prefix
         self.is_requesting_to_be_rewritten_to_wallet_file = True
 
-    def _derive_pubkey(self, for_change: int, n: int) -> bytes:
+    def _get_bip32_node_for_chain(self, for_change: int) -> BIP32Node:
         for_change = int(for_change)
         if for_change not in (0, 1):
             raise CannotDerivePubkey("forbidden path")
-        xpub = self.xpub_change if for_change else self.xpub_receive
-        if xpub is None:
+        node = self._chain_bip32_nodes.get(for_change)
+        if node is None:
             rootnode = self.get_bip32_node_for_xpub()
-            xpub = rootnode.subkey_at_public_derivation((for_change,)).to_xpub()
+            node = rootnode.subkey_at_public_derivation((for_change,))
+            self._chain_bip32_nodes[for_change] = node
             if for_change:
-                self.xpub_change = xpub
+                self.xpub_change = node.to_xpub()
             else:
-                self.xpub_receive = xpub
-        return self.get_pubkey_from_xpub(xpub, (n,))
+                self.xpub_receive = node.to_xpub()
+        return node
+
+    def _derive_pubkey(self, for_change: int, n: int) -> bytes:
+        node = self._get_bip32_node_for_chain(for_change).subkey_at_public_derivation((n,))
+        return node.eckey.get_public_key_bytes(compressed=True)
+
+    def _derive_pubkeys(self, for_change: int, start: int, count: int) -> List[bytes]:
+        return self._get_bip32_node_for_chain(for_change).derive_child_pubkeys(start, count)
 
     @classmethod
     def get_pubkey_from_xpub(cls, xpub: str, sequence) -> bytes:
@@ -733,6 +794,20 @@ class BIP32_KeyStore(Xpub, Deterministic_KeyStore):
         pk = node.eckey.get_secret_bytes()
         return pk, True
 
+    def _get_private_keys(self, pubkey_to_deriv_map, password):
+        # decrypt the xprv only once, and derive the parent node of each branch only once
+        rootnode = BIP32Node.from_xkey(self.get_master_private_key(password))
+        parent_nodes = {}  # type: Dict[Tuple[int, ...], BIP32Node]
+        keypairs = {}
+        for pubkey, deriv in pubkey_to_deriv_map.items():
+            deriv = tuple(deriv)
+            prefix = deriv[:-1]
+            if prefix not in parent_nodes:
+                parent_nodes[prefix] = rootnode.subkey_at_private_derivation(prefix)
+            node = parent_nodes[prefix].subkey_at_private_derivation(deriv[-1:])
+            keypairs[pubkey] = node.eckey.get_secret_bytes()
+        return keypairs
+
     def can_have_deterministic_lightning_xprv(self):
         if (self.get_seed_type() == 'segwit'
                 and self.get_bip32_node_for_xpub().xtype == 'p2wpkh'):
@@ -23,21 +23,35 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import queue
+import asyncio
+import copy
+import heapq
+import os
+import pickle
+import struct
+from array import array
 from collections import defaultdict
-from typing import Sequence, Tuple, Optional, Dict, TYPE_CHECKING, Set, Callable, NamedTuple
+from typing import Sequence, Tuple, Optional, Dict, TYPE_CHECKING, Set, Callable, NamedTuple, List
 import time
 import threading
 from threading import RLock
+import math
 from math import inf
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 import attr
+from aiorpcx import run_in_thread
 
+from . import constants
 from .util import profiler, with_lock, now
+from .lrucache import LRUCache
 from .logging import Logger
 from .lnutil import (NUM_MAX_EDGES_IN_PAYMENT_PATH, ShortChannelID, LnFeatures,
-                     NBLOCK_CLTV_DELTA_TOO_FAR_INTO_FUTURE, PaymentFeeBudget)
-from .channel_db import ChannelDB, Policy, NodeInfo
+                     NBLOCK_CLTV_DELTA_TOO_FAR_INTO_FUTURE, PaymentFeeBudget, REMOTE)
+from .channel_db import (ChannelDB, Policy, NodeInfo, ChannelInfo, GraphListener, ChannelDBNotLoaded,
+                         ChannelDBSnapshot)
 
 if TYPE_CHECKING:
     from .lnchannel import Channel
@@ -72,7 +86,7 @@ class PathEdge:
         # legacy compat  # TODO rm
         return self.end_node
 
-@attr.s
+@attr.s(slots=True)
 class RouteEdge(PathEdge):
     fee_base_msat = attr.ib(type=int, kw_only=True)                # for start_node
     fee_proportional_millionths = attr.ib(type=int, kw_only=True)  # for start_node
@@ -167,11 +181,38 @@ class LiquidAmount(NamedTuple):
     def from_amount(cls, amount_msat: int) -> 'LiquidAmount':
         return cls(amount_msat=amount_msat, timestamp=now())
 
-    def get_valid_amount(self) -> Optional[int]:
-        return None if self.is_invalid() else self.amount_msat
 
-    def is_invalid(self) -> bool:
-        return now() - self.timestamp > HINT_DURATION
+class LiquidityHintDecay(NamedTuple):
+    """How fast observed liquidity amounts lose weight.
+
+    An observation is forgotten after max_age seconds. Before that, if half_life
+    is set, a can_send amount is halved and a cannot_send amount doubled every
+    half_life seconds, so that old bounds constrain path finding less and less.
+    """
+    max_age: int = HINT_DURATION  # seconds
+    half_life: int = 0  # seconds, 0 means no decay
+
+    def is_expired(self, la: LiquidAmount) -> bool:
+        return now() - la.timestamp > self.max_age
+
+    def can_send_amount(self, la: LiquidAmount) -> Optional[int]:
+        age = now() - la.timestamp
+        if age > self.max_age:
+            return None
+        if not self.half_life or age <= 0:
+            return la.amount_msat
+        return int(la.amount_msat * 0.5 ** (age / self.half_life))
+
+    def cannot_send_amount(self, la: LiquidAmount) -> Optional[int]:
+        age = now() - la.timestamp
+        if age > self.max_age:
+            return None
+        if not self.half_life or age <= 0:
+            return la.amount_msat
+        return int(la.amount_msat * 2 ** (age / self.half_life))
+
+
+DEFAULT_HINT_DECAY = LiquidityHintDecay()
 
 
 class LiquidityHint:
@@ -181,7 +222,8 @@ class LiquidityHint:
     A LiquidityHint is the value of a dict, which is keyed to node ids and the
     channel.
     """
-    def __init__(self):
+    def __init__(self, decay: LiquidityHintDecay = DEFAULT_HINT_DECAY):
+        self._decay = decay
         # use "can_send_forward + can_send_backward < cannot_send_forward + cannot_send_backward" as a sanity check?
         self._can_send_forward = None  # type: Optional[LiquidAmount]
         self._cannot_send_forward = None  # type: Optional[LiquidAmount]
@@ -193,7 +235,7 @@ class LiquidityHint:
     @property
     def can_send_forward(self) -> Optional[int]:
         la = self._can_send_forward
-        return la.get_valid_amount() if la else None
+        return self._decay.can_send_amount(la) if la else None
 
     @can_send_forward.setter
     def can_send_forward(self, amount_msat: int) -> None:
@@ -210,7 +252,7 @@ class LiquidityHint:
     @property
     def can_send_backward(self) -> Optional[int]:
         la = self._can_send_backward
-        return la.get_valid_amount() if la else None
+        return self._decay.can_send_amount(la) if la else None
 
     @can_send_backward.setter
     def can_send_backward(self, amount_msat: int) -> None:
@@ -224,7 +266,7 @@ class LiquidityHint:
     @property
     def cannot_send_forward(self) -> Optional[int]:
         la = self._cannot_send_forward
-        return la.get_valid_amount() if la else None
+        return self._decay.cannot_send_amount(la) if la else None
 
     @cannot_send_forward.setter
     def cannot_send_forward(self, amount_msat: int) -> None:
@@ -243,7 +285,7 @@ class LiquidityHint:
     @property
     def cannot_send_backward(self) -> Optional[int]:
         la = self._cannot_send_backward
-        return la.get_valid_amount() if la else None
+        return self._decay.cannot_send_amount(la) if la else None
 
     @cannot_send_backward.setter
     def cannot_send_backward(self, amount_msat: int) -> None:
@@ -305,29 +347,65 @@ class LiquidityHint:
         self._can_send_forward = None
         self._can_send_backward = None
 
+    def get_amounts(self) -> Tuple[Optional[LiquidAmount], ...]:
+        """Returns the unexpired (can_send_forward, cannot_send_forward,
+        can_send_backward, cannot_send_backward) observations."""
+        return tuple(
+            la if la and not self._decay.is_expired(la) else None
+            for la in (self._can_send_forward, self._cannot_send_forward,
+                       self._can_send_backward, self._cannot_send_backward))
+
+    def set_amounts(self, amounts: Sequence[Optional[LiquidAmount]]) -> None:
+        (self._can_send_forward, self._cannot_send_forward,
+         self._can_send_backward, self._cannot_send_backward) = amounts
+
     def __repr__(self):
         return f"forward: can send: {self._can_send_forward}, cannot send: {self._cannot_send_forward}, htlcs: {self._inflight_htlcs_forward}\n" \
                f"backward: can send: {self._can_send_backward}, cannot send: {self._cannot_send_backward}, htlcs: {self._inflight_htlcs_backward}\n"
 
 
-class LiquidityHintMgr:
+# On-disk format of the liquidity hints: a header, followed by one record per channel,
+# most recently updated first. In-flight htlcs are not saved.
+LIQUIDITY_HINTS_MAGIC = b'ELLIQHNT'
+LIQUIDITY_HINTS_VERSION = 1
+_LIQUIDITY_HINTS_HEADER = struct.Struct('>8sHI')  # magic, version, number of records
+# scid, then (amount_msat, timestamp) for can_send/cannot_send forward/backward
+_LIQUIDITY_HINTS_RECORD = struct.Struct('>8s' + 'QI' * 4)
+_LIQUIDITY_HINTS_NONE = 2**64 - 1
+
+
+class LiquidityHintMgr(Logger):
     """Implements liquidity hints for channels in the graph.
 
     This class can be used to update liquidity information about channels in the
     graph. Implements a penalty function for edge weighting in the pathfinding
     algorithm that favors channels which can route payments and penalizes
     channels that cannot.
+
+    If a path is given, the hints can be saved to and loaded from disk, so that
+    they survive restarts.
     """
+    MAX_LOADED_HINTS = 100_000  # bounds the time it takes to load the hints
+
     # TODO: hints based on node pairs only (shadow channels, non-strict forwarding)?
-    def __init__(self):
+    def __init__(self, *, path: str = None, decay: LiquidityHintDecay = DEFAULT_HINT_DECAY):
+        Logger.__init__(self)
         self.lock = RLock()
+        self.path = path
+        self.decay = decay
         self._liquidity_hints: Dict[ShortChannelID, LiquidityHint] = {}
+        self._dirty = False  # whether there are updates that have not been saved yet
+        # called with a scid when we learn that a channel cannot send some amount, with None on reset
+        self._listeners = []  # type: List[Callable[[Optional[ShortChannelID]], None]]
+
+    def add_listener(self, func: Callable[[Optional[ShortChannelID]], None]) -> None:
+        self._listeners.append(func)
 
     @with_lock
     def get_hint(self, channel_id: ShortChannelID) -> LiquidityHint:
         hint = self._liquidity_hints.get(channel_id)
         if not hint:
-            hint = LiquidityHint()
+            hint = LiquidityHint(self.decay)
             self._liquidity_hints[channel_id] = hint
         return hint
 
@@ -335,11 +413,15 @@ class LiquidityHintMgr:
     def update_can_send(self, node_from: bytes, node_to: bytes, channel_id: ShortChannelID, *, amount_msat: int) -> None:
         hint = self.get_hint(channel_id)
         hint.update_can_send(node_from < node_to, amount_msat=amount_msat)
+        self._dirty = True
 
     @with_lock
     def update_cannot_send(self, node_from: bytes, node_to: bytes, channel_id: ShortChannelID, *, amount_msat: int) -> None:
         hint = self.get_hint(channel_id)
         hint.update_cannot_send(node_from < node_to, amount_msat=amount_msat)
+        self._dirty = True
+        for func in self._listeners:
+            func(channel_id)
 
     @with_lock
     def add_htlc(self, node_from: bytes, node_to: bytes, channel_id: ShortChannelID):
@@ -351,6 +433,10 @@ class LiquidityHintMgr:
         hint = self.get_hint(channel_id)
         hint.remove_htlc(node_from < node_to)
 
+    def num_inflight_htlcs(self, node_from: bytes, node_to: bytes, channel_id: ShortChannelID) -> int:
+        hint = self._liquidity_hints.get(channel_id)
+        return hint.num_inflight_htlcs(node_from < node_to) if hint else 0
+
     def penalty(
         self,
         node_from: bytes,
@@ -416,6 +502,84 @@ class LiquidityHintMgr:
             v.reset_amounts()
             v._inflight_htlcs_forward = 0
             v._inflight_htlcs_backward = 0
+        self._dirty = True
+        for func in self._listeners:
+            func(None)
+
+    @with_lock
+    def save(self) -> None:
+        """Writes the unexpired hints to disk, if there are unsaved updates."""
+        if self.path is None or not self._dirty:
+            return
+        records = []
+        for scid, hint in self._liquidity_hints.items():
+            amounts = hint.get_amounts()
+            timestamps = [la.timestamp for la in amounts if la]
+            if timestamps:
+                records.append((max(timestamps), scid, amounts))
+        records.sort(key=lambda x: x[0], reverse=True)
+        records = records[:self.MAX_LOADED_HINTS]
+        chunks = [_LIQUIDITY_HINTS_HEADER.pack(LIQUIDITY_HINTS_MAGIC, LIQUIDITY_HINTS_VERSION, len(records))]
+        for _, scid, amounts in records:
+            fields = []
+            for la in amounts:
+                fields += [la.amount_msat, la.timestamp] if la else [_LIQUIDITY_HINTS_NONE, 0]
+            chunks.append(_LIQUIDITY_HINTS_RECORD.pack(scid, *fields))
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(b''.join(chunks))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            self.logger.warning(f"failed to save liquidity hints: {e!r}")
+            return
+        self._dirty = False
+        self.logger.info(f"saved {len(records)} liquidity hints")
+
+    def load(self) -> None:
+        """Reads the hints saved by save(), skipping expired ones.
+        Hints that are already in memory take precedence.
+        """
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            self.logger.warning(f"cannot read liquidity hints: {e!r}")
+            return
+        try:
+            magic, version, num_records = _LIQUIDITY_HINTS_HEADER.unpack_from(data, 0)
+            if magic != LIQUIDITY_HINTS_MAGIC or version != LIQUIDITY_HINTS_VERSION:
+                raise ValueError(f"unexpected header: {magic!r} {version}")
+            num_records = min(num_records, self.MAX_LOADED_HINTS)
+            end = _LIQUIDITY_HINTS_HEADER.size + num_records * _LIQUIDITY_HINTS_RECORD.size
+            if len(data) < end:
+                raise ValueError("truncated file")
+            records = _LIQUIDITY_HINTS_RECORD.iter_unpack(memoryview(data)[_LIQUIDITY_HINTS_HEADER.size:end])
+        except (struct.error, ValueError) as e:
+            self.logger.warning(f"cannot load liquidity hints: {e!r}")
+            return
+        num_loaded = 0
+        with self.lock:
+            for scid, *fields in records:
+                amounts = [
+                    LiquidAmount(amount_msat=fields[i], timestamp=fields[i+1])
+                    if fields[i] != _LIQUIDITY_HINTS_NONE else None
+                    for i in range(0, 8, 2)]
+                amounts = [la if la and not self.decay.is_expired(la) else None for la in amounts]
+                if not any(amounts):
+                    break  # records are sorted, so all remaining ones are expired too
+                scid = ShortChannelID(scid)
+                if scid in self._liquidity_hints:
+                    continue
+                hint = LiquidityHint(self.decay)
+                hint.set_amounts(amounts)
+                self._liquidity_hints[scid] = hint
+                num_loaded += 1
+        self.logger.info(f"loaded {num_loaded} liquidity hints")
 
     def __repr__(self):
         string = "liquidity hints:\n"
@@ -425,12 +589,319 @@ class LiquidityHintMgr:
         return string
 
 
-class LNPathFinder(Logger):
+class RouteCache(GraphListener):
+    """Remembers the paths found by LNPathFinder.find_route, so that repeated payments
+    to the same destination can skip the graph search.
+
+    Entries are keyed by destination, amount bucket, and the sending channels and
+    route hints the search was run with. An entry is dropped when the channel db reports
+    a change for a channel on its path, when one of its channels gets blacklisted or
+    is found unable to forward, or after TTL seconds (to pick up better paths elsewhere
+    in the graph). The caller re-validates a cached path before using it.
+    """
+
+    TTL = 600  # seconds
+    MAX_ENTRIES = 1000
+    BUCKETS_PER_DOUBLING = 4
+
+    def __init__(self):
+        self.lock = RLock()
+        self._entries = LRUCache(maxsize=self.MAX_ENTRIES)  # type: LRUCache[tuple, Tuple[LNPaymentPath, frozenset, int]]
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def amount_bucket(cls, amount_msat: int) -> int:
+        if amount_msat <= 0:
+            return 0
+        return int(math.log2(amount_msat) * cls.BUCKETS_PER_DOUBLING)
+
+    @classmethod
+    def make_key(
+            cls,
+            *,
+            nodeA: bytes,
+            nodeB: bytes,
+            amount_msat: int,
+            my_sending_channels: Dict[ShortChannelID, 'Channel'],
+            private_route_edges: Dict[ShortChannelID, RouteEdge],
+    ) -> tuple:
+        private_edges_key = tuple(sorted(
+            (bytes(e.short_channel_id), e.start_node, e.end_node, e.fee_base_msat,
+             e.fee_proportional_millionths, e.cltv_delta)
+            for e in private_route_edges.values()))
+        return (nodeA, nodeB, cls.amount_bucket(amount_msat), frozenset(my_sending_channels), private_edges_key)
+
+    @with_lock
+    def get(
+            self,
+            key: tuple,
+            *,
+            now: int,
+            is_usable: Callable[[LNPaymentPath], bool],
+    ) -> Optional[LNPaymentPath]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            path, scids, timestamp = entry
+            if now - timestamp > self.TTL:
+                del self._entries[key]
+            elif is_usable(path):
+                self.hits += 1
+                return path
+        self.misses += 1
+        return None
+
+    @with_lock
+    def put(self, key: tuple, path: LNPaymentPath, *, now: int) -> None:
+        scids = frozenset(edge.short_channel_id for edge in path)
+        self._entries[key] = (path, scids, now)
+
+    @with_lock
+    def remove(self, key: tuple) -> None:
+        self._entries.pop(key, None)
+
+    @with_lock
+    def invalidate_channel(self, short_channel_id: Optional[ShortChannelID]) -> None:
+        if short_channel_id is None:
+            self._entries.clear()
+            return
+        for key, (path, scids, timestamp) in list(self._entries.items()):
+            if short_channel_id in scids:
+                del self._entries[key]
+
+    @with_lock
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def on_channel_changed(self, short_channel_id: ShortChannelID) -> None:
+        self.invalidate_channel(short_channel_id)
+
+    def on_graph_reset(self) -> None:
+        self.clear()
+
+    @with_lock
+    def get_stats(self) -> dict:
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+MAX_EDGE_CLTV_DELTA = 14 * 144  # we do not route through edges with a larger cltv_delta
+_NO_LIMIT = 2**64 - 1  # placeholder for unknown capacity / htlc_maximum_msat
+
+
+class RoutingGraph(GraphListener):
+    """Array-backed mirror of the public graph in ChannelDB, used by LNPathFinder.
+
+    Every public channel contributes two directed edges, one per direction.
+    Arrays are only ever appended to or overwritten in place; a full rebuild
+    replaces them with new ones. Readers running concurrently with sync() should
+    take references to the arrays while holding self.lock (see get_snapshot).
+    As path finding runs in reverse, edges are grouped by their end node, CSR-style:
+    the incoming edges of node i are in_edges[in_offsets[i]:in_offsets[i+1]],
+    plus those added since the last full rebuild (kept in _extra_in_edges).
+    Edge attributes are stored in parallel arrays, indexed by edge index.
+
+    ChannelDB notifies us of changes, and we apply them lazily in sync():
+    policy updates are written in place; new channels get appended edges;
+    removed channels leave unusable edges behind until the next rebuild.
+    """
+
+    # rebuild the CSR arrays if this many edges were appended since the last rebuild
+    REBUILD_THRESHOLD = 5000
 
     def __init__(self, channel_db: ChannelDB):
+        self.channel_db = channel_db
+        self.lock = RLock()
+        self._dirty_lock = threading.Lock()
+        self._needs_rebuild = True
+        self._dirty_channels = set()  # type: Set[ShortChannelID]
+        self._dirty_nodes = set()  # type: Set[bytes]
+        self._clear()
+        channel_db.add_graph_listener(self)
+
+    def _clear(self) -> None:
+        # nodes
+        self.node_ids = []  # type: List[bytes]
+        self.node_index = {}  # type: Dict[bytes, int]
+        self.node_supports_varonion = bytearray()
+        # edges
+        self.edge_scid = []  # type: List[ShortChannelID]
+        self.edge_start = array('I')
+        self.edge_end = array('I')
+        self.edge_usable = bytearray()  # policies known in both directions, not disabled, sane cltv
+        self.edge_fee_base_msat = array('Q')
+        self.edge_fee_proportional_millionths = array('Q')
+        self.edge_cltv_delta = array('I')
+        self.edge_htlc_minimum_msat = array('Q')
+        self.edge_htlc_maximum_msat = array('Q')
+        self.edge_capacity_sat = array('Q')
+        self._edges_for_scid = {}  # type: Dict[ShortChannelID, Tuple[int, int]]
+        # adjacency
+        self.in_offsets = array('I', [0])
+        self.in_edges = array('I')
+        self._extra_in_edges = defaultdict(list)  # type: Dict[int, List[int]]
+        self._num_extra_edges = 0
+
+    def on_channel_changed(self, short_channel_id: ShortChannelID) -> None:
+        with self._dirty_lock:
+            self._dirty_channels.add(short_channel_id)
+
+    def on_node_changed(self, node_id: bytes) -> None:
+        with self._dirty_lock:
+            self._dirty_nodes.add(node_id)
+
+    def on_graph_reset(self) -> None:
+        with self._dirty_lock:
+            self._needs_rebuild = True
+
+    @with_lock
+    def sync(self) -> None:
+        """Applies pending changes from the ChannelDB."""
+        if not self.channel_db.data_loaded.is_set():
+            raise ChannelDBNotLoaded("channelDB data not loaded yet!")
+        with self._dirty_lock:
+            needs_rebuild = self._needs_rebuild or self._num_extra_edges > self.REBUILD_THRESHOLD
+            dirty_channels, self._dirty_channels = self._dirty_channels, set()
+            dirty_nodes, self._dirty_nodes = self._dirty_nodes, set()
+            self._needs_rebuild = False
+        if needs_rebuild:
+            self._rebuild()
+            return
+        for short_channel_id in dirty_channels:
+            self._update_channel(short_channel_id)
+        for node_id in dirty_nodes:
+            idx = self.node_index.get(node_id)
+            if idx is not None:
+                self.node_supports_varonion[idx] = self._node_supports_varonion(node_id)
+
+    @profiler(min_threshold=0.1)
+    def _rebuild(self) -> None:
+        with self.channel_db.lock:
+            channels = list(self.channel_db._channels.values())
+        self._clear()
+        for channel_info in channels:
+            self._add_channel(channel_info)
+        # group edges by end node
+        num_nodes = len(self.node_ids)
+        counts = [0] * (num_nodes + 1)
+        for end in self.edge_end:
+            counts[end + 1] += 1
+        for i in range(num_nodes):
+            counts[i + 1] += counts[i]
+        self.in_offsets = array('I', counts)
+        in_edges = [0] * len(self.edge_end)
+        position = counts[:-1]
+        for edge_idx, end in enumerate(self.edge_end):
+            in_edges[position[end]] = edge_idx
+            position[end] += 1
+        self.in_edges = array('I', in_edges)
+        self._extra_in_edges.clear()
+        self._num_extra_edges = 0
+
+    def _node_supports_varonion(self, node_id: bytes) -> bool:
+        node_info = self.channel_db.get_node_info_for_node_id(node_id)
+        # it's ok if we are missing the node_announcement (node_info) for this node,
+        # but if we have it, we enforce that they support var_onion_optin
+        return node_info is None or LnFeatures(node_info.features).supports(LnFeatures.VAR_ONION_OPT)
+
+    def _get_or_add_node(self, node_id: bytes) -> int:
+        idx = self.node_index.get(node_id)
+        if idx is None:
+            idx = len(self.node_ids)
+            self.node_ids.append(node_id)
+            self.node_supports_varonion.append(self._node_supports_varonion(node_id))
+            self.node_index[node_id] = idx  # last, so that readers never see a partially added node
+        return idx
+
+    def _add_edge(self, short_channel_id: ShortChannelID, start: int, end: int) -> int:
+        edge_idx = len(self.edge_scid)
+        self.edge_scid.append(short_channel_id)
+        self.edge_start.append(start)
+        self.edge_end.append(end)
+        self.edge_usable.append(0)
+        for arr in (self.edge_fee_base_msat, self.edge_fee_proportional_millionths, self.edge_cltv_delta,
+                    self.edge_htlc_minimum_msat, self.edge_htlc_maximum_msat, self.edge_capacity_sat):
+            arr.append(0)
+        return edge_idx
+
+    def _add_channel(self, channel_info: ChannelInfo) -> Tuple[int, int]:
+        node1 = self._get_or_add_node(channel_info.node1_id)
+        node2 = self._get_or_add_node(channel_info.node2_id)
+        edges = self._add_edge(channel_info.short_channel_id, node1, node2), \
+            self._add_edge(channel_info.short_channel_id, node2, node1)
+        self._edges_for_scid[channel_info.short_channel_id] = edges
+        self._set_edge_attributes(edges, channel_info)
+        return edges
+
+    def _update_channel(self, short_channel_id: ShortChannelID) -> None:
+        channel_info = self.channel_db.get_channel_info(short_channel_id)
+        edges = self._edges_for_scid.get(short_channel_id)
+        if edges is None:
+            if channel_info is None:
+                return
+            edges = self._add_channel(channel_info)
+            for edge_idx in edges:
+                self._extra_in_edges[self.edge_end[edge_idx]].append(edge_idx)
+                self._num_extra_edges += 1
+        elif channel_info is None:  # channel was removed
+            for edge_idx in edges:
+                self.edge_usable[edge_idx] = 0
+        else:
+            self._set_edge_attributes(edges, channel_info)
+
+    def _set_edge_attributes(self, edges: Tuple[int, int], channel_info: ChannelInfo) -> None:
+        scid = channel_info.short_channel_id
+        policies = [self.channel_db._policies.get((self.node_ids[self.edge_start[edge_idx]], scid))
+                    for edge_idx in edges]
+        capacity_sat = channel_info.capacity_sat if channel_info.capacity_sat is not None else _NO_LIMIT
+        for edge_idx, policy, policy_backwards in zip(edges, policies, reversed(policies)):
+            self.edge_capacity_sat[edge_idx] = capacity_sat
+            # channels that did not publish both policies often return temporary channel failure
+            if policy is None or policy_backwards is None or policy.is_disabled() \
+                    or policy.cltv_delta > MAX_EDGE_CLTV_DELTA:
+                self.edge_usable[edge_idx] = 0
+                continue
+            self.edge_usable[edge_idx] = 1
+            self.edge_fee_base_msat[edge_idx] = policy.fee_base_msat
+            self.edge_fee_proportional_millionths[edge_idx] = policy.fee_proportional_millionths
+            self.edge_cltv_delta[edge_idx] = policy.cltv_delta
+            self.edge_htlc_minimum_msat[edge_idx] = policy.htlc_minimum_msat
+            self.edge_htlc_maximum_msat[edge_idx] = policy.htlc_maximum_msat \
+                if policy.htlc_maximum_msat is not None else _NO_LIMIT
+
+    @with_lock
+    def get_snapshot(self) -> 'RoutingGraph':
+        """Returns a shallow copy of the graph, that stays consistent if the graph
+        gets rebuilt. Incremental updates made by sync() are still visible in it."""
+        snapshot = copy.copy(self)
+        snapshot.lock = None
+        return snapshot
+
+    def get_incoming_edges(self, node_id: bytes) -> Sequence[int]:
+        """Returns the indices of the edges ending at node_id."""
+        idx = self.node_index.get(node_id)
+        if idx is None:
+            return ()
+        edges = self.in_edges[self.in_offsets[idx]:self.in_offsets[idx + 1]] if idx + 1 < len(self.in_offsets) else ()
+        extra_edges = self._extra_in_edges.get(idx)
+        if extra_edges:
+            edges = list(edges) + extra_edges
+        return edges
+
+
+class LNPathFinder(Logger):
+
+    def __init__(self, channel_db: ChannelDB, *, liquidity_hints: LiquidityHintMgr = None):
         Logger.__init__(self)
         self.channel_db = channel_db
-        self.liquidity_hints = LiquidityHintMgr()
+        self.graph = RoutingGraph(channel_db)
+        self.route_cache = RouteCache()
+        channel_db.add_graph_listener(self.route_cache)
+        self.liquidity_hints = liquidity_hints or LiquidityHintMgr()
+        self.liquidity_hints.add_listener(self.route_cache.invalidate_channel)
         self._edge_blacklist = dict()  # type: Dict[ShortChannelID, int]  # scid -> expiration
         self._blacklist_lock = threading.Lock()
 
@@ -455,10 +926,12 @@ class LNPathFinder(Logger):
         with self._blacklist_lock:
             blacklist_expiration = self._edge_blacklist.get(short_channel_id, 0)
             self._edge_blacklist[short_channel_id] = max(blacklist_expiration, now + duration)
+        self.route_cache.invalidate_channel(short_channel_id)
 
     def clear_blacklist(self):
         with self._blacklist_lock:
             self._edge_blacklist = dict()
+        self.route_cache.clear()
 
     def update_liquidity_hints(
             self,
@@ -556,7 +1029,7 @@ class LNPathFinder(Logger):
                 end_node=end_node,
                 node_info=node_info)
         # Cap cltv of any given edge at 2 weeks (the cost function would not work well for extreme cases)
-        if route_edge.cltv_delta > 14 * 144:
+        if route_edge.cltv_delta > MAX_EDGE_CLTV_DELTA:
             return float('inf'), 0
         # Distance metric notes:  # TODO constants are ad-hoc
         # ( somewhat based on https://github.com/lightningnetwork/lnd/pull/1358 )
@@ -596,38 +1069,111 @@ class LNPathFinder(Logger):
         # run Dijkstra
         # The search is run in the REVERSE direction, from nodeB to nodeA,
         # to properly calculate compound routing fees.
+        # Edges of the public graph are evaluated directly on the arrays of self.graph.
+        # Our own channels and private route hints (and public channels overridden by them)
+        # go through the slower _edge_cost.
+        if private_route_edges is None:
+            private_route_edges = {}
+        with self.graph.lock:
+            self.graph.sync()
+            # in case the graph gets rebuilt while we run
+            graph = self.graph.get_snapshot()
+        node_ids = graph.node_ids
+        node_supports_varonion = graph.node_supports_varonion
+        edge_scid = graph.edge_scid
+        edge_start = graph.edge_start
+        edge_usable = graph.edge_usable
+        edge_fee_base_msat = graph.edge_fee_base_msat
+        edge_fee_proportional_millionths = graph.edge_fee_proportional_millionths
+        edge_cltv_delta = graph.edge_cltv_delta
+        edge_htlc_minimum_msat = graph.edge_htlc_minimum_msat
+        edge_htlc_maximum_msat = graph.edge_htlc_maximum_msat
+        edge_capacity_sat = graph.edge_capacity_sat
+        penalty = self.liquidity_hints.penalty
+
         ignore_amount_constraints = invoice_amount_msat is None  # e.g. onion messages
         distance_from_start = defaultdict(lambda: float('inf'))
         distance_from_start[nodeB] = 0
         previous_hops = {}  # type: Dict[bytes, PathEdge]
-        nodes_to_explore = queue.PriorityQueue()
-        nodes_to_explore.put((0, invoice_amount_msat or 0, nodeB))  # order of fields (in tuple) matters!
+        nodes_to_explore = [(0, invoice_amount_msat or 0, nodeB)]  # order of fields (in tuple) matters!
         now = int(time.time())
 
+        def relax_edge(edge_channel_id, edge_startnode, edge_endnode, edge_cost, fee_for_edge_msat):
+            alt_dist_to_neighbour = distance_from_start[edge_endnode] + edge_cost
+            if alt_dist_to_neighbour < distance_from_start[edge_startnode]:
+                distance_from_start[edge_startnode] = alt_dist_to_neighbour
+                previous_hops[edge_startnode] = PathEdge(
+                    start_node=edge_startnode,
+                    end_node=edge_endnode,
+                    short_channel_id=ShortChannelID(edge_channel_id))
+                amount_to_forward_msat = amount_msat + fee_for_edge_msat
+                heapq.heappush(nodes_to_explore, (alt_dist_to_neighbour, amount_to_forward_msat, edge_startnode))
+
         # main loop of search
-        while nodes_to_explore.qsize() > 0:
-            dist_to_edge_endnode, amount_msat, edge_endnode = nodes_to_explore.get()
+        while nodes_to_explore:
+            dist_to_edge_endnode, amount_msat, edge_endnode = heapq.heappop(nodes_to_explore)
             if edge_endnode == nodeA and previous_hops:  # previous_hops check for circular paths
                 self.logger.info("found a path")
                 break
             if dist_to_edge_endnode != distance_from_start[edge_endnode]:
-                # queue.PriorityQueue does not implement decrease_priority,
+                # heapq does not implement decrease_priority,
                 # so instead of decreasing priorities, we add items again into the queue.
                 # so there are duplicates in the queue, that we discard now:
                 continue
 
             if nodeA == nodeB:  # we want circular paths
                 if not previous_hops:  # in the first node exploration step, we only take receiving channels
-                    channels_for_endnode = self.channel_db.get_channels_for_node(
-                        edge_endnode, my_channels={}, private_route_edges=private_route_edges)
+                    overlay_my_channels, overlay_private_route_edges = {}, private_route_edges
                 else:  # in the next steps, we only take sending channels
-                    channels_for_endnode = self.channel_db.get_channels_for_node(
-                        edge_endnode, my_channels=my_sending_channels, private_route_edges={})
+                    overlay_my_channels, overlay_private_route_edges = my_sending_channels, {}
             else:
-                channels_for_endnode = self.channel_db.get_channels_for_node(
-                    edge_endnode, my_channels=my_sending_channels, private_route_edges=private_route_edges)
-
-            for edge_channel_id in channels_for_endnode:
+                overlay_my_channels, overlay_private_route_edges = my_sending_channels, private_route_edges
+            slow_channels = set()
+            for chan in overlay_my_channels.values():
+                if edge_endnode in (chan.node_id, chan.get_local_pubkey()):
+                    slow_channels.add(chan.short_channel_id)
+            for route_edge in overlay_private_route_edges.values():
+                if edge_endnode in (route_edge.start_node, route_edge.end_node):
+                    slow_channels.add(route_edge.short_channel_id)
+
+            # public channels
+            for edge_idx in graph.get_incoming_edges(edge_endnode):
+                edge_channel_id = edge_scid[edge_idx]
+                if edge_channel_id in my_sending_channels or edge_channel_id in private_route_edges:
+                    slow_channels.add(edge_channel_id)
+                    continue
+                if not edge_usable[edge_idx]:
+                    continue
+                if self._is_edge_blacklisted(edge_channel_id, now=now):
+                    continue
+                edge_startnode = node_ids[edge_start[edge_idx]]
+                if node_filter:
+                    node_info = self.channel_db.get_node_info_for_node_id(edge_startnode)
+                    if not node_filter(edge_startnode, node_info):
+                        continue
+                if edge_startnode == nodeA and my_sending_channels:  # payment outgoing, but not on our channel
+                    continue
+                if not ignore_amount_constraints:
+                    if amount_msat < edge_htlc_minimum_msat[edge_idx]:
+                        continue  # payment amount too little
+                    if amount_msat // 1000 > edge_capacity_sat[edge_idx]:
+                        continue  # payment amount too large
+                    if amount_msat > edge_htlc_maximum_msat[edge_idx]:
+                        continue  # payment amount too large
+                if not node_supports_varonion[graph.node_index[edge_endnode]]:
+                    continue
+                # see _edge_cost for the distance metric
+                if edge_startnode == nodeA or ignore_amount_constraints:
+                    relax_edge(edge_channel_id, edge_startnode, edge_endnode, DEFAULT_PENALTY_BASE_MSAT, 0)
+                    continue
+                fee_msat = fee_for_edge_msat(
+                    amount_msat, edge_fee_base_msat[edge_idx], edge_fee_proportional_millionths[edge_idx])
+                cltv_cost = edge_cltv_delta[edge_idx] * amount_msat * 15 / 1_000_000_000
+                liquidity_penalty = penalty(edge_startnode, edge_endnode, edge_channel_id, amount_msat=amount_msat)
+                relax_edge(edge_channel_id, edge_startnode, edge_endnode, fee_msat + cltv_cost + liquidity_penalty, fee_msat)
+
+            # our own channels and private route hints
+            for edge_channel_id in slow_channels:
                 assert isinstance(edge_channel_id, bytes)
                 if self._is_edge_blacklisted(edge_channel_id, now=now):
                     continue
@@ -650,7 +1196,7 @@ class LNPathFinder(Logger):
                         #       and only a tiny bit later will the HTLCs get added to the channels. If another HTLC has not been
                         #       added yet but we already selected to use the same channel for it, this "can_pay()" can return a false positive.
                         continue
-                edge_cost, fee_for_edge_msat = self._edge_cost(
+                edge_cost, fee_for_edge = self._edge_cost(
                     short_channel_id=edge_channel_id,
                     start_node=edge_startnode,
                     end_node=edge_endnode,
@@ -662,15 +1208,7 @@ class LNPathFinder(Logger):
                     private_route_edges=private_route_edges,
                     now=now,
                 )
-                alt_dist_to_neighbour = distance_from_start[edge_endnode] + edge_cost
-                if alt_dist_to_neighbour < distance_from_start[edge_startnode]:
-                    distance_from_start[edge_startnode] = alt_dist_to_neighbour
-                    previous_hops[edge_startnode] = PathEdge(
-                        start_node=edge_startnode,
-                        end_node=edge_endnode,
-                        short_channel_id=ShortChannelID(edge_channel_id))
-                    amount_to_forward_msat = amount_msat + fee_for_edge_msat
-                    nodes_to_explore.put((alt_dist_to_neighbour, amount_to_forward_msat, edge_startnode))
+                relax_edge(edge_channel_id, edge_startnode, edge_endnode, edge_cost, fee_for_edge)
             # for circular paths, we already explored the end node, but this
             # is also our start node, so set it to unexplored
             if edge_endnode == nodeB and nodeA == nodeB:
@@ -738,6 +1276,44 @@ class LNPathFinder(Logger):
             invoice_amount_msat=None,
         )
 
+    def _is_cached_path_usable(
+            self,
+            path: LNPaymentPath,
+            *,
+            amount_msat: int,
+            my_sending_channels: Dict[ShortChannelID, 'Channel'],
+            private_route_edges: Dict[ShortChannelID, RouteEdge],
+            now: int,
+    ) -> bool:
+        """Checks that a path from the route cache can still carry amount_msat.
+        We also refuse paths with in-flight htlcs, so that the parts of an MPP payment
+        are spread over different paths, as a fresh search would.
+        """
+        amt = amount_msat
+        for idx, edge in reversed(list(enumerate(path))):
+            is_first_edge = idx == 0
+            if self.liquidity_hints.num_inflight_htlcs(edge.start_node, edge.end_node, edge.short_channel_id):
+                return False
+            if is_first_edge and my_sending_channels:
+                chan = my_sending_channels.get(edge.short_channel_id)
+                if chan is None or not chan.can_pay(amt, check_frozen=True):
+                    return False
+            edge_cost, fee_msat = self._edge_cost(
+                short_channel_id=edge.short_channel_id,
+                start_node=edge.start_node,
+                end_node=edge.end_node,
+                payment_amt_msat=amt,
+                ignore_costs=is_first_edge,
+                is_mine=edge.short_channel_id in my_sending_channels,
+                my_channels=my_sending_channels,
+                private_route_edges=private_route_edges,
+                now=now,
+            )
+            if edge_cost == inf:
+                return False
+            amt += fee_msat
+        return True
+
     def create_route_from_path(
             self,
             path: Optional[LNPaymentPath],
@@ -789,13 +1365,190 @@ class LNPathFinder(Logger):
     ) -> Optional[LNPaymentRoute]:
         route = None
         if not path:
-            path = self.find_path_for_payment(
+            if my_sending_channels is None:
+                my_sending_channels = {}
+            if private_route_edges is None:
+                private_route_edges = {}
+            now = int(time.time())
+            cache_key = self.route_cache.make_key(
                 nodeA=nodeA,
                 nodeB=nodeB,
-                invoice_amount_msat=invoice_amount_msat,
+                amount_msat=invoice_amount_msat,
                 my_sending_channels=my_sending_channels,
                 private_route_edges=private_route_edges)
+            path = self.route_cache.get(cache_key, now=now, is_usable=partial(
+                self._is_cached_path_usable,
+                amount_msat=invoice_amount_msat,
+                my_sending_channels=my_sending_channels,
+                private_route_edges=private_route_edges,
+                now=now))
+            if not path:
+                path = self.find_path_for_payment(
+                    nodeA=nodeA,
+                    nodeB=nodeB,
+                    invoice_amount_msat=invoice_amount_msat,
+                    my_sending_channels=my_sending_channels,
+                    private_route_edges=private_route_edges)
+                if path:
+                    self.route_cache.put(cache_key, path, now=now)
         if path:
             route = self.create_route_from_path(
                 path, my_channels=my_sending_channels, private_route_edges=private_route_edges)
         return route
+
+
+class SendingChannelView:
+    """A picklable stand-in for one of our channels, holding what path finding
+    needs to know about it, so that it can be sent to a worker process.
+    As the balance of the channel changes, a view is only valid for a short time.
+    """
+
+    def __init__(self, chan: 'Channel'):
+        self.short_channel_id = chan.short_channel_id
+        self.node_id = chan.node_id
+        self._local_pubkey = chan.get_local_pubkey()
+        self._capacity = chan.get_capacity()
+        self._channel_announcement = chan.construct_channel_announcement_without_sigs()
+        self._remote_update = chan.get_remote_update()
+        self._outgoing_gossip_channel_update = chan.get_outgoing_gossip_channel_update()
+        self._is_frozen_for_sending = chan.is_frozen_for_sending()
+        self._can_pay_range = self._get_can_pay_range(chan)
+
+    @staticmethod
+    def _get_can_pay_range(chan: 'Channel') -> Optional[Tuple[int, int]]:
+        """Returns the (min, max) amounts for which chan.can_pay() holds, or None.
+        Apart from the htlc minimum, all constraints of can_pay() are upper bounds,
+        so the amounts it accepts form an interval.
+        """
+        min_msat = max(1, chan.config[REMOTE].htlc_minimum_msat)
+        if not chan.can_pay(min_msat):
+            return None
+        lo = min_msat
+        hi = 1000 * chan.get_capacity()
+        while lo < hi:  # find the largest amount we can pay
+            mid = (lo + hi + 1) // 2
+            if chan.can_pay(mid):
+                lo = mid
+            else:
+                hi = mid - 1
+        return min_msat, lo
+
+    def get_local_pubkey(self) -> bytes:
+        return self._local_pubkey
+
+    def get_capacity(self) -> int:
+        return self._capacity
+
+    def construct_channel_announcement_without_sigs(self) -> Tuple[bytes, bool]:
+        return self._channel_announcement
+
+    def get_remote_update(self) -> Optional[bytes]:
+        return self._remote_update
+
+    def get_outgoing_gossip_channel_update(self) -> bytes:
+        return self._outgoing_gossip_channel_update
+
+    def can_pay(self, amount_msat: int, *, check_frozen=False) -> bool:
+        if check_frozen and self._is_frozen_for_sending:
+            return False
+        if self._can_pay_range is None:
+            return False
+        min_msat, max_msat = self._can_pay_range
+        return min_msat <= amount_msat <= max_msat
+
+
+class PathFindingRequest(NamedTuple):
+    nodeA: bytes
+    nodeB: bytes
+    invoice_amount_msat: int
+    my_sending_channels: Dict[ShortChannelID, SendingChannelView]
+    private_route_edges: Dict[ShortChannelID, RouteEdge]
+
+
+# path finder of a worker process of PathFindingPool
+_worker_path_finder = None  # type: Optional[LNPathFinder]
+
+
+def _path_finding_worker_init(channel_db_snapshot: ChannelDBSnapshot, net_name: str) -> None:
+    global _worker_path_finder
+    for net in constants.NETS_LIST:
+        if net.NET_NAME == net_name:
+            net.set_as_network()
+    _worker_path_finder = LNPathFinder(channel_db_snapshot)
+    _worker_path_finder.graph.sync()
+
+
+def _path_finding_worker_find_path(state: bytes, request: PathFindingRequest) -> Optional[LNPaymentPath]:
+    path_finder = _worker_path_finder
+    liquidity_hints, edge_blacklist = pickle.loads(state)
+    path_finder.liquidity_hints._liquidity_hints = liquidity_hints
+    path_finder._edge_blacklist = edge_blacklist
+    return path_finder.find_path_for_payment(
+        nodeA=request.nodeA,
+        nodeB=request.nodeB,
+        invoice_amount_msat=request.invoice_amount_msat,
+        my_sending_channels=request.my_sending_channels,
+        private_route_edges=request.private_route_edges)
+
+
+class PathFindingPool(Logger):
+    """Opt-in backend that searches payment paths in worker processes,
+    so that the paths for all parts of a split payment can be found concurrently.
+
+    Each worker holds a read-only snapshot of the graph, and the pool is
+    recreated with a fresh snapshot once it gets older than SNAPSHOT_MAX_AGE.
+    The liquidity hints and the blacklist of the path finder in this process
+    are sent along with each batch of requests.
+    """
+
+    SNAPSHOT_MAX_AGE = 600  # seconds
+
+    def __init__(self, path_finder: LNPathFinder, *, num_workers: int):
+        Logger.__init__(self)
+        assert num_workers > 0, num_workers
+        self.path_finder = path_finder
+        self.num_workers = num_workers
+        self._executor = None  # type: Optional[ProcessPoolExecutor]
+        self._snapshot_time = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is not None and time.time() - self._snapshot_time < self.SNAPSHOT_MAX_AGE:
+                return self._executor
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+            snapshot = ChannelDBSnapshot(self.path_finder.channel_db)
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.num_workers,
+                initializer=_path_finding_worker_init,
+                initargs=(snapshot, constants.net.NET_NAME))
+            self._snapshot_time = time.time()
+            self.logger.info(f"started {self.num_workers} path finding workers")
+            return self._executor
+
+    def _get_state(self) -> bytes:
+        path_finder = self.path_finder
+        with path_finder.liquidity_hints.lock, path_finder._blacklist_lock:
+            return pickle.dumps((path_finder.liquidity_hints._liquidity_hints, path_finder._edge_blacklist))
+
+    async def find_paths(self, requests: Sequence[PathFindingRequest]) -> List[Optional[LNPaymentPath]]:
+        """Returns a path (or None) for each request, searched for concurrently."""
+        executor = await run_in_thread(self._get_executor)
+        state = await run_in_thread(self._get_state)
+        loop = asyncio.get_running_loop()
+        futures = [loop.run_in_executor(executor, _path_finding_worker_find_path, state, request)
+                   for request in requests]
+        try:
+            return list(await asyncio.gather(*futures))
+        except BrokenProcessPool:
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            raise
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
@@ -33,7 +33,7 @@ from electrum_ecc import ECPubkey
 
 from . import bitcoin
 from . import constants
-from .util import bfh, NetworkJobOnDefaultServer
+from .util import bfh, NetworkJobOnDefaultServer, EventListener, event_listener
 from .lnutil import funding_output_script_from_keys, ShortChannelID
 from .verifier import verify_tx_is_in_block, MerkleVerificationFailure
 from .transaction import Transaction
@@ -46,7 +46,7 @@ if TYPE_CHECKING:
     from .lnrouter import ChannelDB
 
 
-class LNChannelVerifier(NetworkJobOnDefaultServer):
+class LNChannelVerifier(NetworkJobOnDefaultServer, EventListener):
     """ Verify channel announcements for the Channel DB """
 
     # FIXME the initial routing sync is bandwidth-heavy, and the electrum server
@@ -59,11 +59,27 @@ class LNChannelVerifier(NetworkJobOnDefaultServer):
         self.unverified_channel_info = {}  # type: Dict[ShortChannelID, dict]  # scid -> msg_dict
         # channel announcements that seem to be invalid:
         self.blacklist = set()  # type: Set[ShortChannelID]
+        # channels added since the last pass. On new headers, we look at all of them.
+        self._new_channels = set()  # type: Set[ShortChannelID]
+        self._check_all_channels = True
         NetworkJobOnDefaultServer.__init__(self, network)
+        self.register_callbacks()
 
     def _reset(self):
         super()._reset()
         self.started_verifying_channel = set()  # type: Set[ShortChannelID]
+        self._check_all_channels = True
+
+    async def stop(self, *, full_shutdown: bool = True):
+        if full_shutdown:
+            self.unregister_callbacks()
+        await super().stop(full_shutdown=full_shutdown)
+
+    @event_listener
+    def on_event_blockchain_updated(self, *args):
+        # channels waiting for headers might be verifiable now
+        self._check_all_channels = True
+        self.wake_up()
 
     # TODO make async; and rm self.lock completely
     def add_new_channel_info(self, short_channel_id: ShortChannelID, msg: dict) -> bool:
@@ -73,7 +89,9 @@ class LNChannelVerifier(NetworkJobOnDefaultServer):
             return False
         with self.lock:
             self.unverified_channel_info[short_channel_id] = msg
-            return True
+            self._new_channels.add(short_channel_id)
+        self.wake_up()
+        return True
 
     async def _run_tasks(self, *, taskgroup):
         await super()._run_tasks(taskgroup=taskgroup)
@@ -83,14 +101,20 @@ class LNChannelVerifier(NetworkJobOnDefaultServer):
     async def main(self):
         while True:
             await self._verify_some_channels()
-            await asyncio.sleep(0.1)
+            await self._wait_for_wakeup()
 
     async def _verify_some_channels(self):
         blockchain = self.network.blockchain()
         local_height = blockchain.height()
 
         with self.lock:
-            unverified_channel_info = list(self.unverified_channel_info)
+            if self._check_all_channels:
+                self._check_all_channels = False
+                unverified_channel_info = list(self.unverified_channel_info)
+            else:
+                unverified_channel_info = [
+                    scid for scid in self._new_channels if scid in self.unverified_channel_info]
+            self._new_channels.clear()
 
         for short_channel_id in unverified_channel_info:
             if short_channel_id in self.started_verifying_channel:
@@ -102,12 +126,17 @@ class LNChannelVerifier(NetworkJobOnDefaultServer):
             header = blockchain.read_header(block_height)
             if header is None:
                 if block_height <= constants.net.max_checkpoint():
-                    await self.taskgroup.spawn(self.interface.request_chunk_below_max_checkpoint(height=block_height))
+                    await self.taskgroup.spawn(self._request_chunk_below_max_checkpoint(block_height))
                 continue
             self.started_verifying_channel.add(short_channel_id)
             await self.taskgroup.spawn(self.verify_channel(block_height, short_channel_id))
             #self.logger.info(f'requested short_channel_id {short_channel_id.hex()}')
 
+    async def _request_chunk_below_max_checkpoint(self, height: int) -> None:
+        if await self.interface.request_chunk_below_max_checkpoint(height=height):
+            self._check_all_channels = True
+            self.wake_up()
+
     async def verify_channel(self, block_height: int, short_channel_id: ShortChannelID):
         # we are verifying channel announcements as they are from untrusted ln peers.
         # we use electrum servers to do this. however we don't trust electrum servers either...
@@ -19,6 +19,7 @@ from functools import partial
 from collections import defaultdict
 import concurrent
 from concurrent import futures
+from concurrent.futures.process import BrokenProcessPool
 import urllib.parse
 import itertools
 import dataclasses
@@ -82,7 +83,7 @@ from .lnonion import (
 from .lnmsg import decode_msg
 from .lnrouter import (
     RouteEdge, LNPaymentRoute, LNPaymentPath, is_route_within_budget, NoChannelPolicy,
-    LNPathInconsistent, fee_for_edge_msat,
+    LNPathInconsistent, fee_for_edge_msat, PathFindingPool, PathFindingRequest, SendingChannelView,
 )
 from .lnwatcher import LNWatcher
 from .submarine_swaps import SwapManager
@@ -729,6 +730,9 @@ class LNGossip(Logger):
                     self.channel_db.prune_old_policies(self.max_age)
                     self.channel_db.prune_orphaned_channels()
                 await asyncio.to_thread(_maintain)
+                await self.channel_db.write_snapshot()
+            if self.network.path_finder:
+                await asyncio.to_thread(self.network.path_finder.liquidity_hints.save)
             await asyncio.sleep(120)
 
     async def _maintain_forwarding_gossip(self):
@@ -2505,42 +2509,41 @@ class LNWallet(Logger):
                 else:
                     # We atomically loop through a split configuration. If there was
                     # a failure to find a path for a single part, we try the next configuration
-                    for (chan_id, _), part_amounts_msat in sc.config.items():
-                        for part_amount_msat in part_amounts_msat:
-                            channel = self._channels[chan_id]
-                            if is_direct_path:
-                                route = self.create_direct_route(
-                                    amount_msat=part_amount_msat,
-                                    channel=channel,
-                                )
-                            else:
-                                assert not self.uses_trampoline()
-                                route = await run_in_thread(partial(
-                                    self.create_route_for_single_htlc,
-                                    amount_msat=part_amount_msat,
-                                    invoice_pubkey=paysession.invoice_pubkey,
-                                    r_tags=paysession.r_tags,
-                                    invoice_features=paysession.invoice_features,
-                                    my_sending_channels=[channel] if is_mpp else my_active_channels,
-                                    full_path=full_path,
-                                ))
-                            if not is_route_within_budget(
-                                    route, budget=budget._replace(fee_msat=budget.fee_msat // sc.config.number_parts()),
-                                    amount_msat_for_dest=part_amount_msat,
-                                    cltv_delta_for_dest=paysession.min_final_cltv_delta):
-                                self.logger.info(f"rejecting route (exceeds budget): {route=}. {budget=}")
-                                raise FeeBudgetExceeded()
-                            shi = SentHtlcInfo(
-                                route=route,
-                                payment_secret_orig=paysession.payment_secret,
-                                payment_secret_bucket=paysession.payment_secret,
-                                amount_msat=part_amount_msat,
-                                bucket_msat=paysession.amount_to_pay,
-                                amount_receiver_msat=part_amount_msat,
-                                trampoline_fee_level=None,
-                                trampoline_route=None,
-                            )
-                            routes.append((shi, paysession.min_final_cltv_delta, fwd_trampoline_onion))
+                    parts = [
+                        (self._channels[chan_id], part_amount_msat)
+                        for (chan_id, _), part_amounts_msat in sc.config.items()
+                        for part_amount_msat in part_amounts_msat]
+                    if is_direct_path:
+                        part_routes = [
+                            self.create_direct_route(amount_msat=part_amount_msat, channel=channel)
+                            for channel, part_amount_msat in parts]
+                    else:
+                        assert not self.uses_trampoline()
+                        part_routes = await self.create_routes_for_parts(
+                            parts=parts,
+                            paysession=paysession,
+                            my_active_channels=my_active_channels,
+                            is_mpp=is_mpp,
+                            full_path=full_path,
+                        )
+                    for (channel, part_amount_msat), route in zip(parts, part_routes):
+                        if not is_route_within_budget(
+                                route, budget=budget._replace(fee_msat=budget.fee_msat // sc.config.number_parts()),
+                                amount_msat_for_dest=part_amount_msat,
+                                cltv_delta_for_dest=paysession.min_final_cltv_delta):
+                            self.logger.info(f"rejecting route (exceeds budget): {route=}. {budget=}")
+                            raise FeeBudgetExceeded()
+                        shi = SentHtlcInfo(
+                            route=route,
+                            payment_secret_orig=paysession.payment_secret,
+                            payment_secret_bucket=paysession.payment_secret,
+                            amount_msat=part_amount_msat,
+                            bucket_msat=paysession.amount_to_pay,
+                            amount_receiver_msat=part_amount_msat,
+                            trampoline_fee_level=None,
+                            trampoline_route=None,
+                        )
+                        routes.append((shi, paysession.min_final_cltv_delta, fwd_trampoline_onion))
             except NoPathFound:
                 continue
             except FeeBudgetExceeded as e:
@@ -2578,17 +2581,95 @@ class LNWallet(Logger):
         route = [route_edge]
         return route
 
-    @profiler
-    def create_route_for_single_htlc(
+    async def create_routes_for_parts(
+            self, *,
+            parts: Sequence[Tuple[Channel, int]],  # (channel, amount that final receiver gets)
+            paysession: PaySession,
+            my_active_channels: List[Channel],
+            is_mpp: bool,
+            full_path: Optional[LNPaymentPath],
+    ) -> List[LNPaymentRoute]:
+        """Finds a route for each part of a split payment. Raises NoPathFound
+        if there is no route for one of them. If the network has a path finding
+        pool, the paths for all parts are searched for concurrently.
+        """
+        pool = self.network.path_finding_pool
+        if pool is not None and not full_path:
+            try:
+                return await self._create_routes_for_parts_in_pool(
+                    pool, parts=parts, paysession=paysession, my_active_channels=my_active_channels, is_mpp=is_mpp)
+            except BrokenProcessPool as e:
+                self.logger.warning(f"path finding pool failed, searching in-process instead: {e!r}")
+        routes = []
+        for channel, part_amount_msat in parts:
+            route = await run_in_thread(partial(
+                self.create_route_for_single_htlc,
+                amount_msat=part_amount_msat,
+                invoice_pubkey=paysession.invoice_pubkey,
+                r_tags=paysession.r_tags,
+                invoice_features=paysession.invoice_features,
+                my_sending_channels=[channel] if is_mpp else my_active_channels,
+                full_path=full_path,
+            ))
+            routes.append(route)
+        return routes
+
+    async def _create_routes_for_parts_in_pool(
+            self,
+            pool: PathFindingPool,
+            *,
+            parts: Sequence[Tuple[Channel, int]],
+            paysession: PaySession,
+            my_active_channels: List[Channel],
+            is_mpp: bool,
+    ) -> List[LNPaymentRoute]:
+        def prepare_requests():
+            channel_views = {}  # type: Dict[ShortChannelID, SendingChannelView]
+            def get_views(channels):
+                views = {}
+                for chan in channels:
+                    if chan.short_channel_id is None:
+                        continue
+                    if chan.short_channel_id not in channel_views:
+                        channel_views[chan.short_channel_id] = SendingChannelView(chan)
+                    views[chan.short_channel_id] = channel_views[chan.short_channel_id]
+                return views
+            ret = []
+            for channel, part_amount_msat in parts:
+                sending_channels = [channel] if is_mpp else my_active_channels
+                my_sending_channels, private_route_edges = self._get_edges_for_route_search(
+                    invoice_pubkey=paysession.invoice_pubkey,
+                    r_tags=paysession.r_tags,
+                    my_sending_channels=sending_channels)
+                ret.append((my_sending_channels, private_route_edges, PathFindingRequest(
+                    nodeA=self.node_keypair.pubkey,
+                    nodeB=paysession.invoice_pubkey,
+                    invoice_amount_msat=part_amount_msat,
+                    my_sending_channels=get_views(sending_channels),
+                    private_route_edges=private_route_edges)))
+            return ret
+        prepared = await run_in_thread(prepare_requests)
+        paths = await pool.find_paths([request for _, _, request in prepared])
+        routes = []
+        for (my_sending_channels, private_route_edges, _), path in zip(prepared, paths):
+            if not path:
+                raise NoPathFound()
+            try:
+                route = self.network.path_finder.create_route_from_path(
+                    path, my_channels=my_sending_channels, private_route_edges=private_route_edges)
+            except NoChannelPolicy as e:
+                raise NoPathFound() from e
+            routes.append(self._finalize_route(
+                route, invoice_pubkey=paysession.invoice_pubkey, invoice_features=paysession.invoice_features))
+        return routes
+
+    def _get_edges_for_route_search(
             self, *,
-            amount_msat: int,  # that final receiver gets
             invoice_pubkey: bytes,
             r_tags,
-            invoice_features: int,
             my_sending_channels: List[Channel],
-            full_path: Optional[LNPaymentPath],
-    ) -> LNPaymentRoute:
-
+    ) -> Tuple[Dict[ShortChannelID, Channel], Dict[ShortChannelID, RouteEdge]]:
+        """Returns our sending channels by scid, and the private edges from the route hints."""
         my_sending_aliases = set(chan.get_local_scid_alias() for chan in my_sending_channels)
         my_sending_channels = {chan.short_channel_id: chan for chan in my_sending_channels
             if chan.short_channel_id is not None}
@@ -2634,6 +2715,38 @@ class LNWallet(Logger):
                         node_features=node_info.features if node_info else 0)
                 private_route_edges[route_edge.short_channel_id] = route_edge
                 start_node = end_node
+        return my_sending_channels, private_route_edges
+
+    def _finalize_route(
+            self,
+            route: Optional[LNPaymentRoute],
+            *,
+            invoice_pubkey: bytes,
+            invoice_features: int,
+    ) -> LNPaymentRoute:
+        if not route:
+            raise NoPathFound()
+        assert len(route) > 0
+        if route[-1].end_node != invoice_pubkey:
+            raise LNPathInconsistent("last node_id != invoice pubkey")
+        # add features from invoice
+        route[-1].node_features |= invoice_features
+        return route
+
+    @profiler
+    def create_route_for_single_htlc(
+            self, *,
+            amount_msat: int,  # that final receiver gets
+            invoice_pubkey: bytes,
+            r_tags,
+            invoice_features: int,
+            my_sending_channels: List[Channel],
+            full_path: Optional[LNPaymentPath],
+    ) -> LNPaymentRoute:
+        my_sending_channels, private_route_edges = self._get_edges_for_route_search(
+            invoice_pubkey=invoice_pubkey,
+            r_tags=r_tags,
+            my_sending_channels=my_sending_channels)
         # now find a route, end to end: between us and the recipient
         try:
             route = self.network.path_finder.find_route(
@@ -2645,14 +2758,7 @@ class LNWallet(Logger):
                 private_route_edges=private_route_edges)
         except NoChannelPolicy as e:
             raise NoPathFound() from e
-        if not route:
-            raise NoPathFound()
-        assert len(route) > 0
-        if route[-1].end_node != invoice_pubkey:
-            raise LNPathInconsistent("last node_id != invoice pubkey")
-        # add features from invoice
-        route[-1].node_features |= invoice_features
-        return route
+        return self._finalize_route(route, invoice_pubkey=invoice_pubkey, invoice_features=invoice_features)
 
     def _prepare_invoice_features(self, base_features: LnFeatures, *, amount_msat: Optional[int]) -> LnFeatures:
         if not all((not c.is_open() or c.is_frozen_for_receiving()) or self.is_trampoline_peer(c.node_id) \
@@ -25,7 +25,7 @@ import time
 import os
 import random
 import re
-from collections import defaultdict
+from collections import defaultdict, deque
 import threading
 import json
 from typing import (
@@ -34,11 +34,13 @@ from typing import (
 )
 import copy
 import functools
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from enum import IntEnum
 from contextlib import nullcontext
 
 import aiorpcx
-from aiorpcx import ignore_after, NetAddress
+from aiorpcx import ignore_after, NetAddress, run_in_thread
 from aiohttp import ClientResponse
 
 from . import util
@@ -50,10 +52,12 @@ from . import constants
 from . import blockchain
 from . import dns_hacks
 from .transaction import Transaction
-from .blockchain import Blockchain
+from .rawtx_cache import RawTxCache
+from .blockchain import Blockchain, CHUNK_SIZE, HEADER_SIZE
 from .interface import (
     Interface, PREFERRED_NETWORK_PROTOCOL, RequestTimedOut, NetworkTimeout, BUCKET_NAME_OF_ONION_SERVERS,
     NetworkException, RequestCorrupted, ServerAddr, TxBroadcastError, KNOWN_ELEC_PROTOCOL_TRANSPORTS,
+    ChainResolutionMode,
 )
 from .version import PROTOCOL_VERSION_MIN
 from .i18n import _
@@ -64,7 +68,7 @@ from .fee_policy import FeeHistogram, FeeTimeEstimates, FEE_ETA_TARGETS
 if TYPE_CHECKING:
     from collections.abc import Coroutine
     from .channel_db import ChannelDB
-    from .lnrouter import LNPathFinder
+    from .lnrouter import LNPathFinder, PathFindingPool
     from .lnworker import LNGossip
     from .daemon import Daemon
     from .simple_config import SimpleConfig
@@ -328,6 +332,7 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
     channel_db: Optional['ChannelDB'] = None
     lngossip: Optional['LNGossip'] = None
     path_finder: Optional['LNPathFinder'] = None
+    path_finding_pool: Optional['PathFindingPool'] = None
 
     def __init__(self, config: 'SimpleConfig', *, daemon: 'Daemon' = None):
         global _INSTANCE
@@ -404,6 +409,11 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
         self.fee_estimates = FeeTimeEstimates()
         self.last_time_fee_estimates_requested = 0  # zero ensures immediate fees
 
+        self._headers_verify_executor = None  # type: Optional[ProcessPoolExecutor]
+        self.rawtx_cache = RawTxCache.from_config(self.config)  # type: Optional[RawTxCache]
+        # request concurrency limits learned from previous connections to servers:
+        self._request_concurrency_hints = {}  # type: Dict[ServerAddr, int]
+
     def has_internet_connection(self) -> bool:
         """Our guess whether the device has Internet-connectivity."""
         return self._has_ever_managed_to_connect_to_server
@@ -419,7 +429,16 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
             return
         if self.lngossip is None:
             self.channel_db = channel_db.ChannelDB(self)
-            self.path_finder = lnrouter.LNPathFinder(self.channel_db)
+            liquidity_hints = lnrouter.LiquidityHintMgr(
+                path=os.path.join(util.get_headers_dir(self.config), 'liquidity_hints'),
+                decay=lnrouter.LiquidityHintDecay(
+                    max_age=self.config.LIGHTNING_LIQUIDITY_HINTS_MAX_AGE,
+                    half_life=self.config.LIGHTNING_LIQUIDITY_HINTS_HALF_LIFE))
+            liquidity_hints.load()
+            self.path_finder = lnrouter.LNPathFinder(self.channel_db, liquidity_hints=liquidity_hints)
+            if self.config.LIGHTNING_PATH_FINDING_WORKERS > 0:
+                self.path_finding_pool = lnrouter.PathFindingPool(
+                    self.path_finder, num_workers=self.config.LIGHTNING_PATH_FINDING_WORKERS)
             self.channel_db.load_data()
             self.lngossip = lnworker.LNGossip(self.config)
             self.lngossip.start_network(self)
@@ -432,7 +451,11 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
             if full_shutdown:
                 await self.channel_db.stopped_event.wait()
             self.channel_db = None
+            await asyncio.to_thread(self.path_finder.liquidity_hints.save)
             self.path_finder = None
+            if self.path_finding_pool:
+                self.path_finding_pool.shutdown()
+                self.path_finding_pool = None
 
     @classmethod
     def run_from_another_thread(cls, coro: 'Coroutine[Any, Any, T]', *, timeout=None) -> T:
@@ -959,9 +982,19 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
         if not interface: return
         if interface.server == self.default_server:
             self._set_status(ConnectionState.DISCONNECTED)
+        if (limit := interface.request_limiter.get_learned_limit()) is not None:
+            self._request_concurrency_hints[interface.server] = limit
         await self._close_interface(interface)
         util.trigger_callback('network_updated')
 
+    def get_request_concurrency_hint(self, server: ServerAddr) -> Optional[int]:
+        """Request concurrency limit to start from when connecting to server."""
+        return self._request_concurrency_hints.get(server)
+
+    def get_request_concurrency_stats(self) -> Dict[str, dict]:
+        return {str(server): iface.request_limiter.get_stats()
+                for server, iface in list(self.interfaces.items())}
+
     def get_network_timeout_seconds(self, request_type=NetworkTimeout.Generic) -> int:
         if self.config.NETWORK_TIMEOUT:
             return self.config.NETWORK_TIMEOUT
@@ -1111,6 +1144,10 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
     @best_effort_reliable
     @catch_server_exceptions
     async def get_transaction(self, tx_hash: str, *, timeout=None) -> str:
+        # note: the interface also consults and fills the cache. we check it here too,
+        #       as a cache hit does not need a server connection.
+        if self.rawtx_cache and (raw := await run_in_thread(self.rawtx_cache.get, tx_hash)):
+            return raw.hex()
         if self.interface is None:  # handled by best_effort_reliable
             raise RequestTimedOut()
         return await self.interface.get_transaction(tx_hash=tx_hash, timeout=timeout)
@@ -1206,6 +1243,129 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
         """
         return self.blockchain().height()
 
+    # header chunks requested per interface, in one round of fast-forward header sync
+    MAX_HEADER_CHUNKS_PER_INTERFACE = 10
+    MAX_HEADER_CHUNKS = 50  # at most ~8 MB of headers in memory
+
+    def _get_interfaces_for_header_sync(self, primary: Interface, *, tip: int) -> Sequence[Interface]:
+        """Returns the interfaces to request headers from, up to height `tip`. `primary` is first."""
+        with self.interfaces_lock: interfaces = list(self.interfaces.values())
+        helpers = [iface for iface in interfaces
+                   if iface is not primary and iface.is_connected_and_ready() and iface.tip >= tip]
+        return [primary] + helpers
+
+    async def fast_forward_chain(self, primary: Interface, *, index0: int, tip: int) -> int:
+        """Requests chunks of headers starting at chunk `index0`, up to height `tip`,
+        and connects them to the blockchain of `primary`.
+        Returns number of headers we managed to connect, starting at height index0 * CHUNK_SIZE.
+
+        Chunks are requested from all interfaces that are at least at `tip`, in parallel,
+        and each chunk is verified and connected as soon as it and the chunks before it arrived.
+        `primary` decides what the chain is: a chunk from another server is only used if the hash
+        of its last header matches the one `primary` has at that height. A chunk from another
+        server that does not match or does not connect is requested again, from `primary`.
+        """
+        interfaces = self._get_interfaces_for_header_sync(primary, tip=tip)
+        # tradeoffs:
+        # - more chunks: higher memory requirements
+        # - more chunks: higher concurrency => syncing needs fewer network round-trips
+        # - if a chunk does not connect, bandwidth for all later chunks is wasted
+        num_chunks = min(self.MAX_HEADER_CHUNKS_PER_INTERFACE * len(interfaces), self.MAX_HEADER_CHUNKS)
+        chunks = []  # type: List[Tuple[int, int, int]]  # (index, start_height, count)
+        for index in range(index0, index0 + num_chunks):
+            start_height = index * CHUNK_SIZE
+            if start_height > tip:
+                break
+            end_height = min(start_height + CHUNK_SIZE - 1, tip)
+            chunks.append((index, start_height, end_height - start_height + 1))
+        todo = deque(chunks)
+        # index -> (headers, iface, exception). headers is None if the chunk could not be fetched
+        results = {index: self.asyncio_loop.create_future() for index, _, _ in chunks}
+        failed_helpers = set()  # type: Set[Interface]
+
+        async def fetch_chunks(iface: Interface):
+            while todo and iface not in failed_helpers:
+                index, start_height, count = todo.popleft()
+                try:
+                    headers = await iface.get_block_headers(start_height=start_height, count=count)
+                    if iface is not primary:
+                        if len(headers) != count:
+                            raise RequestCorrupted(f"got {len(headers)} headers, expected {count}")
+                        header = await primary.get_block_header(
+                            start_height + count - 1, mode=ChainResolutionMode.CATCHUP)
+                        if blockchain.hash_header(header) != blockchain.hash_raw_header(headers[-1]):
+                            raise RequestCorrupted(f"last header of chunk {index} differs from main server")
+                except Exception as e:
+                    if iface is not primary:
+                        self.logger.info(f"not using {iface.server} for header sync: {e!r}")
+                        failed_helpers.add(iface)
+                    results[index].set_result((None, iface, e))
+                    return
+                results[index].set_result((headers, iface, None))
+
+        num_headers = 0
+        async with OldTaskGroup() as group:
+            for _ in range(self.MAX_HEADER_CHUNKS_PER_INTERFACE):
+                for iface in interfaces:
+                    await group.spawn(fetch_chunks(iface))
+            # connect chunks in order, as they arrive
+            pos = 0
+            while pos < len(chunks):
+                index, start_height, count = chunks[pos]
+                headers, iface, exc = await results[index]
+                if iface is primary and exc is not None:
+                    raise exc
+                # the chunks after this one that already arrived are verified together with it
+                batch = []  # type: List[bytes]
+                for index2, _, _ in chunks[pos:]:
+                    if not results[index2].done() or (headers2 := results[index2].result()[0]) is None:
+                        break
+                    batch.append(b"".join(headers2))
+                num_connected = await self._connect_header_chunks(primary.blockchain, index, batch) if batch else 0
+                num_headers += sum(len(data) // HEADER_SIZE for data in batch[:num_connected])
+                pos += num_connected
+                if num_connected == len(batch) > 0:
+                    continue
+                # this chunk could not be fetched or does not connect
+                index, start_height, count = chunks[pos]
+                headers, iface, exc = results[index].result()
+                if iface is primary:
+                    if exc is not None:
+                        raise exc
+                    break
+                self.logger.info(f"requesting header chunk {index} again from {primary.server}")
+                headers = await primary.get_block_headers(start_height=start_height, count=count)
+                if not primary.blockchain.connect_chunk(index, data=b"".join(headers)):
+                    break
+                num_headers += len(headers)
+                pos += 1
+            await group.cancel_remaining()
+        return num_headers
+
+    def _get_headers_verify_executor(self) -> Optional[ProcessPoolExecutor]:
+        num_workers = self.config.NETWORK_HEADERS_VERIFY_WORKERS
+        if num_workers <= 0:
+            return None
+        if self._headers_verify_executor is None:
+            self._headers_verify_executor = ProcessPoolExecutor(max_workers=num_workers)
+            self.logger.info(f"started {num_workers} header verification workers")
+        return self._headers_verify_executor
+
+    async def _connect_header_chunks(self, chain: Blockchain, index0: int, chunks: Sequence[bytes]) -> int:
+        """Connects consecutive chunks to chain, verifying them in worker processes if enabled.
+        Returns the number of chunks connected.
+        """
+        executor = self._get_headers_verify_executor()
+        if executor is None or len(chunks) == 1:
+            return chain.connect_chunks(index0, chunks)
+        try:
+            return await run_in_thread(functools.partial(chain.connect_chunks, index0, chunks, executor=executor))
+        except BrokenProcessPool as e:
+            self.logger.warning(f"header verification workers failed: {e!r}. verifying in main process")
+            if self._headers_verify_executor is executor:
+                self._headers_verify_executor = None
+            return chain.connect_chunks(index0, chunks)
+
     def export_checkpoints(self, path):
         """Run manually to generate blockchain checkpoints.
         Kept for console use only.
@@ -1267,6 +1427,9 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
         self.taskgroup = None
         self.interface = None
         self.interfaces = {}
+        if self._headers_verify_executor is not None:
+            self._headers_verify_executor.shutdown(wait=False, cancel_futures=True)
+            self._headers_verify_executor = None
         self._connecting_ifaces.clear()
         self._closing_ifaces.clear()
         if not full_shutdown:
@@ -0,0 +1,156 @@
+# Electrum - lightweight Bitcoin client
+# Copyright (C) 2025 The Electrum Developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# On-disk cache of the pubkeys derived by the keystores of a wallet.
+#
+# File format:
+#   MAGIC, followed by one section per keystore:
+#     keystore fingerprint (32 bytes) | num entries (uint32)
+#     | entries: for_change (uint8) | n (uint32) | len(pubkey) (uint8) | pubkey
+#     | mac (32 bytes)
+#   The keystore fingerprint is sha256(mpk). The mac is HMAC-SHA256 over the
+#   section, keyed with the mpk, so that a section is only used for the
+#   master key it was derived from, and a corrupted section is ignored.
+
+import hashlib
+import os
+import stat
+import struct
+from typing import Sequence, Dict, Tuple, TYPE_CHECKING
+
+from .crypto import sha256, hmac_oneshot
+from .logging import get_logger
+from .util import os_chmod
+
+if TYPE_CHECKING:
+    from .keystore import MasterPublicKeyMixin
+
+
+_logger = get_logger(__name__)
+
+MAGIC = b'EPKC\x01'
+_ENTRY_HEADER = struct.Struct('>BIB')
+
+
+class PubkeyCacheFileException(Exception): pass
+
+
+def get_pubkey_cache_path(wallet_path: str) -> str:
+    return wallet_path + '.pubkeys'
+
+
+def _keystore_fingerprint(ks: 'MasterPublicKeyMixin') -> bytes:
+    return sha256(ks.get_master_public_key().encode('ascii'))
+
+
+def _mac(ks: 'MasterPublicKeyMixin', data: bytes) -> bytes:
+    return hmac_oneshot(ks.get_master_public_key().encode('ascii'), data, hashlib.sha256)
+
+
+def serialize_pubkey_cache(keystores: Sequence['MasterPublicKeyMixin']) -> bytes:
+    out = [MAGIC]
+    for ks in keystores:
+        pubkeys = ks.get_cached_pubkeys()
+        section = [_keystore_fingerprint(ks), struct.pack('>I', len(pubkeys))]
+        for (for_change, n), pubkey in sorted(pubkeys.items()):
+            section.append(_ENTRY_HEADER.pack(for_change, n, len(pubkey)))
+            section.append(pubkey)
+        section = b''.join(section)
+        out.append(section)
+        out.append(_mac(ks, section))
+    return b''.join(out)
+
+
+def deserialize_pubkey_cache(
+        data: bytes,
+        keystores: Sequence['MasterPublicKeyMixin'],
+) -> Dict['MasterPublicKeyMixin', Dict[Tuple[int, int], bytes]]:
+    """Returns the cached pubkeys for each keystore found in data.
+    Sections that fail the integrity check are skipped.
+    Raises PubkeyCacheFileException if data is malformed.
+    """
+    if not data.startswith(MAGIC):
+        raise PubkeyCacheFileException('unknown file format')
+    keystores_by_fp = {_keystore_fingerprint(ks): ks for ks in keystores}
+    result = {}
+    pos = len(MAGIC)
+    try:
+        while pos < len(data):
+            start = pos
+            fp = data[pos:pos+32]
+            num_entries, = struct.unpack_from('>I', data, pos + 32)
+            pos += 36
+            pubkeys = {}
+            for i in range(num_entries):
+                for_change, n, pubkey_len = _ENTRY_HEADER.unpack_from(data, pos)
+                pos += _ENTRY_HEADER.size
+                pubkeys[(for_change, n)] = data[pos:pos+pubkey_len]
+                pos += pubkey_len
+            section = data[start:pos]
+            mac = data[pos:pos+32]
+            pos += 32
+            if len(mac) != 32:
+                raise PubkeyCacheFileException('truncated file')
+            ks = keystores_by_fp.get(fp)
+            if ks is None:
+                continue
+            if _mac(ks, section) != mac:
+                _logger.warning(f'ignoring pubkey cache section of keystore {fp.hex()}: integrity check failed')
+                continue
+            result[ks] = pubkeys
+    except struct.error as e:
+        raise PubkeyCacheFileException('truncated file') from e
+    return result
+
+
+def read_pubkey_cache(path: str, keystores: Sequence['MasterPublicKeyMixin']) -> int:
+    """Adds the pubkeys found in the cache file to the in-memory caches of the keystores.
+    Returns the number of pubkeys loaded.
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return 0
+    try:
+        cached = deserialize_pubkey_cache(data, keystores)
+    except PubkeyCacheFileException as e:
+        _logger.warning(f'ignoring pubkey cache {path}: {e!r}')
+        return 0
+    for ks, pubkeys in cached.items():
+        ks.add_cached_pubkeys(pubkeys)
+    return sum(len(pubkeys) for pubkeys in cached.values())
+
+
+def write_pubkey_cache(path: str, keystores: Sequence['MasterPublicKeyMixin']) -> None:
+    data = serialize_pubkey_cache(keystores)
+    temp_path = "%s.tmp.%s" % (path, os.getpid())
+    with open(temp_path, "wb") as f:
+        try:
+            os_chmod(temp_path, stat.S_IREAD | stat.S_IWRITE)
+        except PermissionError as e:
+            _logger.warning(f"cannot chmod temp pubkey cache file: {e!r}")
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
@@ -0,0 +1,188 @@
+# Electrum - lightweight Bitcoin client
+# Copyright (C) 2025 The Electrum Developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# On-disk cache of raw transactions, shared by all wallets of the process,
+# and kept across restarts.
+#
+# Layout:
+#   <cache dir>/<txid[:2]>/<txid>, containing the raw tx bytes.
+#   Entries are content-addressed: on read, the txid of the contents is
+#   checked against the file name, and a mismatching entry is removed.
+#   The total size is bounded; when it is exceeded, the least recently
+#   used entries (by mtime, which is bumped on read) are evicted.
+#   The directory is scanned once, on first use, to build an in-memory index
+#   of the entries in LRU order; after that, the index is kept up to date.
+#
+# All methods do blocking file I/O: call them from a thread, not from the event loop.
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, TYPE_CHECKING, Dict
+
+from .logging import Logger
+from .transaction import Transaction
+from .util import is_hash256_str, make_dir
+
+if TYPE_CHECKING:
+    from .simple_config import SimpleConfig
+
+
+class RawTxCache(Logger):
+
+    # after exceeding max_size, we evict entries until this fraction of it is used
+    EVICT_TO_FRACTION = 0.9
+
+    def __init__(self, path: str, *, max_size: int):
+        Logger.__init__(self)
+        self.path = path
+        self.max_size = max_size  # in bytes
+        self.lock = threading.Lock()
+        self._index = None  # type: Optional[Dict[str, int]]  # txid -> size, least recently used first
+        self._total_size = 0
+        make_dir(self.path, allow_symlink=False)
+
+    @classmethod
+    def from_config(cls, config: 'SimpleConfig') -> Optional['RawTxCache']:
+        """Returns None if the cache is disabled."""
+        max_size_mb = config.NETWORK_RAWTX_CACHE_SIZE
+        if max_size_mb <= 0:
+            return None
+        return cls(os.path.join(config.path, 'rawtx_cache'), max_size=max_size_mb * 1_000_000)
+
+    def _get_entry_path(self, txid: str) -> str:
+        return os.path.join(self.path, txid[:2], txid)
+
+    def get(self, txid: str) -> Optional[bytes]:
+        if not is_hash256_str(txid):
+            return None
+        with self.lock:
+            self._load_index()
+            if txid not in self._index:
+                return None
+            self._index.move_to_end(txid)  # mark as recently used
+        path = self._get_entry_path(txid)
+        try:
+            with open(path, 'rb') as f:
+                raw = f.read()
+        except OSError as e:
+            if not isinstance(e, FileNotFoundError):  # e.g. removed by another process
+                self.logger.info(f"cannot read cached tx {txid}: {e!r}")
+            with self.lock:
+                self._remove_from_index(txid)
+            return None
+        try:
+            is_valid = Transaction(raw).txid() == txid
+        except Exception:
+            is_valid = False
+        if not is_valid:
+            self.logger.info(f"removing corrupted cache entry for tx {txid}")
+            with self.lock:
+                if self._remove_entry(path):
+                    self._remove_from_index(txid)
+            return None
+        try:
+            os.utime(path)  # so that the LRU order survives restarts
+        except OSError:
+            pass
+        return raw
+
+    def put(self, txid: str, raw: bytes) -> None:
+        """Adds a raw tx to the cache. The caller should have checked that it matches txid.
+        Never raises.
+        """
+        if not is_hash256_str(txid) or not raw or len(raw) > self.max_size:
+            return
+        path = self._get_entry_path(txid)
+        with self.lock:
+            self._load_index()
+            if txid in self._index:
+                return
+            try:
+                make_dir(os.path.dirname(path), allow_symlink=False)
+                temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(temp_path, 'wb') as f:
+                    f.write(raw)
+                os.replace(temp_path, path)
+            except OSError as e:
+                self.logger.info(f"cannot write cached tx {txid}: {e!r}")
+                return
+            self._index[txid] = len(raw)
+            self._total_size += len(raw)
+            if self._total_size > self.max_size:
+                self._evict()
+
+    def _load_index(self) -> None:
+        if self._index is not None:
+            return
+        entries = sorted(self._list_entries(), key=lambda entry: entry[2])
+        self._index = OrderedDict((os.path.basename(path), size) for path, size, _mtime in entries)
+        self._total_size = sum(self._index.values())
+        self.logger.debug(f"loaded index of {len(self._index)} txs ({self._total_size} bytes)")
+
+    def _remove_from_index(self, txid: str) -> None:
+        size = self._index.pop(txid, None)
+        if size is not None:
+            self._total_size -= size
+
+    def _list_entries(self):
+        """Yields (path, size, mtime) of all entries."""
+        try:
+            subdirs = list(os.scandir(self.path))
+        except OSError:
+            return
+        for subdir in subdirs:
+            if not subdir.is_dir(follow_symlinks=False):
+                continue
+            try:
+                files = list(os.scandir(subdir.path))
+            except OSError:
+                continue
+            for entry in files:
+                if not is_hash256_str(entry.name):
+                    continue  # e.g. leftover temp files
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                yield entry.path, st.st_size, st.st_mtime
+
+    def _evict(self) -> None:
+        target_size = int(self.max_size * self.EVICT_TO_FRACTION)
+        num_removed = 0
+        while self._index and self._total_size > target_size:
+            txid, size = self._index.popitem(last=False)
+            self._total_size -= size
+            if self._remove_entry(self._get_entry_path(txid)):
+                num_removed += 1
+        self.logger.debug(f"evicted {num_removed} txs. cache size is now {self._total_size} bytes")
+
+    def _remove_entry(self, path: str) -> bool:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            return True
+        except OSError as e:
+            self.logger.info(f"cannot remove cache entry {path}: {e!r}")
+            return False
+        return True
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+#
+# Times signing a large consolidation tx, offline.
+# usage: bench_sign_consolidation.py [num_inputs] [xtype] [num_workers]
+#   e.g. bench_sign_consolidation.py 1000 p2wpkh
+
+import sys
+import time
+import tempfile
+
+from electrum.bip32 import BIP32Node
+from electrum.fee_policy import FixedFeePolicy
+from electrum.simple_config import SimpleConfig
+from electrum.transaction import PartialTransaction, PartialTxInput, PartialTxOutput, TxOutpoint, Transaction
+from electrum.util import create_and_start_event_loop
+from electrum.wallet import restore_wallet_from_text
+
+
+num_inputs = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+xtype = sys.argv[2] if len(sys.argv) > 2 else 'p2wpkh'
+num_workers = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+
+loop, stopping_fut, loop_thread = create_and_start_event_loop()
+try:
+    config = SimpleConfig({'electrum_path': tempfile.mkdtemp()})
+    xprv = BIP32Node.from_rootseed(b'\x01' * 32, xtype=xtype).to_xprv()
+    t0 = time.perf_counter()
+    wallet = restore_wallet_from_text(xprv, path=None, config=config, gap_limit=num_inputs)['wallet']
+    print(f"created wallet with {num_inputs} addresses in {time.perf_counter() - t0:.3f} sec")
+
+    # fund every address from a few fake parent txs
+    addresses = wallet.get_receiving_addresses()[:num_inputs]
+    outputs_per_parent = 100
+    for i in range(0, num_inputs, outputs_per_parent):
+        txin = PartialTxInput(prevout=TxOutpoint((i + 1).to_bytes(32, 'big'), 0))
+        txin.script_sig = b''
+        outputs = [PartialTxOutput.from_address_and_value(addr, 10_000)
+                   for addr in addresses[i:i + outputs_per_parent]]
+        parent = PartialTransaction.from_io([txin], outputs)
+        wallet.adb.add_transaction(Transaction(parent.serialize_to_network(include_sigs=False)))
+
+    tx = wallet.make_unsigned_transaction(
+        coins=wallet.get_spendable_coins(),
+        outputs=[PartialTxOutput.from_address_and_value(addresses[0], '!')],
+        fee_policy=FixedFeePolicy(10_000),
+    )
+    assert len(tx.inputs()) == num_inputs
+
+    t0 = time.perf_counter()
+    wallet.sign_transaction(tx, None)
+    t_wallet = time.perf_counter() - t0
+    assert tx.is_complete()
+    print(f"wallet.sign_transaction: {num_inputs} {xtype} inputs in {t_wallet:.3f} sec")
+
+    # only the signing itself, given the private keys
+    tx = wallet.make_unsigned_transaction(
+        coins=wallet.get_spendable_coins(),
+        outputs=[PartialTxOutput.from_address_and_value(addresses[0], '!')],
+        fee_policy=FixedFeePolicy(10_000),
+    )
+    tx.add_info_from_wallet(wallet)
+    keypairs = wallet.keystore._get_private_keys(wallet.keystore._get_tx_derivations(tx), None)
+    t0 = time.perf_counter()
+    tx.sign(keypairs, num_workers=num_workers)
+    t_sign = time.perf_counter() - t0
+    assert tx.is_complete()
+    print(f"tx.sign (num_workers={num_workers}): {num_inputs} {xtype} inputs in {t_sign:.3f} sec")
+finally:
+    stopping_fut.get_loop().call_soon_threadsafe(stopping_fut.set_result, 1)
+    loop_thread.join(timeout=1)
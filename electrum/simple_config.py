@@ -667,7 +667,24 @@ class SimpleConfig(Logger):
         #   For Bitcoin, that is 4 M weight units, i.e. 4 MB on the p2p wire.
         #   Double that due to our JSON-RPC hex-encoding, plus overhead, that's 8+ MB.
     NETWORK_TIMEOUT = ConfigVar('network_timeout', default=None, type_=int)
+    # max number of history and merkle proof requests sent to the server in one JSON-RPC batch. 1 disables batching.
+    NETWORK_REQUEST_BATCH_SIZE = ConfigVar('network_request_batch_size', default=50, type_=int)
     NETWORK_BOOKMARKED_SERVERS = ConfigVar('network_bookmarked_servers', default=None)
+    # upper bound for the number of requests in flight to a single server.
+    # the actual limit adapts to how fast the server responds, see RequestConcurrencyLimiter.
+    NETWORK_MAX_REQUEST_CONCURRENCY = ConfigVar('network_max_request_concurrency', default=200, type_=int)
+    NETWORK_HEADERS_VERIFY_WORKERS = ConfigVar(
+        'network_headers_verify_workers', default=0, type_=int,
+        long_desc=lambda: _("""Number of worker processes used to verify block headers.
+If set, chunks of headers are verified in parallel, e.g. when catching up after being offline for a long time.
+With 0, headers are verified in the main process."""),
+    )
+    NETWORK_RAWTX_CACHE_SIZE = ConfigVar(
+        'network_rawtx_cache_size', default=0, type_=int,
+        long_desc=lambda: _("""Maximum size, in MB, of an on-disk cache of raw transactions fetched from the server.
+The cache is shared by all wallets and kept across restarts. Note that it is not encrypted,
+so it reveals which transactions your wallets are interested in. With 0, the cache is disabled."""),
+    )
 
     WALLET_MERGE_DUPLICATE_OUTPUTS = ConfigVar(
         'wallet_merge_duplicate_outputs', default=False, type_=bool,
@@ -724,6 +741,22 @@ to a previously-paid address of yours that would then be included with unrelated
         long_desc=lambda: _("""Allows partial updates to be written to disk for the wallet DB.
 If disabled, the full wallet file is written to disk for every change. Experimental."""),
     )
+    WALLET_SQL_HISTORY = ConfigVar(
+        'wallet_sql_history', default=False, type_=bool,
+        long_desc=lambda: _("""Store the transaction history maps of wallets in an SQLite file next to the wallet file,
+instead of keeping them in memory. Note that this file is not encrypted. Experimental."""),
+    )
+    WALLET_LAZY_LOAD = ConfigVar(
+        'wallet_lazy_load', default=False, type_=bool,
+        long_desc=lambda: _("""Keep large sections of the wallet DB (e.g. transactions) in serialized form
+until they are accessed. This makes opening large wallets faster. Experimental."""),
+    )
+    WALLET_PUBKEY_CACHE = ConfigVar(
+        'wallet_pubkey_cache', default=False, type_=bool,
+        long_desc=lambda: _("""Save the public keys derived by HD wallets in a file next to the wallet file,
+so that they do not need to be derived again when the wallet is reopened.
+Not used for wallets with encrypted storage. Experimental."""),
+    )
 
     FX_USE_EXCHANGE_RATE = ConfigVar('use_exchange_rate', default=False, type_=bool)
     FX_CURRENCY = ConfigVar('currency', default='EUR', type_=str)
@@ -783,6 +816,24 @@ Warning: setting this to too low will result in lots of payment failures."""),
         short_desc=lambda: _("Max lightning fees to pay for small payments"),
     )
 
+    LIGHTNING_PATH_FINDING_WORKERS = ConfigVar(
+        'lightning_path_finding_workers', default=0, type_=int,
+        long_desc=lambda: _("""Number of worker processes used to find payment paths with local routing (gossip).
+If set, the paths for all parts of a multi-part payment are searched for concurrently.
+With 0, paths are searched for in the main process, one part at a time."""),
+    )
+
+    LIGHTNING_LIQUIDITY_HINTS_MAX_AGE = ConfigVar(
+        'lightning_liquidity_hints_max_age', default=3600, type_=int,
+        long_desc=lambda: _("""For how long (in seconds) what we learned about the liquidity of channels during payment attempts is used for path finding.
+The liquidity hints are saved on disk, so this also applies across restarts."""),
+    )
+    LIGHTNING_LIQUIDITY_HINTS_HALF_LIFE = ConfigVar(
+        'lightning_liquidity_hints_half_life', default=0, type_=int,
+        long_desc=lambda: _("""If set, liquidity hints lose weight over time: every half-life (in seconds), the amount a channel is known to be able to forward is halved, and the amount it is known not to be able to forward is doubled.
+With 0, hints keep their full weight until they expire."""),
+    )
+
     LIGHTNING_NODE_ALIAS = ConfigVar('lightning_node_alias', default='', type_=str)
     LIGHTNING_NODE_COLOR_RGB = ConfigVar('lightning_node_color_rgb', default='000000', type_=str)
     EXPERIMENTAL_LN_FORWARD_PAYMENTS = ConfigVar('lightning_forward_payments', default=False, type_=bool)
@@ -71,6 +71,8 @@ class WalletStorage(Logger):
         self._allow_partial_writes = allow_partial_writes
         self.pubkey = None
         self.decrypted = ''
+        self._needs_full_write = False  # set if the file on disk cannot be appended to
+        self._last_line_hash = None  # type: Optional[bytes]  # journal records are bound to the line before them
         try:
             test_read_write_permissions(self.path)
         except IOError as e:
@@ -114,20 +116,34 @@ class WalletStorage(Logger):
             assert not os.path.exists(self.path)
         os.replace(temp_path, self.path)
         self._file_exists = True
+        self._needs_full_write = False
+        self._last_line_hash = crypto.sha256(s) if self.pubkey else None
         self.logger.info(f"saved {self.path}")
 
     def append(self, data: str) -> None:
-        """ append data to file. for the moment, only non-encrypted file"""
+        """Append data to file.
+        If the file is encrypted, data is sealed as a separate journal record,
+        written on a new line (see decrypt).
+        """
         assert self._allow_partial_writes
-        assert not self.is_encrypted()
+        assert not self._needs_full_write
+        if self.is_encrypted():
+            assert self.pubkey
+            record = self._seal_record(data)
+            s = '\n' + record
+        else:
+            s = data
         with open(self.path, "rb+") as f:
             pos = f.seek(0, os.SEEK_END)
             if pos != self.pos:
                 raise StorageOnDiskUnexpectedlyChanged(f"expected size {self.pos}, found {pos}")
-            f.write(data.encode("utf-8"))
+            f.write(s.encode("utf-8"))
             self.pos = f.seek(0, os.SEEK_END)
             f.flush()
             os.fsync(f.fileno())
+        if self.is_encrypted():
+            self.decrypted += data
+            self._last_line_hash = crypto.sha256(record)
 
     def _needs_consolidation(self):
         return self.pos > 2 * self.init_pos
@@ -136,7 +152,7 @@ class WalletStorage(Logger):
         """If false, next action can be a partial-write ('append')."""
         return (
             not self.file_exists()
-            or self.is_encrypted()
+            or self._needs_full_write
             or self._needs_consolidation()
             or not self._allow_partial_writes
         )
@@ -176,7 +192,8 @@ class WalletStorage(Logger):
 
     def _init_encryption_version(self):
         try:
-            magic = base64.b64decode(self.raw, validate=True)[0:4]
+            # encrypted files may have journal records appended, one per line
+            magic = base64.b64decode(self.raw.split('\n', 1)[0], validate=True)[0:4]
             if magic == b'BIE1':
                 return StorageEncryptionVersion.USER_PASSWORD
             elif magic == b'BIE2':
@@ -208,25 +225,77 @@ class WalletStorage(Logger):
         if self.is_past_initial_decryption():
             return
         ec_key = self.get_eckey_from_password(password)
+        last_line_hash = None
         if self.raw:
-            enc_magic = self._get_encryption_magic()
-            s = zlib.decompress(crypto.ecies_decrypt_message(ec_key, self.raw, magic=enc_magic))
-            s = s.decode('utf8')
+            blob, *records = self.raw.split('\n')
+            s = self._unseal(ec_key, blob)
+            last_line_hash = crypto.sha256(blob)
+            # Journal records, each sealed separately. They contain the
+            # json patches appended by JsonDB, in plaintext file format.
+            for i, record in enumerate(records):
+                try:
+                    data = self._unseal_record(ec_key, record, prev_line_hash=last_line_hash)
+                except Exception as e:
+                    raise WalletFileException(f"corrupt journal record in encrypted wallet file: {e!r}") from e
+                if data is None:
+                    if i < len(records) - 1:
+                        raise WalletFileException("incomplete journal record in encrypted wallet file")
+                    # incomplete last record, e.g. crash during append
+                    self.logger.warning("dropping incomplete journal record")
+                    self._needs_full_write = True
+                    break
+                s += data
+                last_line_hash = crypto.sha256(record)
         else:
             s = ''
         self.pubkey = ec_key.get_public_key_hex()
         self.decrypted = s
+        self._last_line_hash = last_line_hash
+
+    def _unseal(self, ec_key: ecc.ECPrivkey, sealed: str, *, prefix: bytes = b'') -> str:
+        """Raises InvalidPassword if the MAC does not match,
+        and WalletFileException if the decrypted data does not start with prefix.
+        """
+        enc_magic = self._get_encryption_magic()
+        c = crypto.ecies_decrypt_message(ec_key, sealed, magic=enc_magic)
+        if c[:len(prefix)] != prefix:
+            raise WalletFileException("unexpected prefix in sealed data")
+        s = zlib.decompress(c[len(prefix):])
+        return s.decode('utf8')
+
+    def _seal(self, plaintext: str, *, prefix: bytes = b'') -> str:
+        c = zlib.compress(bytes(plaintext, 'utf8'), level=zlib.Z_BEST_SPEED)
+        enc_magic = self._get_encryption_magic()
+        public_key = ecc.ECPubkey(bfh(self.pubkey))
+        s = crypto.ecies_encrypt_message(public_key, prefix + c, magic=enc_magic)
+        return s.decode('utf8')
+
+    # Journal records are written as "<length>:<sealed data>", so that a record
+    # truncated by a crash can be told apart from a corrupted one.
+    # The sealed data starts with the hash of the previous line of the file,
+    # so that records cannot be dropped, reordered or replayed.
+
+    def _seal_record(self, plaintext: str) -> str:
+        assert self._last_line_hash is not None
+        sealed = self._seal(plaintext, prefix=self._last_line_hash)
+        return f"{len(sealed)}:{sealed}"
+
+    def _unseal_record(self, ec_key: ecc.ECPrivkey, record: str, *, prev_line_hash: bytes) -> Optional[str]:
+        """Returns None if the record is incomplete.
+        Raises if it is complete, but cannot be authenticated.
+        """
+        length, sep, sealed = record.partition(':')
+        if not sep or not length.isdigit() or len(sealed) < int(length):
+            return None
+        if len(sealed) != int(length):
+            raise WalletFileException("unexpected length of journal record")
+        return self._unseal(ec_key, sealed, prefix=prev_line_hash)
 
     def encrypt_before_writing(self, plaintext: str) -> str:
         s = plaintext
         if self.pubkey:
             self.decrypted = plaintext
-            s = bytes(s, 'utf8')
-            c = zlib.compress(s, level=zlib.Z_BEST_SPEED)
-            enc_magic = self._get_encryption_magic()
-            public_key = ecc.ECPubkey(bfh(self.pubkey))
-            s = crypto.ecies_encrypt_message(public_key, c, magic=enc_magic)
-            s = s.decode('utf8')
+            s = self._seal(plaintext)
         return s
 
     def check_password(self, password: Optional[str]) -> None:
@@ -247,6 +316,8 @@ class WalletStorage(Logger):
             raise Exception("storage needs to be decrypted before changing password")
         if enc_version is None:
             enc_version = self._encryption_version
+        # the file on disk uses the old key (or none), so we cannot append to it
+        self._needs_full_write = True
         if password and enc_version != StorageEncryptionVersion.PLAINTEXT:
             ec_key = self.get_eckey_from_password(password)
             self.pubkey = ec_key.get_public_key_hex()
@@ -27,7 +27,7 @@ import threading
 import json
 from enum import IntEnum
 from collections import defaultdict
-from typing import TYPE_CHECKING, Optional, Sequence, List, Union, Any
+from typing import TYPE_CHECKING, Optional, Sequence, List, Union, Any, Dict
 
 
 if TYPE_CHECKING:
@@ -202,6 +202,12 @@ class StoredDict(dict, BaseStoredObject):
         # early return to prevent unnecessary disk writes
         if not is_new and self._db and json.dumps(v, cls=self._db.encoder) == json.dumps(self[key], cls=self._db.encoder):
             return
+        v = self._convert_value(key, v)
+        # set item
+        dict.__setitem__(self, key, v)
+        self.db_add(key, v) if is_new else self.db_replace(key, v)
+
+    def _convert_value(self, key: _FLEX_KEY, v) -> Any:
         # convert dict to StoredDict.
         if type(v) == dict and (self._db is None or self._db._should_convert_to_stored_dict(key)):
             v = StoredDict(v, self._db)
@@ -217,9 +223,7 @@ class StoredDict(dict, BaseStoredObject):
         # set parent
         if isinstance(v, BaseStoredObject):
             v.set_parent(key=key, parent=self)
-        # set item
-        dict.__setitem__(self, key, v)
-        self.db_add(key, v) if is_new else self.db_replace(key, v)
+        return v
 
     @locked
     def __delitem__(self, key: _FLEX_KEY) -> None:
@@ -251,6 +255,91 @@ class StoredDict(dict, BaseStoredObject):
         return self[key]
 
 
+class LazyStoredDict(StoredDict):
+    """StoredDict whose values are kept in their json form until first access.
+
+    Keys are converted when the dict is created, values are converted
+    (and wrapped into StoredDict/StoredList) one key at a time.
+    Used for large top-level sections of the db, see JsonDB.lazy_sections.
+    """
+
+    def __init__(self, data: dict, db: 'JsonDB', *, json_path: List[str]):
+        self.set_db(db)
+        self._json_path = json_path
+        self._lazy = {}  # type: Dict[_FLEX_KEY, str]  # key -> json key
+        for k, v in data.items():
+            key = db._convert_dict_key(json_path, k)
+            dict.__setitem__(self, key, v)
+            self._lazy[key] = k
+
+    def _materialize(self, key: _FLEX_KEY) -> None:
+        if key not in self._lazy:
+            return
+        with self.lock:
+            k = self._lazy.pop(key, None)
+            if k is None:
+                return
+            v = dict.__getitem__(self, key)
+            v = self._db._convert_dict_value(self._json_path + [k], v)
+            dict.__setitem__(self, key, self._convert_value(key, v))
+            self._db._on_lazy_section_touched(self._json_path[0])
+
+    def _materialize_all(self) -> None:
+        for key in list(self._lazy):
+            self._materialize(key)
+
+    def num_materialized(self) -> int:
+        return len(self) - len(self._lazy)
+
+    def get_unconverted(self, key: _FLEX_KEY, default=None) -> Any:
+        """Like get, but if the value was not accessed yet,
+        returns it in its json form, without converting it."""
+        return dict.get(self, key, default)
+
+    def __getitem__(self, key: _FLEX_KEY) -> Any:
+        self._materialize(key)
+        return dict.__getitem__(self, key)
+
+    def get(self, key: _FLEX_KEY, default=None) -> Any:
+        self._materialize(key)
+        return dict.get(self, key, default)
+
+    def __iter__(self):
+        # not inherited, so that dict(self) and {**self} go through __getitem__
+        return dict.__iter__(self)
+
+    @locked
+    def items(self):
+        # the json encoder calls items(). when dumping the db,
+        # values that were never accessed are written back as they are.
+        if not self._db.is_dumping():
+            self._materialize_all()
+        return dict.items(self)
+
+    def values(self):
+        self._materialize_all()
+        return dict.values(self)
+
+    def copy(self) -> dict:
+        self._materialize_all()
+        return dict.copy(self)
+
+    @locked
+    def pop(self, key: _FLEX_KEY, v=_RaiseKeyError) -> Any:
+        self._materialize(key)
+        return StoredDict.pop(self, key, v)
+
+    @locked
+    def __delitem__(self, key: _FLEX_KEY) -> None:
+        self._lazy.pop(key, None)
+        StoredDict.__delitem__(self, key)
+
+    @locked
+    def clear(self) -> None:
+        self._lazy.clear()
+        dict.clear(self)
+
+
 class StoredList(list, BaseStoredObject):
 
     def __init__(self, data, db: 'JsonDB'):
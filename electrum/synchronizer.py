@@ -87,6 +87,7 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
     def add(self, addr: str) -> None:
         if not is_address(addr): raise ValueError(f"invalid bitcoin address {neuter_bitcoin_address(addr)}")
         self._adding_addrs.add(addr)  # this lets is_up_to_date already know about addr
+        self.wake_up()
 
     async def _add_address(self, addr: str):
         try:
@@ -130,6 +131,7 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
             self.requested_addrs.discard(addr)  # ok for addr not to be present
             await self.taskgroup.spawn(self._on_address_status, addr, status)
             self._processed_some_notifications = True
+            self.wake_up()
 
     async def main(self):
         raise NotImplementedError()  # implemented by subclasses
@@ -202,6 +204,7 @@ class Synchronizer(SynchronizerBase):
             self._stale_histories.pop(addr, asyncio.Future()).cancel()
         finally:
             self._handling_addr_statuses.discard(addr)
+            self.wake_up()
         result = await self._maybe_request_history_for_addr(addr, ann_status=status)
         hist = list(map(lambda item: (item['tx_hash'], item['height']), result))
         if status != self._last_announced_status.get(addr):
@@ -231,6 +234,7 @@ class Synchronizer(SynchronizerBase):
 
         # Remove request; this allows up_to_date to be True
         self.requested_histories.discard((addr, status))
+        self.wake_up()
 
     async def _request_missing_txs(self, hist, *, allow_server_not_finding_tx=False):
         # "hist" is a list of [tx_hash, tx_height] lists
@@ -259,6 +263,7 @@ class Synchronizer(SynchronizerBase):
             # most likely, "No such mempool or blockchain transaction"
             if allow_server_not_finding_tx:
                 self.requested_tx.remove(tx_hash)
+                self.wake_up()
                 return
             else:
                 raise
@@ -270,6 +275,7 @@ class Synchronizer(SynchronizerBase):
         self.requested_tx.remove(tx_hash)
         self.adb.receive_tx_callback(tx)
         self.logger.info(f"received tx {tx_hash}. bytes-len: {len(raw_tx)//2}")
+        self.wake_up()
 
     async def main(self):
         self.adb.up_to_date_changed()
@@ -284,10 +290,11 @@ class Synchronizer(SynchronizerBase):
         for addr in random_shuffled_copy(self.adb.get_addresses()):
             await self._add_address(addr)
         # main loop
+        # Woken up when addresses are added, and when anything is_up_to_date
+        # depends on might have changed (requests answered, verifier progress).
         self._init_done = True
         prev_uptodate = False
         while True:
-            await asyncio.sleep(0.1)
             for addr in self._adding_addrs.copy(): # copy set to ensure iterator stability
                 await self._add_address(addr)
             up_to_date = self.adb.is_up_to_date()
@@ -297,6 +304,7 @@ class Synchronizer(SynchronizerBase):
                 self._processed_some_notifications = False
                 self.adb.up_to_date_changed()
             prev_uptodate = up_to_date
+            await self._wait_for_wakeup()
 
 
 class Notifier(SynchronizerBase):
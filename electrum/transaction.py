@@ -27,6 +27,7 @@
 
 import struct
 import io
+from concurrent.futures import ThreadPoolExecutor
 import base64
 from typing import (
     Sequence, Union, NamedTuple, Tuple, Optional, Iterable, Callable, List, Dict, Set, TYPE_CHECKING, Mapping, Any
@@ -268,12 +269,41 @@ class BIP341SharedTxDigestFields(NamedTuple):  # witness v1
         )
 
 
+class LegacySharedTxDigestFields(NamedTuple):  # pre-segwit
+    txins: bytes  # all inputs, with empty scriptSigs
+    txin_offsets: Sequence[int]  # start of each input in txins, followed by len(txins)
+    txouts: bytes
+
+    @classmethod
+    def from_tx(cls, tx: 'Transaction') -> 'LegacySharedTxDigestFields':
+        inputs = tx.inputs()
+        outputs = tx.outputs()
+        txins = bytearray(var_int(len(inputs)))
+        txin_offsets = []
+        for txin in inputs:
+            txin_offsets.append(len(txins))
+            txins += txin.serialize_to_network(script_sig=b"")
+        txin_offsets.append(len(txins))
+        txouts = var_int(len(outputs)) + b"".join(o.serialize_to_network() for o in outputs)
+        return LegacySharedTxDigestFields(
+            txins=bytes(txins),
+            txin_offsets=txin_offsets,
+            txouts=txouts,
+        )
+
+
 class SighashCache:
 
     def __init__(self):
+        self._legacy = None  # type: Optional[LegacySharedTxDigestFields]
         self._witver0 = None  # type: Optional[BIP143SharedTxDigestFields]
         self._witver1 = None  # type: Optional[BIP341SharedTxDigestFields]
 
+    def get_legacy_data_for_tx(self, tx: 'Transaction') -> LegacySharedTxDigestFields:
+        if self._legacy is None:
+            self._legacy = LegacySharedTxDigestFields.from_tx(tx)
+        return self._legacy
+
     def get_witver0_data_for_tx(self, tx: 'Transaction') -> BIP143SharedTxDigestFields:
         if self._witver0 is None:
             self._witver0 = BIP143SharedTxDigestFields.from_tx(tx)
@@ -318,11 +348,24 @@ class TxOutpoint(NamedTuple):
         return f"{self.txid.hex()[0:10]}:{self.out_idx}"
 
 
+class _LazyBytes:
+    """Slice of a raw tx, only copied out when first accessed."""
+    __slots__ = ('buf', 'start', 'end')
+
+    def __init__(self, buf: bytes, start: int, end: int):
+        self.buf = buf
+        self.start = start
+        self.end = end
+
+    def __bytes__(self) -> bytes:
+        return self.buf[self.start:self.end]
+
+
 class TxInput:
     prevout: TxOutpoint
-    script_sig: Optional[bytes]
+    _script_sig: Union[bytes, _LazyBytes, None]
     nsequence: int
-    witness: Optional[bytes]
+    _witness: Union[bytes, _LazyBytes, None]
     _is_coinbase_output: bool
 
     def __init__(self, *,
@@ -348,6 +391,26 @@ class TxInput:
 
         self._is_taproot = None  # type: Optional[bool]  # None means unknown
 
+    @property
+    def script_sig(self) -> Optional[bytes]:
+        if type(self._script_sig) is _LazyBytes:
+            self._script_sig = bytes(self._script_sig)
+        return self._script_sig
+
+    @script_sig.setter
+    def script_sig(self, value: Union[bytes, _LazyBytes, None]):
+        self._script_sig = value
+
+    @property
+    def witness(self) -> Optional[bytes]:
+        if type(self._witness) is _LazyBytes:
+            self._witness = bytes(self._witness)
+        return self._witness
+
+    @witness.setter
+    def witness(self, value: Union[bytes, _LazyBytes, None]):
+        self._witness = value
+
     def get_time_based_relative_locktime(self) -> Optional[int]:
         # see bip 68
         if self.nsequence & (1<<31):  # "disable" flag
@@ -399,6 +462,18 @@ class TxInput:
                 raise PSBTInputConsistencyFailure(f"PSBT input validation: "
                                                   f"If a non-witness UTXO is provided, its hash must match the hash specified in the prevout")
 
+    def has_info_beyond_serialization(self) -> bool:
+        """Whether fields were set that are not part of the network serialization of the input."""
+        return (self.block_height is not None
+                or self.block_txpos is not None
+                or self.spent_height is not None
+                or self.spent_txid is not None
+                or self._utxo is not None
+                or self.__scriptpubkey is not None
+                or self.__value_sats is not None
+                or self._is_coinbase_output
+                or self._is_taproot is not None)
+
     def is_coinbase_input(self) -> bool:
         """Whether this is the input of a coinbase tx."""
         return self.prevout.is_coinbase()
@@ -570,9 +645,12 @@ class BCDataStream(object):
     def write(self, _bytes: Union[bytes, bytearray]):  # Initialize with string of _bytes
         assert isinstance(_bytes, (bytes, bytearray))
         if self.input is None:
-            self.input = bytearray(_bytes)
+            # immutable input is not copied, so that we can read from it in place
+            self.input = _bytes if isinstance(_bytes, bytes) else bytearray(_bytes)
         else:
-            self.input += bytearray(_bytes)
+            if not isinstance(self.input, bytearray):
+                self.input = bytearray(self.input)
+            self.input += _bytes
 
     def read_string(self, encoding='ascii'):
         # Strings are encoded depending on length:
@@ -609,6 +687,22 @@ class BCDataStream(object):
         else:
             raise SerializationError('attempt to read past end of buffer')
 
+    def skip_bytes(self, length: int) -> None:
+        if self.input is None:
+            raise SerializationError("call write(bytes) before trying to deserialize")
+        assert length >= 0
+        if self.read_cursor + length > len(self.input):
+            raise SerializationError('attempt to read past end of buffer')
+        self.read_cursor += length
+
+    def read_bytes_lazy(self, length: int) -> Union[bytes, '_LazyBytes']:
+        """Like read_bytes, but does not copy the data if the input is immutable."""
+        if not isinstance(self.input, bytes):
+            return self.read_bytes(length)
+        start = self.read_cursor
+        self.skip_bytes(length)
+        return _LazyBytes(self.input, start, self.read_cursor)
+
     def write_bytes(self, _bytes: Union[bytes, bytearray], length: int):
         assert len(_bytes) == length, len(_bytes)
         self.write(_bytes)
@@ -869,28 +963,72 @@ def get_address_from_output_script(_bytes: bytes, *, net=None) -> Optional[str]:
 
 
 def parse_input(vds: BCDataStream) -> TxInput:
-    prevout_hash = vds.read_bytes(32)[::-1]
-    prevout_n = vds.read_uint32()
-    prevout = TxOutpoint(txid=prevout_hash, out_idx=prevout_n)
-    script_sig = vds.read_bytes(vds.read_compact_size())
+    prevout = _parse_prevout(vds)
+    script_sig = vds.read_bytes_lazy(vds.read_compact_size())
     nsequence = vds.read_uint32()
     return TxInput(prevout=prevout, script_sig=script_sig, nsequence=nsequence)
 
 
+def _parse_prevout(vds: BCDataStream) -> TxOutpoint:
+    prevout_hash = vds.read_bytes(32)[::-1]
+    prevout_n = vds.read_uint32()
+    return TxOutpoint(txid=prevout_hash, out_idx=prevout_n)
+
+
 def parse_witness(vds: BCDataStream, txin: TxInput) -> None:
+    # the serialized witness is the same as in the tx. we only walk over the elements.
+    start = vds.read_cursor
     n = vds.read_compact_size()
-    witness_elements = list(vds.read_bytes(vds.read_compact_size()) for i in range(n))
-    txin.witness = construct_witness(witness_elements)
+    for i in range(n):
+        vds.skip_bytes(vds.read_compact_size())
+    end = vds.read_cursor
+    vds.read_cursor = start
+    txin.witness = vds.read_bytes_lazy(end - start)
 
 
 def parse_output(vds: BCDataStream) -> TxOutput:
+    value = _parse_output_value(vds)
+    scriptpubkey = vds.read_bytes(vds.read_compact_size())
+    return TxOutput(value=value, scriptpubkey=scriptpubkey)
+
+
+def _parse_output_value(vds: BCDataStream) -> int:
     value = vds.read_int64()
     if value > TOTAL_COIN_SUPPLY_LIMIT_IN_BTC * COIN:
         raise SerializationError('invalid output amount (too large)')
     if value < 0:
         raise SerializationError('invalid output amount (negative)')
-    scriptpubkey = vds.read_bytes(vds.read_compact_size())
-    return TxOutput(value=value, scriptpubkey=scriptpubkey)
+    return value
+
+
+def parse_prevouts_and_output_values(raw: bytes) -> Tuple[List[TxOutpoint], List[int]]:
+    """Returns the prevouts and the output values of a raw network tx.
+    This is much faster than Transaction.deserialize, as scripts and witnesses are skipped.
+    """
+    vds = BCDataStream()
+    vds.write(raw)
+    vds.read_int32()  # version
+    n_vin = vds.read_compact_size()
+    if n_vin == 0:  # segwit
+        marker = vds.read_bytes(1)
+        if marker != b'\x01':
+            raise SerializationError('invalid txn marker byte: {}'.format(marker))
+        n_vin = vds.read_compact_size()
+    if n_vin < 1:
+        raise SerializationError('tx needs to have at least 1 input')
+    prevouts = []
+    for i in range(n_vin):
+        prevouts.append(_parse_prevout(vds))
+        vds.skip_bytes(vds.read_compact_size())  # script_sig
+        vds.skip_bytes(4)  # nsequence
+    n_vout = vds.read_compact_size()
+    if n_vout < 1:
+        raise SerializationError('tx needs to have at least 1 output')
+    values = []
+    for i in range(n_vout):
+        values.append(_parse_output_value(vds))
+        vds.skip_bytes(vds.read_compact_size())  # scriptpubkey
+    return prevouts, values
 
 
 # pay & redeem scripts
@@ -902,19 +1040,20 @@ def multisig_script(public_keys: Sequence[str], m: int) -> bytes:
 
 
 class Transaction:
-    _cached_network_ser: Optional[str]
+    _cached_network_ser_bytes: Optional[bytes]
 
     def __str__(self):
         return self.serialize()
 
     def __init__(self, raw):
         if raw is None:
-            self._cached_network_ser = None
+            self._cached_network_ser_bytes = None
         elif isinstance(raw, str):
-            self._cached_network_ser = raw.strip() if raw else None
-            assert is_hex_str(self._cached_network_ser)
+            raw = raw.strip()
+            assert is_hex_str(raw)
+            self._cached_network_ser_bytes = bytes.fromhex(raw) if raw else None
         elif isinstance(raw, (bytes, bytearray)):
-            self._cached_network_ser = raw.hex()
+            self._cached_network_ser_bytes = bytes(raw) if raw else None
         else:
             raise Exception(f"cannot initialize transaction from {raw}")
         self._inputs = None  # type: List[TxInput]
@@ -924,6 +1063,22 @@ class Transaction:
 
         self._cached_txid = None  # type: Optional[str]
 
+    def __deepcopy__(self, memo):
+        if (type(self) is Transaction and self._cached_network_ser_bytes
+                and not any(txin.has_info_beyond_serialization() for txin in (self._inputs or []))):
+            # Such a network tx is fully described by its serialization. Re-parsing it lazily
+            # is much cheaper than copying the deserialized inputs and outputs, which
+            # matters for PSBTs that contain the same large parent tx for many inputs.
+            tx = Transaction(self._cached_network_ser_bytes)
+            tx._cached_txid = self._cached_txid
+            memo[id(self)] = tx
+            return tx
+        tx = self.__class__.__new__(self.__class__)
+        memo[id(self)] = tx
+        for k, v in self.__dict__.items():
+            tx.__dict__[k] = copy.deepcopy(v, memo)
+        return tx
+
     @property
     def locktime(self):
         self.deserialize()
@@ -959,20 +1114,25 @@ class Transaction:
             self.deserialize()
         return self._inputs
 
+    def get_prevouts_and_output_values(self) -> Tuple[Sequence[TxOutpoint], Sequence[int]]:
+        """Does not deserialize the tx, if it is not deserialized yet."""
+        if self._inputs is None and self._cached_network_ser_bytes is not None:
+            return parse_prevouts_and_output_values(self._cached_network_ser_bytes)
+        return [txin.prevout for txin in self.inputs()], [txout.value for txout in self.outputs()]
+
     def outputs(self) -> Sequence[TxOutput]:
         if self._outputs is None:
             self.deserialize()
         return self._outputs
 
     def deserialize(self) -> None:
-        if self._cached_network_ser is None:
+        if self._cached_network_ser_bytes is None:
             return
         if self._inputs is not None:
             return
 
-        raw_bytes = bfh(self._cached_network_ser)
         vds = BCDataStream()
-        vds.write(raw_bytes)
+        vds.write(self._cached_network_ser_bytes)
         self._version = vds.read_int32()
         n_vin = vds.read_compact_size()
         is_segwit = (n_vin == 0)
@@ -1139,12 +1299,15 @@ class Transaction:
             if sighash != Sighash.ALL:
                 raise Exception(f"SIGHASH_FLAG ({sighash}) not supported! (for legacy sighash)")
             preimage_script = txin.get_scriptcode_for_sighash()
-            txins = var_int(len(inputs)) + b"".join(
-                txin.serialize_to_network(script_sig=preimage_script if txin_index==k else b"")
-                for k, txin in enumerate(inputs))
-            txouts = var_int(len(outputs)) + b"".join(o.serialize_to_network() for o in outputs)
+            scache = sighash_cache.get_legacy_data_for_tx(self)
+            # splice our input, with the scriptCode as scriptSig, into the shared serialization
+            start = scache.txin_offsets[txin_index]
+            end = scache.txin_offsets[txin_index + 1]
+            txins = (scache.txins[:start]
+                     + txin.serialize_to_network(script_sig=preimage_script)
+                     + scache.txins[end:])
             nHashType = int.to_bytes(sighash, length=4, byteorder="little", signed=False)
-            preimage = nVersion + txins + txouts + nLocktime + nHashType
+            preimage = nVersion + txins + scache.txouts + nLocktime + nHashType
             return preimage
         raise Exception("should not reach this")
 
@@ -1172,16 +1335,16 @@ class Transaction:
                    for txin in self.inputs())
 
     def invalidate_ser_cache(self):
-        self._cached_network_ser = None
+        self._cached_network_ser_bytes = None
         self._cached_txid = None
 
     def serialize(self) -> str:
-        if not self._cached_network_ser:
-            self._cached_network_ser = self.serialize_to_network(estimate_size=False, include_sigs=True)
-        return self._cached_network_ser
+        return Transaction.serialize_as_bytes(self).hex()
 
     def serialize_as_bytes(self) -> bytes:
-        return bfh(self.serialize())
+        if not self._cached_network_ser_bytes:
+            self._cached_network_ser_bytes = bfh(self.serialize_to_network(estimate_size=False, include_sigs=True))
+        return self._cached_network_ser_bytes
 
     def serialize_to_network(self, *, estimate_size=False, include_sigs=True, force_legacy=False) -> str:
         """Serialize the transaction as used on the Bitcoin network, into hex.
@@ -1406,10 +1569,10 @@ class Transaction:
 
     def estimated_total_size(self):
         """Return an estimated total transaction size in bytes."""
-        if not self.is_complete() or self._cached_network_ser is None:
+        if not self.is_complete() or self._cached_network_ser_bytes is None:
             return len(self.serialize_to_network(estimate_size=True)) // 2
         else:
-            return len(self._cached_network_ser) // 2  # ASCII hex string
+            return len(self._cached_network_ser_bytes)
 
     def estimated_witness_size(self):
         """Return an estimate of witness size in bytes."""
@@ -2483,19 +2646,42 @@ class PartialTransaction(Transaction):
             self._outputs.sort(key = lambda o: (o.value, o.scriptpubkey))
         self.invalidate_ser_cache()
 
-    def sign(self, keypairs: Mapping[bytes, bytes]) -> None:
+    def sign(self, keypairs: Mapping[bytes, bytes], *, num_workers: int = 1) -> None:
+        """Signs all inputs we have keys for.
+        The preimages of all inputs are computed in one pass, and then signed as a batch.
+        If num_workers > 1, the signing is done in a thread pool (libsecp256k1 releases the GIL).
+        """
         # keypairs:  pubkey_bytes -> secret_bytes
         sighash_cache = SighashCache()
+        jobs = []  # type: List[Tuple[int, bytes, bytes, bytes]]  # (txin_idx, pubkey, secret, preimage)
         for i, txin in enumerate(self.inputs()):
-            for pubkey in txin.pubkeys:
-                if txin.is_complete():
-                    break
-                if pubkey not in keypairs:
-                    continue
-                _logger.info(f"adding signature for {pubkey.hex()}. spending utxo {txin.prevout.to_str()}")
-                sec = keypairs[pubkey]
-                sig = self.sign_txin(i, sec, sighash_cache=sighash_cache)
-                self.add_signature_to_txin(txin_idx=i, signing_pubkey=pubkey, sig=sig)
+            if txin.is_complete():
+                continue
+            pubkeys = [pubkey for pubkey in txin.pubkeys if pubkey in keypairs]
+            if not pubkeys:
+                continue
+            txin.validate_data(for_signing=True)
+            pre_hash = self.serialize_preimage(i, sighash_cache=sighash_cache)
+            for pubkey in pubkeys:
+                jobs.append((i, pubkey, keypairs[pubkey], pre_hash))
+
+        def sign_job(job):
+            i, pubkey, sec, pre_hash = job
+            return self._sign_preimage(self._inputs[i], sec, pre_hash)
+
+        if num_workers > 1 and len(jobs) > 1:
+            with ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='tx_sign') as executor:
+                sigs = list(executor.map(sign_job, jobs))
+        else:
+            sigs = list(map(sign_job, jobs))
+
+        for (i, pubkey, sec, pre_hash), sig in zip(jobs, sigs):
+            txin = self._inputs[i]
+            if txin.is_complete():
+                # e.g. multisig where we have more keys than needed
+                continue
+            _logger.info(f"adding signature for {pubkey.hex()}. spending utxo {txin.prevout.to_str()}")
+            self.add_signature_to_txin(txin_idx=i, signing_pubkey=pubkey, sig=sig)
 
         _logger.debug(f"tx.sign() finished. is_complete={self.is_complete()}")
         self.invalidate_ser_cache()
@@ -2510,6 +2696,10 @@ class PartialTransaction(Transaction):
         txin = self.inputs()[txin_index]
         txin.validate_data(for_signing=True)
         pre_hash = self.serialize_preimage(txin_index, sighash_cache=sighash_cache)
+        return self._sign_preimage(txin, privkey_bytes, pre_hash)
+
+    @classmethod
+    def _sign_preimage(cls, txin: 'PartialTxInput', privkey_bytes: bytes, pre_hash: bytes) -> bytes:
         if txin.is_taproot():
             # note: privkey_bytes is the internal key
             merkle_root = txin.tap_merkle_root or bytes()
@@ -1538,6 +1538,8 @@ class NetworkJobOnDefaultServer(Logger, ABC):
         # Ensure fairness between NetworkJobs. e.g. if multiple wallets
         # are open, a large wallet's Synchronizer should not starve the small wallets:
         self._network_request_semaphore = asyncio.Semaphore(100)
+        # main loops wait on this instead of polling, see wake_up()
+        self._wakeup_event = asyncio.Event()
 
         self._reset()
         # every time the main interface changes, restart:
@@ -1596,6 +1598,19 @@ class NetworkJobOnDefaultServer(Logger, ABC):
             self._reset()
             await self._start(interface)
 
+    def wake_up(self) -> None:
+        """Tell the job there might be new work to do.
+        Can be called from any thread.
+        """
+        self.network.asyncio_loop.call_soon_threadsafe(self._wakeup_event.set)
+
+    async def _wait_for_wakeup(self) -> None:
+        """Wait until wake_up() has been called since the last time we returned.
+        Wake-ups that happen while the caller is busy are not lost.
+        """
+        await self._wakeup_event.wait()
+        self._wakeup_event.clear()
+
     def reset_request_counters(self):
         self._requests_sent = 0
         self._requests_answered = 0
@@ -26,7 +26,7 @@ from typing import Sequence, Optional, TYPE_CHECKING
 
 import aiorpcx
 
-from .util import TxMinedInfo, NetworkJobOnDefaultServer
+from .util import TxMinedInfo, NetworkJobOnDefaultServer, EventListener, event_listener
 from .crypto import sha256d
 from .bitcoin import hash_decode, hash_encode
 from .transaction import Transaction
@@ -46,12 +46,13 @@ class InnerNodeOfSpvProofIsValidTx(MerkleVerificationFailure): pass
 class LeftSiblingDuplicate(MerkleVerificationFailure): pass
 
 
-class SPV(NetworkJobOnDefaultServer):
+class SPV(NetworkJobOnDefaultServer, EventListener):
     """ Simple Payment Verification """
 
     def __init__(self, network: 'Network', wallet: 'AddressSynchronizer'):
         self.wallet = wallet
         NetworkJobOnDefaultServer.__init__(self, network)
+        self.register_callbacks()
 
     def _reset(self):
         super()._reset()
@@ -63,15 +64,26 @@ class SPV(NetworkJobOnDefaultServer):
         async with taskgroup as group:
             await group.spawn(self.main)
 
+    async def stop(self, *, full_shutdown: bool = True):
+        if full_shutdown:
+            self.unregister_callbacks()
+        await super().stop(full_shutdown=full_shutdown)
+
     def diagnostic_name(self):
         return self.wallet.diagnostic_name()
 
+    @event_listener
+    def on_event_blockchain_updated(self, *args):
+        # new headers might let us verify txs, or there was a reorg
+        self.wake_up()
+
     async def main(self):
         self.blockchain = self.network.blockchain()
         while True:
             await self._maybe_undo_verifications()
             await self._request_proofs()
-            await asyncio.sleep(0.1)
+            # woken up by the wallet for new unverified txs, and by new headers
+            await self._wait_for_wakeup()
 
     async def _request_proofs(self):
         local_height = self.blockchain.height()
@@ -89,13 +101,17 @@ class SPV(NetworkJobOnDefaultServer):
             if header is None:
                 if tx_height <= constants.net.max_checkpoint():
                     # FIXME these requests are not counted (self._requests_sent += 1)
-                    await self.taskgroup.spawn(self.interface.request_chunk_below_max_checkpoint(height=tx_height))
+                    await self.taskgroup.spawn(self._request_chunk_below_max_checkpoint(tx_height))
                 continue
             # request now
             self.logger.info(f'requested merkle {tx_hash}')
             self.requested_merkle.add(tx_hash)
             await self.taskgroup.spawn(self._request_and_verify_single_proof, tx_hash, tx_height)
 
+    async def _request_chunk_below_max_checkpoint(self, height: int) -> None:
+        if await self.interface.request_chunk_below_max_checkpoint(height=height):
+            self.wake_up()
+
     async def _request_and_verify_single_proof(self, tx_hash, tx_height):
         try:
             self._requests_sent += 1
@@ -105,6 +121,7 @@ class SPV(NetworkJobOnDefaultServer):
             self.logger.info(f'tx {tx_hash} not at height {tx_height}')
             self.wallet.remove_unverified_tx(tx_hash, tx_height)
             self.requested_merkle.discard(tx_hash)
+            self.wake_up()  # in case the wallet has a new height for it
             return
         finally:
             self._requests_answered += 1
@@ -61,15 +61,19 @@ from .util import (
 )
 from .bitcoin import COIN, is_address, is_minikey, relayfee, dust_threshold, DummyAddress, DummyAddressUsedInTxException
 from .keystore import (
-    load_keystore, Hardware_KeyStore, KeyStore, KeyStoreWithMPK, AddressIndexGeneric, CannotDerivePubkey
+    load_keystore, Hardware_KeyStore, KeyStore, KeyStoreWithMPK, AddressIndexGeneric, CannotDerivePubkey,
+    MasterPublicKeyMixin,
 )
 from .simple_config import SimpleConfig
 from .fee_policy import FeePolicy, FixedFeePolicy, FEE_RATIO_HIGH_WARNING, FEERATE_WARNING_HIGH_FEE
 from .stored_dict import StorageEncryptionVersion
 from .storage import  WalletStorage
+from .pubkey_cache import get_pubkey_cache_path, read_pubkey_cache, write_pubkey_cache
 from .wallet_db import WalletDB
+from .wallet_sql_db import SqlWalletDB
 from .transaction import (
-    Transaction, TxInput, TxOutput, PartialTransaction, PartialTxInput, PartialTxOutput, TxOutpoint, Sighash
+    Transaction, TxInput, TxOutput, PartialTransaction, PartialTxInput, PartialTxOutput, TxOutpoint, Sighash,
+    SighashCache,
 )
 from .plugin import run_hook
 from .address_synchronizer import (
@@ -426,6 +430,7 @@ class Abstract_Wallet(ABC, Logger, EventListener):
         self._tx_parents_cache = {}
         self._paid_invoice_keys_cache = set()  # type: Set[str]
         self._coin_price_cache = {}
+        self._coin_weight_cache = {}  # type: Dict[Tuple[str, str], Tuple[int, bool]]  # see CoinChooserBase._get_input_weight
         self._default_labels = {}
         self._accounting_addresses = set()  # addresses counted as ours after successful sweep
 
@@ -1236,17 +1241,13 @@ class Abstract_Wallet(ABC, Logger, EventListener):
         now = time.time()
         transactions = OrderedDictWithIndex()
         monotonic_timestamp = 0
-        for hist_item in self.adb.get_history(domain=domain):
+        # the height range is applied by the history index; unconfirmed txs sort last
+        for hist_item in self.adb.get_history(domain=domain, from_height=from_height, to_height=to_height):
             timestamp = (hist_item.tx_mined_status.timestamp or TX_TIMESTAMP_INF)
-            height = hist_item.tx_mined_status.height()
             if from_timestamp and (timestamp or now) < from_timestamp:
                 continue
             if to_timestamp and (timestamp or now) >= to_timestamp:
                 continue
-            if from_height is not None and from_height > height > 0:
-                continue
-            if to_height is not None and (height >= to_height or height <= 0):
-                continue
             monotonic_timestamp = max(monotonic_timestamp, timestamp)
             txid = hist_item.txid
             group_id = groups.get(txid)
@@ -2031,7 +2032,7 @@ class Abstract_Wallet(ABC, Logger, EventListener):
 
         if len(i_max) == 0:
             # Let the coin chooser select the coins to spend
-            coin_chooser = coinchooser.get_coin_chooser(self.config)
+            coin_chooser = coinchooser.get_coin_chooser(self.config, input_weight_cache=self._coin_weight_cache)
             # If there is an unconfirmed RBF tx, merge with it
             if base_tx:
                 assert base_tx.txid() is not None  # pre-segwit and incomplete?
@@ -2416,7 +2417,7 @@ class Abstract_Wallet(ABC, Logger, EventListener):
             self.add_input_info(item)
         def fee_estimator(size):
             return FeePolicy.estimate_fee_for_feerate(fee_per_kb=new_fee_rate*1000, size=size)
-        coin_chooser = coinchooser.get_coin_chooser(self.config)
+        coin_chooser = coinchooser.get_coin_chooser(self.config, input_weight_cache=self._coin_weight_cache)
         try:
             return coin_chooser.make_tx(
                 coins=coins,
@@ -2801,11 +2802,12 @@ class Abstract_Wallet(ABC, Logger, EventListener):
             batch.add_sweep_info_to_tx(tx)
 
         # sign with make_witness
+        sighash_cache = SighashCache()
         for i, txin in enumerate(tx.inputs()):
             if hasattr(txin, 'make_witness'):
                 self.logger.info(f'sign_transaction: adding witness using make_witness')
                 privkey = txin.privkey
-                sig = tx.sign_txin(i, privkey)
+                sig = tx.sign_txin(i, privkey, sighash_cache=sighash_cache)
                 txin.script_sig = b''
                 txin.witness = txin.make_witness(sig)
                 assert txin.is_complete()
@@ -3227,6 +3229,9 @@ class Abstract_Wallet(ABC, Logger, EventListener):
         # save changes. force full rewrite to rm remnants of old password
         if self.storage and self.storage.file_exists():
             self.db.write_and_force_consolidation()
+        # do not leak our history next to an encrypted wallet file
+        if self.storage and self.storage.is_encrypted() and isinstance(self.db, SqlWalletDB):
+            self.db.move_history_to_json()
         # if wallet was previously unlocked, reset password_in_memory
         self.lock_wallet()
 
@@ -4092,10 +4097,57 @@ class Deterministic_Wallet(Abstract_Wallet):
         Abstract_Wallet.__init__(self, db, config=config)
         self.gap_limit = db.get('gap_limit', 20)
         self.gap_limit_for_change = db.get('gap_limit_for_change', 10)
+        self._pubkey_cache_path = None  # type: Optional[str]
+        self._num_pubkeys_in_cache_file = 0
+        if config.WALLET_PUBKEY_CACHE and self.storage and not self.storage.is_encrypted():
+            self._pubkey_cache_path = get_pubkey_cache_path(self.storage.path)
+        self._update_pubkey_cache_size()
+        if self._pubkey_cache_path:
+            self._num_pubkeys_in_cache_file = read_pubkey_cache(self._pubkey_cache_path, self._get_mpk_keystores())
+            self.logger.info(f"loaded {self._num_pubkeys_in_cache_file} pubkeys from cache")
         # generate addresses now. note that without libsecp this might block
         # for a few seconds!
         self.synchronize()
 
+    def _get_mpk_keystores(self) -> Sequence[MasterPublicKeyMixin]:
+        return [ks for ks in self.get_keystores() if isinstance(ks, MasterPublicKeyMixin)]
+
+    def _update_pubkey_cache_size(self, *, num_new_addresses: int = 0) -> None:
+        # the pubkey caches should be able to hold all our addresses,
+        # with some headroom for new ones
+        num_addresses = self.db.num_receiving_addresses() + self.db.num_change_addresses() + num_new_addresses
+        for ks in self._get_mpk_keystores():
+            ks.set_pubkey_cache_size(num_addresses + num_addresses // 4)
+
+    def save_pubkey_cache(self) -> None:
+        if not self._pubkey_cache_path:
+            return
+        keystores = self._get_mpk_keystores()
+        num_pubkeys = sum(len(ks.get_cached_pubkeys()) for ks in keystores)
+        if num_pubkeys <= self._num_pubkeys_in_cache_file:
+            return
+        try:
+            write_pubkey_cache(self._pubkey_cache_path, keystores)
+        except OSError as e:
+            self.logger.warning(f"failed to save pubkey cache: {e!r}")
+            return
+        self._num_pubkeys_in_cache_file = num_pubkeys
+        self.logger.info(f"saved {num_pubkeys} pubkeys to cache")
+
+    async def stop(self):
+        try:
+            await super().stop()
+        finally:
+            self.save_pubkey_cache()
+
+    def update_password(self, old_pw, new_pw, *, encrypt_storage: bool = True, xpub_encrypt: bool = False):
+        super().update_password(old_pw, new_pw, encrypt_storage=encrypt_storage, xpub_encrypt=xpub_encrypt)
+        # do not leak our pubkeys next to an encrypted wallet file
+        if self._pubkey_cache_path and self.storage.is_encrypted():
+            if os.path.exists(self._pubkey_cache_path):
+                os.unlink(self._pubkey_cache_path)
+            self._pubkey_cache_path = None
+
     def _init_lnworker(self):
         # lightning_privkey2 is not deterministic (legacy wallets, bip39)
         ln_xprv = self.db.get('lightning_xprv') or self.db.get('lightning_privkey2')
@@ -4190,6 +4242,11 @@ class Deterministic_Wallet(Abstract_Wallet):
         pubkeys = self.derive_pubkeys(for_change, n)
         return self.pubkeys_to_address(pubkeys)
 
+    def derive_addresses(self, for_change: int, start: int, count: int) -> Sequence[str]:
+        """Returns the addresses at indices start, ..., start+count-1."""
+        for_change = int(for_change)
+        return [self.derive_address(for_change, n) for n in range(start, start + count)]
+
     def export_private_key_for_path(self, path: Union[Sequence[int], str], password: Optional[str]) -> str:
         if isinstance(path, str):
             path = convert_bip32_strpath_to_intpath(path)
@@ -4214,16 +4271,21 @@ class Deterministic_Wallet(Abstract_Wallet):
             txinout.bip32_paths[pubkey] = (fp_bytes, der_full)
 
     def create_new_address(self, for_change: bool = False):
+        return self.create_new_addresses(for_change, 1)[0]
+
+    def create_new_addresses(self, for_change: bool, count: int) -> Sequence[str]:
         assert type(for_change) is bool
         with self.lock:
             n = self.db.num_change_addresses() if for_change else self.db.num_receiving_addresses()
-            address = self.derive_address(int(for_change), n)
-            self.db.add_change_address(address) if for_change else self.db.add_receiving_address(address)
-            self.adb.add_address(address)
-            if for_change:
-                # note: if it's actually "old", it will get filtered later
-                self._not_old_change_addresses.append(address)
-            return address
+            self._update_pubkey_cache_size(num_new_addresses=count)
+            addresses = self.derive_addresses(int(for_change), n, count)
+            for address in addresses:
+                self.db.add_change_address(address) if for_change else self.db.add_receiving_address(address)
+                self.adb.add_address(address)
+                if for_change:
+                    # note: if it's actually "old", it will get filtered later
+                    self._not_old_change_addresses.append(address)
+            return addresses
 
     def synchronize_sequence(self, for_change: bool) -> int:
         count = 0  # num new addresses we generated
@@ -4231,16 +4293,21 @@ class Deterministic_Wallet(Abstract_Wallet):
         while True:
             num_addr = self.db.num_change_addresses() if for_change else self.db.num_receiving_addresses()
             if num_addr < limit:
-                count += 1
-                self.create_new_address(for_change)
+                count += limit - num_addr
+                self.create_new_addresses(for_change, limit - num_addr)
                 continue
             if for_change:
                 last_few_addresses = self.get_change_addresses(slice_start=-limit)
             else:
                 last_few_addresses = self.get_receiving_addresses(slice_start=-limit)
-            if any(map(self.adb.address_is_old, last_few_addresses)):
-                count += 1
-                self.create_new_address(for_change)
+            # we need 'limit' unused addresses after the last old one
+            num_needed = 0
+            for i, addr in enumerate(last_few_addresses):
+                if self.adb.address_is_old(addr):
+                    num_needed = i + 1
+            if num_needed:
+                count += num_needed
+                self.create_new_addresses(for_change, num_needed)
             else:
                 break
         return count
@@ -4354,6 +4421,11 @@ class Standard_Wallet(Simple_Wallet, Deterministic_Wallet):
     def derive_pubkeys(self, c, i):
         return [self.keystore.derive_pubkey(c, i).hex()]
 
+    def derive_addresses(self, for_change, start, count):
+        for_change = int(for_change)
+        pubkeys = self.keystore.derive_pubkeys(for_change, start, count)
+        return [self.pubkeys_to_address([pubkey.hex()]) for pubkey in pubkeys]
+
     def pubkeys_to_address(self, pubkeys):
         pubkey = pubkeys[0]
         return bitcoin.pubkey_to_address(self.txin_type, pubkey)
@@ -4403,6 +4475,12 @@ class Multisig_Wallet(Deterministic_Wallet):
     def derive_pubkeys(self, c, i):
         return [k.derive_pubkey(c, i).hex() for k in self.get_keystores()]
 
+    def derive_addresses(self, for_change, start, count):
+        for_change = int(for_change)
+        pubkeys_per_keystore = [k.derive_pubkeys(for_change, start, count) for k in self.get_keystores()]
+        return [self.pubkeys_to_address([pubkey.hex() for pubkey in pubkeys])
+                for pubkeys in zip(*pubkeys_per_keystore)]
+
     def load_keystore(self):
         self.keystores = {}  # type: Dict[str, KeyStore]
         for i in range(self.n):
@@ -22,6 +22,7 @@
 # ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+import base64
 import datetime
 import json
 import copy
@@ -35,7 +36,7 @@ import attr
 
 from . import bitcoin
 from . import constants
-from .util import profiler, WalletFileException, multisig_type, TxMinedInfo, MyEncoder
+from .util import profiler, WalletFileException, multisig_type, TxMinedInfo, MyEncoder, is_hex_str
 from .keystore import bip44_derivation
 from .transaction import Transaction, TxOutpoint, tx_from_any, PartialTransaction, PartialTxOutput, BadHeaderMagic
 from .logging import Logger
@@ -43,7 +44,7 @@ from .logging import Logger
 from .lnutil import HTLCOwner, ChannelType, RecvMPPResolution
 from .json_db import JsonDB, locked, modifier
 from . import stored_dict
-from .stored_dict import StoredObject, stored_at, register_key, register_name
+from .stored_dict import StoredObject, LazyStoredDict, stored_at, register_key, register_name
 from .plugin import run_hook, plugin_loaders
 from .version import ELECTRUM_VERSION
 from .i18n import _
@@ -71,7 +72,7 @@ class WalletUnfinished(WalletFileException):
 # seed_version is now used for the version of the wallet file
 OLD_SEED_VERSION = 4        # electrum versions < 2.0
 NEW_SEED_VERSION = 11       # electrum versions >= 2.0
-FINAL_SEED_VERSION = 71     # electrum >= 2.7 will set this to prevent
+FINAL_SEED_VERSION = 72     # electrum >= 2.7 will set this to prevent
                             # old versions from overwriting new format
 
 
@@ -103,8 +104,32 @@ class DBMetadata(StoredObject):
 class WalletFileExceptionVersion51(WalletFileException): pass
 
 
+def is_psbt_db_str(x: str) -> bool:
+    return x[0:6] == 'cHNidP'  # base64 psbt
+
+
+def tx_from_db_str(x: str) -> Transaction:
+    """Complete transactions are stored as base64 of the raw tx, partial ones as base64 PSBT."""
+    if is_psbt_db_str(x):
+        return tx_from_any(x, deserialize=False, sanitize=False)
+    return Transaction(base64.b64decode(x))
+
+
+def tx_to_db_str(tx: Transaction) -> str:
+    if isinstance(tx, PartialTransaction):
+        return tx.serialize()
+    return base64.b64encode(tx.serialize_as_bytes()).decode('ascii')
+
+
+class WalletDBEncoder(MyEncoder):
+    def default(self, obj):
+        if isinstance(obj, Transaction):
+            return tx_to_db_str(obj)
+        return super().default(obj)
+
+
 # register dicts that require value conversions not handled by constructor
-register_name('/transactions/*', None, lambda x: tx_from_any(x, deserialize=False, sanitize=False))
+register_name('/transactions/*', None, tx_from_db_str)
 register_name('/channels/*/data_loss_protect_remote_pcp/*', None, lambda x: bytes.fromhex(x))
 register_name('/channels/*/onion_keys/*', None, lambda x: bytes.fromhex(x))
 # register tuples, otherwise they will default to StoredList
@@ -260,6 +285,7 @@ class WalletDBUpgrader(Logger):
         self._convert_version_69()
         self._convert_version_70()
         self._convert_version_71()
+        self._convert_version_72()
         self.put('seed_version', FINAL_SEED_VERSION)  # just to be sure
 
     def _convert_wallet_type(self):
@@ -1436,6 +1462,16 @@ class WalletDBUpgrader(Logger):
         self.data['genesis_blockhash'] = constants.net.GENESIS
         self.data['seed_version'] = 71
 
+    def _convert_version_72(self):
+        """Store complete transactions as base64 of the raw tx, instead of hex."""
+        if not self._is_upgrade_method_needed(71, 71):
+            return
+        transactions = self.data.get('transactions', {})
+        for txid, raw in transactions.items():
+            if is_hex_str(raw):
+                transactions[txid] = base64.b64encode(bytes.fromhex(raw)).decode('ascii')
+        self.data['seed_version'] = 72
+
     def _convert_imported(self):
         if not self._is_upgrade_method_needed(0, 13):
             return
@@ -1569,19 +1605,27 @@ def upgrade_wallet_db(data: dict, do_upgrade: bool) -> Tuple[dict, bool]:
 
 class WalletDB(JsonDB):
 
+    # large sections that are only converted on access if lazy_load is set.
+    # Only sections that are not read in full when the wallet is opened belong here:
+    # e.g. txi and txo are needed to build the local history and utxo index,
+    # and lightning_payments to compute the status of invoices.
+    LAZY_SECTIONS = ('transactions',)
+
     def __init__(
         self,
         s: str,
         *,
         storage: Optional['WalletStorage'] = None,
         upgrade: bool = False,
+        lazy_load: bool = False,
     ):
         JsonDB.__init__(
             self,
             s,
             storage=storage,
-            encoder=MyEncoder,
+            encoder=WalletDBEncoder,
             upgrader=partial(upgrade_wallet_db, do_upgrade=upgrade),
+            lazy_sections=self.LAZY_SECTIONS if lazy_load else (),
         )
         # create pointers
         self.load_transactions()
@@ -1735,7 +1779,11 @@ class WalletDB(JsonDB):
         assert isinstance(tx, Transaction), tx
         # note that tx might be a PartialTransaction
         # serialize and de-serialize tx now. this might e.g. convert a complete PartialTx to a Tx
-        tx = tx_from_any(str(tx), sanitize=False)
+        if isinstance(tx, PartialTransaction):
+            tx = tx_from_any(str(tx), sanitize=False)
+        else:
+            tx = Transaction(tx.serialize_as_bytes())
+            tx.deserialize()
         if not tx_hash:
             raise Exception("trying to add tx to db without txid")
         if tx_hash != tx.txid():
@@ -1757,6 +1805,22 @@ class WalletDB(JsonDB):
         assert isinstance(tx_hash, str)
         return self.transactions.get(tx_hash)
 
+    @locked
+    def has_transaction(self, tx_hash: str) -> bool:
+        # unlike get_transaction, this does not deserialize the tx
+        return tx_hash in self.transactions
+
+    @locked
+    def has_complete_transaction(self, tx_hash: str) -> bool:
+        # unlike get_transaction, this does not deserialize the tx
+        if isinstance(self.transactions, LazyStoredDict):
+            tx = self.transactions.get_unconverted(tx_hash)
+        else:
+            tx = self.transactions.get(tx_hash)
+        if isinstance(tx, str):  # not converted yet
+            return not is_psbt_db_str(tx)
+        return tx is not None and not isinstance(tx, PartialTransaction)
+
     @locked
     def list_transactions(self) -> Sequence[str]:
         return list(self.transactions.keys())
@@ -1956,6 +2020,10 @@ class WalletDB(JsonDB):
 
     @profiler
     def load_transactions(self):
+        if self.get('sql_history'):
+            raise WalletFileException(
+                _('The history of this wallet is stored in a separate SQLite file.') + '\n' +
+                _('Enable the config option "{}" to open it.').format('wallet_sql_history'))
         # references in self.data
         # TODO make all these private
         # txid -> address -> prev_outpoint -> value
@@ -1970,8 +2038,9 @@ class WalletDB(JsonDB):
         # scripthash -> outpoint -> value
         self._prevouts_by_scripthash = self.get_dict('prevouts_by_scripthash')  # type: Dict[str, Dict[str, int]]
         # remove unreferenced tx
+        # note: membership test only, to not materialize lazy sections
         for tx_hash in list(self.transactions.keys()):
-            if not self.get_txi_addresses(tx_hash) and not self.get_txo_addresses(tx_hash):
+            if tx_hash not in self.txi and tx_hash not in self.txo:
                 self.logger.info(f"removing unreferenced tx: {tx_hash}")
                 self.transactions.pop(tx_hash)
         # remove unreferenced outpoints
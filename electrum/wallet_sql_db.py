@@ -0,0 +1,457 @@
+# Electrum - lightweight Bitcoin client
+# Copyright (C) 2025 The Electrum Developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import json
+import sqlite3
+from typing import Dict, Optional, List, Tuple, Set, Iterable, Sequence, Union, TYPE_CHECKING
+
+from .util import profiler, TxMinedInfo, test_read_write_permissions
+from .transaction import TxOutpoint
+from .json_db import JsonDB, locked
+from .wallet_db import WalletDB
+
+if TYPE_CHECKING:
+    from .storage import WalletStorage
+
+
+def sql_modifier(func):
+    def wrapper(self: 'SqlWalletDB', *args, **kwargs):
+        with self.lock:
+            self._sql_dirty = True
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
+class SqlWalletDB(WalletDB):
+    """WalletDB that keeps the history maps in an SQLite file next to the wallet file.
+
+    txi, txo, spent_outpoints, addr_history, verified_tx3 and prevouts_by_scripthash
+    are stored in indexed tables instead of the json document, so they do not need
+    to be held in memory. Everything else is still stored in the wallet file.
+
+    Unlike SqlDB, there is no dedicated thread: WalletDB accessors are synchronous
+    and called from several threads, so the connection is guarded by self.lock.
+    The SQLite file is committed whenever the db is written.
+
+    The SQLite file is not encrypted. If the wallet file is encrypted, the history
+    is kept in the wallet file, and the db behaves as a plain WalletDB.
+    """
+
+    # json sections moved into sql tables
+    SQL_SECTIONS = ('txi', 'txo', 'spent_outpoints', 'addr_history', 'verified_tx3', 'prevouts_by_scripthash')
+
+    def __init__(
+        self,
+        s: str,
+        *,
+        storage: Optional['WalletStorage'] = None,
+        upgrade: bool = False,
+        lazy_load: bool = False,
+    ):
+        self._sql_path = self.get_sql_path(storage.path) if storage else ':memory:'
+        self._sql_dirty = False
+        self.conn = None  # type: Optional[sqlite3.Connection]
+        WalletDB.__init__(self, s, storage=storage, upgrade=upgrade, lazy_load=lazy_load)
+
+    @classmethod
+    def get_sql_path(cls, wallet_path: str) -> str:
+        return wallet_path + '.history.sqlite'
+
+    def _connect(self) -> None:
+        file_existed = self._sql_path != ':memory:' and os.path.exists(self._sql_path)
+        if self.get('sql_history') and not file_existed:
+            # start with empty tables. the synchronizer will fetch the history again
+            self.logger.warning(f'wallet history file not found: {self._sql_path}. history will be re-downloaded')
+            self.put('sql_history', None)
+        if self._sql_path != ':memory:':
+            test_read_write_permissions(self._sql_path)
+        self.conn = sqlite3.connect(self._sql_path, check_same_thread=False)
+        self.create_database()
+
+    def create_database(self) -> None:
+        c = self.conn.cursor()
+        c.execute("""CREATE TABLE IF NOT EXISTS txi (
+            tx_hash TEXT NOT NULL, address TEXT NOT NULL, prevout TEXT NOT NULL, value INTEGER NOT NULL,
+            PRIMARY KEY(tx_hash, address, prevout))""")
+        c.execute("""CREATE TABLE IF NOT EXISTS txo (
+            tx_hash TEXT NOT NULL, address TEXT NOT NULL, n TEXT NOT NULL, value INTEGER NOT NULL, is_coinbase INTEGER NOT NULL,
+            PRIMARY KEY(tx_hash, address, n))""")
+        c.execute("""CREATE TABLE IF NOT EXISTS spent_outpoints (
+            prevout_hash TEXT NOT NULL, prevout_n TEXT NOT NULL, spending_txid TEXT NOT NULL,
+            PRIMARY KEY(prevout_hash, prevout_n))""")
+        c.execute("""CREATE TABLE IF NOT EXISTS addr_history (
+            address TEXT PRIMARY KEY, history TEXT NOT NULL)""")
+        c.execute("""CREATE TABLE IF NOT EXISTS verified_tx (
+            txid TEXT PRIMARY KEY, height INTEGER NOT NULL, timestamp INTEGER, txpos INTEGER, header_hash TEXT)""")
+        c.execute("""CREATE TABLE IF NOT EXISTS prevouts_by_scripthash (
+            scripthash TEXT NOT NULL, prevout TEXT NOT NULL, value INTEGER NOT NULL,
+            PRIMARY KEY(scripthash, prevout))""")
+        self.conn.commit()
+
+    @profiler
+    def load_transactions(self):
+        if self.storage and self.storage.is_encrypted():
+            # do not leak our history next to an encrypted wallet file
+            self.move_history_to_json()
+            return
+        self._connect()
+        if not self.get('sql_history'):
+            self._import_from_json()
+        self.transactions = self.get_dict('transactions')        # type: Dict[str, Transaction]
+        self.tx_fees = self.get_dict('tx_fees')                  # type: Dict[str, TxFeesValue]
+        # remove unreferenced tx
+        referenced = set(self.list_txi()) | set(self.list_txo())
+        for tx_hash in list(self.transactions.keys()):
+            if tx_hash not in referenced:
+                self.logger.info(f"removing unreferenced tx: {tx_hash}")
+                self.transactions.pop(tx_hash)
+        # remove history of missing txs. The sql file is committed before the wallet file
+        # is written, so it can be ahead of it after a crash. The synchronizer will fetch them again.
+        for tx_hash in referenced:
+            if tx_hash not in self.transactions:
+                self.logger.info(f"removing history of missing tx: {tx_hash}")
+                self.remove_txi(tx_hash)
+                self.remove_txo(tx_hash)
+        for addr in self.get_history():
+            if any(tx_hash not in self.transactions for tx_hash, height in self.get_addr_history(addr)):
+                self.remove_addr_history(addr)
+        # remove unreferenced outpoints
+        for prevout_hash, prevout_n, spending_txid in self.conn.execute(
+                "SELECT prevout_hash, prevout_n, spending_txid FROM spent_outpoints").fetchall():
+            if spending_txid not in self.transactions:
+                self.logger.info("removing unreferenced spent outpoint")
+                self.remove_spent_outpoint(prevout_hash, prevout_n)
+
+    @locked
+    def _import_from_json(self) -> None:
+        """Moves the history maps from the json document into the sql tables."""
+        self.logger.info(f"moving wallet history to {self._sql_path}")
+        self._delete_all()
+        c = self.conn.cursor()
+        txi = self.data.get('txi', {})
+        c.executemany("INSERT INTO txi VALUES (?,?,?,?)", [
+            (tx_hash, addr, ser, v)
+            for tx_hash, d in txi.items() for addr, d2 in d.items() for ser, v in d2.items()])
+        txo = self.data.get('txo', {})
+        c.executemany("INSERT INTO txo VALUES (?,?,?,?,?)", [
+            (tx_hash, addr, str(n), v, int(cb))
+            for tx_hash, d in txo.items() for addr, d2 in d.items() for n, (v, cb) in d2.items()])
+        spent_outpoints = self.data.get('spent_outpoints', {})
+        c.executemany("INSERT INTO spent_outpoints VALUES (?,?,?)", [
+            (prevout_hash, str(n), txid)
+            for prevout_hash, d in spent_outpoints.items() for n, txid in d.items()])
+        history = self.data.get('addr_history', {})
+        c.executemany("INSERT INTO addr_history VALUES (?,?)", [
+            (addr, json.dumps(hist)) for addr, hist in history.items()])
+        verified_tx = self.data.get('verified_tx3', {})
+        c.executemany("INSERT INTO verified_tx VALUES (?,?,?,?,?)", [
+            (txid, *v) for txid, v in verified_tx.items()])
+        prevouts = self.data.get('prevouts_by_scripthash', {})
+        c.executemany("INSERT INTO prevouts_by_scripthash VALUES (?,?,?)", [
+            (sh, prevout, v) for sh, d in prevouts.items() for prevout, v in d.items()])
+        # commit before the json document loses the data
+        self.conn.commit()
+        for name in self.SQL_SECTIONS:
+            self.data.pop(name, None)
+        self.put('sql_history', True)
+
+    @locked
+    def move_history_to_json(self) -> None:
+        """Moves the history maps back into the json document, and deletes the sql file.
+        From then on, self behaves as a plain WalletDB.
+        """
+        if self.conn is None and self.get('sql_history') and os.path.exists(self._sql_path):
+            self.conn = sqlite3.connect(self._sql_path, check_same_thread=False)
+        if self.conn is not None:
+            self.logger.info(f"moving wallet history back from {self._sql_path}")
+            # json roundtrip, to get the same types as when loading the wallet file
+            history = json.loads(json.dumps(self._export_to_json()))
+            self.conn.close()
+            self.conn = None
+            history = self._convert_dict([], history)
+            for name in self.SQL_SECTIONS:
+                self.data[name] = history[name]
+        self.put('sql_history', None)
+        self.__class__ = WalletDB
+        WalletDB.load_transactions(self)
+        # delete the sql file only once the wallet file has the history
+        if self.storage and self.storage.file_exists():
+            self.write_and_force_consolidation()
+        if self._sql_path != ':memory:' and os.path.exists(self._sql_path):
+            os.unlink(self._sql_path)
+
+    def _delete_all(self) -> None:
+        c = self.conn.cursor()
+        for table in ('txi', 'txo', 'spent_outpoints', 'addr_history', 'verified_tx', 'prevouts_by_scripthash'):
+            c.execute(f"DELETE FROM {table}")
+
+    @locked
+    def _export_to_json(self) -> dict:
+        """Returns the history maps in the format of WalletDB."""
+        txi = {}
+        for tx_hash, addr, ser, v in self.conn.execute("SELECT * FROM txi"):
+            txi.setdefault(tx_hash, {}).setdefault(addr, {})[ser] = v
+        txo = {}
+        for tx_hash, addr, n, v, cb in self.conn.execute("SELECT * FROM txo"):
+            txo.setdefault(tx_hash, {}).setdefault(addr, {})[n] = (v, bool(cb))
+        spent_outpoints = {}
+        for prevout_hash, n, txid in self.conn.execute("SELECT * FROM spent_outpoints"):
+            spent_outpoints.setdefault(prevout_hash, {})[n] = txid
+        history = {addr: json.loads(hist)
+                   for addr, hist in self.conn.execute("SELECT * FROM addr_history ORDER BY rowid")}
+        verified_tx = {txid: (height, timestamp, txpos, header_hash)
+                       for txid, height, timestamp, txpos, header_hash in self.conn.execute("SELECT * FROM verified_tx")}
+        prevouts = {}
+        for sh, prevout, v in self.conn.execute("SELECT * FROM prevouts_by_scripthash"):
+            prevouts.setdefault(sh, {})[prevout] = v
+        return {
+            'txi': txi,
+            'txo': txo,
+            'spent_outpoints': spent_outpoints,
+            'addr_history': history,
+            'verified_tx3': verified_tx,
+            'prevouts_by_scripthash': prevouts,
+        }
+
+    @locked
+    def dump(self, *, human_readable: bool = True) -> str:
+        # self-contained json, e.g. for backups. It can be opened by WalletDB.
+        data = dict(self.data)
+        data.pop('sql_history', None)
+        data.update(self._export_to_json())
+        return self._dump(data, human_readable=human_readable)
+
+    def _dump_for_storage(self, *, human_readable: bool) -> str:
+        return JsonDB.dump(self, human_readable=human_readable)
+
+    @locked
+    def _commit(self) -> None:
+        if self._sql_dirty:
+            self.conn.commit()
+            self._sql_dirty = False
+
+    def write(self):
+        self._commit()
+        WalletDB.write(self)
+
+    def write_and_force_consolidation(self):
+        if self.conn:  # called from JsonDB.__init__, before we are connected
+            self._commit()
+        WalletDB.write_and_force_consolidation(self)
+
+    @locked
+    def get_txi_addresses(self, tx_hash: str) -> List[str]:
+        assert isinstance(tx_hash, str)
+        r = self.conn.execute("SELECT DISTINCT address FROM txi WHERE tx_hash=?", (tx_hash,))
+        return [x[0] for x in r]
+
+    @locked
+    def get_txo_addresses(self, tx_hash: str) -> List[str]:
+        assert isinstance(tx_hash, str)
+        r = self.conn.execute("SELECT DISTINCT address FROM txo WHERE tx_hash=?", (tx_hash,))
+        return [x[0] for x in r]
+
+    @locked
+    def get_txi_addr(self, tx_hash: str, address: str) -> Iterable[Tuple[str, int]]:
+        assert isinstance(tx_hash, str)
+        assert isinstance(address, str)
+        r = self.conn.execute("SELECT prevout, value FROM txi WHERE tx_hash=? AND address=?", (tx_hash, address))
+        return r.fetchall()
+
+    @locked
+    def get_txo_addr(self, tx_hash: str, address: str) -> Dict[int, Tuple[int, bool]]:
+        assert isinstance(tx_hash, str)
+        assert isinstance(address, str)
+        r = self.conn.execute("SELECT n, value, is_coinbase FROM txo WHERE tx_hash=? AND address=?", (tx_hash, address))
+        return {int(n): (v, bool(cb)) for (n, v, cb) in r}
+
+    @sql_modifier
+    def add_txi_addr(self, tx_hash: str, addr: str, ser: str, v: int) -> None:
+        assert isinstance(tx_hash, str)
+        assert isinstance(addr, str)
+        assert isinstance(ser, str)
+        assert isinstance(v, int)
+        self.conn.execute("INSERT OR REPLACE INTO txi VALUES (?,?,?,?)", (tx_hash, addr, ser, v))
+
+    @sql_modifier
+    def add_txo_addr(self, tx_hash: str, addr: str, n: Union[int, str], v: int, is_coinbase: bool) -> None:
+        n = str(n)
+        assert isinstance(tx_hash, str)
+        assert isinstance(addr, str)
+        assert isinstance(v, int)
+        assert isinstance(is_coinbase, bool)
+        self.conn.execute("INSERT OR REPLACE INTO txo VALUES (?,?,?,?,?)", (tx_hash, addr, n, v, int(is_coinbase)))
+
+    @locked
+    def list_txi(self) -> Sequence[str]:
+        return [x[0] for x in self.conn.execute("SELECT DISTINCT tx_hash FROM txi")]
+
+    @locked
+    def list_txo(self) -> Sequence[str]:
+        return [x[0] for x in self.conn.execute("SELECT DISTINCT tx_hash FROM txo")]
+
+    @sql_modifier
+    def remove_txi(self, tx_hash: str) -> None:
+        assert isinstance(tx_hash, str)
+        self.conn.execute("DELETE FROM txi WHERE tx_hash=?", (tx_hash,))
+
+    @sql_modifier
+    def remove_txo(self, tx_hash: str) -> None:
+        assert isinstance(tx_hash, str)
+        self.conn.execute("DELETE FROM txo WHERE tx_hash=?", (tx_hash,))
+
+    @locked
+    def list_spent_outpoints(self) -> Sequence[Tuple[str, str]]:
+        return self.conn.execute("SELECT prevout_hash, prevout_n FROM spent_outpoints").fetchall()
+
+    @locked
+    def get_spent_outpoints(self, prevout_hash: str) -> Sequence[str]:
+        assert isinstance(prevout_hash, str)
+        r = self.conn.execute("SELECT prevout_n FROM spent_outpoints WHERE prevout_hash=?", (prevout_hash,))
+        return [x[0] for x in r]
+
+    @locked
+    def get_spent_outpoint(self, prevout_hash: str, prevout_n: Union[int, str]) -> Optional[str]:
+        assert isinstance(prevout_hash, str)
+        prevout_n = str(prevout_n)
+        r = self.conn.execute(
+            "SELECT spending_txid FROM spent_outpoints WHERE prevout_hash=? AND prevout_n=?",
+            (prevout_hash, prevout_n)).fetchone()
+        return r[0] if r else None
+
+    @sql_modifier
+    def remove_spent_outpoint(self, prevout_hash: str, prevout_n: Union[int, str]) -> None:
+        assert isinstance(prevout_hash, str)
+        prevout_n = str(prevout_n)
+        self.conn.execute(
+            "DELETE FROM spent_outpoints WHERE prevout_hash=? AND prevout_n=?", (prevout_hash, prevout_n))
+
+    @sql_modifier
+    def set_spent_outpoint(self, prevout_hash: str, prevout_n: Union[int, str], tx_hash: str) -> None:
+        assert isinstance(prevout_hash, str)
+        assert isinstance(tx_hash, str)
+        prevout_n = str(prevout_n)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO spent_outpoints VALUES (?,?,?)", (prevout_hash, prevout_n, tx_hash))
+
+    @sql_modifier
+    def add_prevout_by_scripthash(self, scripthash: str, *, prevout: TxOutpoint, value: int) -> None:
+        assert isinstance(scripthash, str)
+        assert isinstance(prevout, TxOutpoint)
+        assert isinstance(value, int)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO prevouts_by_scripthash VALUES (?,?,?)", (scripthash, prevout.to_str(), value))
+
+    @sql_modifier
+    def remove_prevout_by_scripthash(self, scripthash: str, *, prevout: TxOutpoint, value: int) -> None:
+        assert isinstance(scripthash, str)
+        assert isinstance(prevout, TxOutpoint)
+        assert isinstance(value, int)
+        self.conn.execute(
+            "DELETE FROM prevouts_by_scripthash WHERE scripthash=? AND prevout=?", (scripthash, prevout.to_str()))
+
+    @locked
+    def get_prevouts_by_scripthash(self, scripthash: str) -> Set[Tuple[TxOutpoint, int]]:
+        assert isinstance(scripthash, str)
+        r = self.conn.execute("SELECT prevout, value FROM prevouts_by_scripthash WHERE scripthash=?", (scripthash,))
+        return {(TxOutpoint.from_str(prevout), value) for prevout, value in r}
+
+    @locked
+    def get_history(self) -> Sequence[str]:
+        return [x[0] for x in self.conn.execute("SELECT address FROM addr_history ORDER BY rowid")]
+
+    @locked
+    def is_addr_in_history(self, addr: str) -> bool:
+        assert isinstance(addr, str)
+        r = self.conn.execute("SELECT 1 FROM addr_history WHERE address=?", (addr,))
+        return r.fetchone() is not None
+
+    @locked
+    def get_addr_history(self, addr: str) -> Sequence[Tuple[str, int]]:
+        assert isinstance(addr, str)
+        r = self.conn.execute("SELECT history FROM addr_history WHERE address=?", (addr,)).fetchone()
+        return json.loads(r[0]) if r else []
+
+    @sql_modifier
+    def set_addr_history(self, addr: str, hist) -> None:
+        assert isinstance(addr, str)
+        # upsert, to keep the rowid (insertion order) of the address
+        self.conn.execute(
+            "INSERT INTO addr_history VALUES (?,?) ON CONFLICT(address) DO UPDATE SET history=excluded.history",
+            (addr, json.dumps(hist)))
+
+    @sql_modifier
+    def remove_addr_history(self, addr: str) -> None:
+        assert isinstance(addr, str)
+        self.conn.execute("DELETE FROM addr_history WHERE address=?", (addr,))
+
+    @locked
+    def list_verified_tx(self) -> Sequence[str]:
+        return [x[0] for x in self.conn.execute("SELECT txid FROM verified_tx")]
+
+    @locked
+    def get_verified_tx(self, txid: str) -> Optional[TxMinedInfo]:
+        assert isinstance(txid, str)
+        r = self.conn.execute(
+            "SELECT height, timestamp, txpos, header_hash FROM verified_tx WHERE txid=?", (txid,)).fetchone()
+        if r is None:
+            return None
+        height, timestamp, txpos, header_hash = r
+        return TxMinedInfo(_height=height,
+                           conf=None,
+                           timestamp=timestamp,
+                           txpos=txpos,
+                           header_hash=header_hash)
+
+    @sql_modifier
+    def add_verified_tx(self, txid: str, info: TxMinedInfo):
+        assert isinstance(txid, str)
+        assert isinstance(info, TxMinedInfo)
+        height = info._height  # number of conf is dynamic and might not be set here
+        assert height > 0, height
+        self.conn.execute(
+            "INSERT OR REPLACE INTO verified_tx VALUES (?,?,?,?,?)",
+            (txid, height, info.timestamp, info.txpos, info.header_hash))
+
+    @sql_modifier
+    def remove_verified_tx(self, txid: str):
+        assert isinstance(txid, str)
+        self.conn.execute("DELETE FROM verified_tx WHERE txid=?", (txid,))
+
+    @locked
+    def is_in_verified_tx(self, txid: str) -> bool:
+        assert isinstance(txid, str)
+        return self.conn.execute("SELECT 1 FROM verified_tx WHERE txid=?", (txid,)).fetchone() is not None
+
+    @locked
+    def get_num_ismine_inputs_of_tx(self, txid: str) -> int:
+        assert isinstance(txid, str)
+        return self.conn.execute("SELECT COUNT(*) FROM txi WHERE tx_hash=?", (txid,)).fetchone()[0]
+
+    @sql_modifier
+    def clear_history(self):
+        self.set_modified(True)
+        self._delete_all()
+        self.transactions.clear()
+        self.tx_fees.clear()
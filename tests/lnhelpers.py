@@ -160,6 +160,7 @@ class MockNetwork:
         self.channel_db = ChannelDB(self)
         self.channel_db.data_loaded.set()
         self.path_finder = LNPathFinder(self.channel_db)
+        self.path_finding_pool = None
         self.lngossip = MockLNGossip()
         self.tx_queue = asyncio.Queue()
         self.proxy = ProxySettings()
@@ -716,6 +716,20 @@ class Test_xprv_xpub(ElectrumTestCase):
         self.assertEqual("xpub6BJA1jSqiukeaesWfxe6sNK9CCGaujFFSJLomWHprUL9DePQ4JDkM5d88n49sMGJxrhpjazuXYWdMf17C9T5XnxkopaeS7jGk1GyyVziaMt", xpub)
         self.assertEqual("xprv9xJocDuwtYCMNAo3Zw76WENQeAS6WGXQ55RCy7tDJ8oALr4FWkuVoHJeHVAcAqiZLE7Je3vZJHxspZdFHfnBEjHqU5hG1Jaj32dVoS6XLT1", xprv)
 
+    def test_derive_child_pubkeys(self):
+        node = BIP32Node.from_xkey(self.xprv_xpub[0]['xpub'])
+        pubkeys = node.derive_child_pubkeys(5, 30)
+        self.assertEqual(30, len(pubkeys))
+        for n, pubkey in enumerate(pubkeys, start=5):
+            self.assertEqual(node.subkey_at_public_derivation([n]).eckey.get_public_key_bytes(), pubkey)
+        self.assertEqual([], node.derive_child_pubkeys(0, 0))
+        self.assertEqual([node.subkey_at_public_derivation([bip32.BIP32_PRIME - 1]).eckey.get_public_key_bytes()],
+                         node.derive_child_pubkeys(bip32.BIP32_PRIME - 1, 1))
+        with self.assertRaisesRegex(Exception, "not possible to derive hardened child"):
+            node.derive_child_pubkeys(bip32.BIP32_PRIME - 1, 2)
+        with self.assertRaises(ValueError):
+            node.derive_child_pubkeys(-1, 2)
+
     def test_xpub_from_xprv(self):
         """We can derive the xpub key from a xprv."""
         for xprv_details in self.xprv_xpub:
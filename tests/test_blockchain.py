@@ -1,10 +1,16 @@
 import shutil
 import tempfile
 import os
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List
+from unittest import mock
 
 from electrum import constants, blockchain
 from electrum.simple_config import SimpleConfig
-from electrum.blockchain import Blockchain, deserialize_header, hash_header, InvalidHeader
+from electrum.blockchain import (Blockchain, deserialize_header, serialize_header, hash_header, hash_raw_header,
+                                 InvalidHeader, verify_raw_headers, CHUNK_SIZE)
+from electrum.crypto import sha256, sha256d
 from electrum.util import bfh, make_dir
 
 from . import ElectrumTestCase
@@ -268,6 +274,110 @@ class TestBlockchain(ElectrumTestCase):
         self.assertEqual(hash_header(self.HEADERS['M']), chain_z.get_hash(9))
         self.assertEqual(hash_header(self.HEADERS['Z']), chain_z.get_hash(13))
 
+    def test_read_headers(self):
+        blockchain.blockchains[constants.net.GENESIS] = chain_u = Blockchain(
+            config=self.config, forkpoint=0, parent=None,
+            forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+        open(chain_u.path(), 'w+').close()
+        self.assertEqual([None, None], chain_u.read_headers(range(0, 2)))
+        for name in 'ABCDEFOPQR':
+            self._append_header(chain_u, self.HEADERS[name])
+        chain_l = chain_u.fork(self.HEADERS['G'])
+        for name in 'HIJ':
+            self._append_header(chain_l, self.HEADERS[name])
+
+        def get_hashes(chain, heights):
+            return [hash_raw_header(bytes(h)) if h is not None else None for h in chain.read_headers(heights)]
+        # reads below the forkpoint go to the parent; out of range heights are None
+        self.assertEqual([hash_header(self.HEADERS[name]) for name in 'EFGHIJ'] + [None],
+                         get_hashes(chain_l, range(4, 11)))
+        self.assertEqual([hash_header(self.HEADERS[name]) for name in 'BDFP'],
+                         get_hashes(chain_u, range(1, 9, 2)))
+        self.assertEqual([None], get_hashes(chain_u, range(-1, 0)))
+        # files are remapped after chains get swapped
+        self._append_header(chain_l, self.HEADERS['K'])
+        self.assertEqual(None, chain_l.parent)
+        self.assertEqual([hash_header(self.HEADERS[name]) for name in 'FGHIJK'], get_hashes(chain_l, range(5, 11)))
+        self.assertEqual([hash_header(self.HEADERS[name]) for name in 'FOPQR'], get_hashes(chain_u, range(5, 10)))
+        self.assertEqual(self.HEADERS['K'], chain_l.read_header(10))
+        # ... and after the file gets truncated.
+        # headers that were read before are still valid
+        headers = chain_l.read_headers(range(7, 11))
+        chain_l.write(b'', 8 * 80)
+        self.assertEqual(7, chain_l.height())
+        self.assertEqual([hash_header(self.HEADERS['H']), None], get_hashes(chain_l, range(7, 9)))
+        self.assertEqual([hash_header(self.HEADERS[name]) for name in 'HIJK'], [hash_raw_header(h) for h in headers])
+        self.assertEqual(None, chain_l.read_header(8))
+
+    @staticmethod
+    def _make_raw_headers(prev_header: bytes, count: int, *, seed: bytes = b'') -> List[bytes]:
+        headers = []
+        prev_hash = sha256d(prev_header)
+        for i in range(count):
+            header = (bfh("00000020") + prev_hash + sha256(seed + i.to_bytes(4, 'little'))
+                      + (1296688700 + i).to_bytes(4, 'little') + bfh("ffff7f20") + bytes(4))
+            headers.append(header)
+            prev_hash = sha256d(header)
+        return headers
+
+    def test_connect_chunks(self):
+        genesis = serialize_header(self.HEADERS['A'])
+        raw_headers = [genesis] + self._make_raw_headers(genesis, 2 * CHUNK_SIZE + 9)
+        chunks = [b"".join(raw_headers[i:i + CHUNK_SIZE]) for i in range(0, len(raw_headers), CHUNK_SIZE)]
+        self.assertEqual(3, len(chunks))
+        bad_chunk = bytearray(chunks[1])
+        bad_chunk[100 * 80 + 40] ^= 1  # changes the hash of a header, so the next one does not connect
+        for executor in (None, ThreadPoolExecutor(max_workers=2)):
+            with self.subTest(executor=executor):
+                blockchain.blockchains = {}
+                blockchain.blockchains[constants.net.GENESIS] = chain = Blockchain(
+                    config=self.config, forkpoint=0, parent=None,
+                    forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+                open(chain.path(), 'w+').close()
+                chain.update_size()
+                self.assertEqual(1, chain.connect_chunks(0, [chunks[0], bytes(bad_chunk), chunks[2]], executor=executor))
+                self.assertEqual(CHUNK_SIZE - 1, chain.height())
+                self.assertEqual(2, chain.connect_chunks(1, chunks[1:], executor=executor))
+                self.assertEqual(len(raw_headers) - 1, chain.height())
+                self.assertEqual(hash_raw_header(raw_headers[-1]), chain.get_hash(chain.height()))
+                # chunks matching what we have can be connected again, conflicting ones cannot
+                self.assertEqual(3, chain.connect_chunks(0, chunks, executor=executor))
+                other_headers = self._make_raw_headers(raw_headers[CHUNK_SIZE - 1], CHUNK_SIZE, seed=b'other')
+                self.assertEqual(0, chain.connect_chunks(1, [b"".join(other_headers)], executor=executor))
+                self.assertEqual(hash_raw_header(raw_headers[-1]), chain.get_hash(chain.height()))
+                if executor is not None:
+                    executor.shutdown()
+
+    def test_connect_chunks_stops_at_any_error(self):
+        genesis = serialize_header(self.HEADERS['A'])
+        raw_headers = [genesis] + self._make_raw_headers(genesis, 2 * CHUNK_SIZE - 1)
+        chunks = [b"".join(raw_headers[i:i + CHUNK_SIZE]) for i in range(0, len(raw_headers), CHUNK_SIZE)]
+        for executor in (None, ThreadPoolExecutor(max_workers=2)):
+            with self.subTest(executor=executor):
+                blockchain.blockchains = {}
+                blockchain.blockchains[constants.net.GENESIS] = chain = Blockchain(
+                    config=self.config, forkpoint=0, parent=None,
+                    forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+                open(chain.path(), 'w+').close()
+                chain.update_size()
+                # the target cannot be computed, e.g. a header of the previous chunk cannot be deserialized
+                with mock.patch.object(chain, 'get_target', side_effect=ValueError):
+                    self.assertEqual(0, chain.connect_chunks(0, chunks, executor=executor))
+                # verification fails with an unexpected error
+                with mock.patch.object(blockchain, 'verify_raw_headers', side_effect=ValueError):
+                    self.assertEqual(0, chain.connect_chunks(0, chunks, executor=executor))
+                # saving fails
+                with mock.patch.object(chain, 'save_chunk', side_effect=OSError):
+                    self.assertEqual(0, chain.connect_chunks(0, chunks, executor=executor))
+                self.assertEqual(-1, chain.height())
+                # the caller retries without the executor
+                with mock.patch.object(blockchain, 'verify_raw_headers', side_effect=BrokenProcessPool):
+                    with self.assertRaises(BrokenProcessPool):
+                        chain.connect_chunks(0, chunks, executor=executor)
+                self.assertEqual(2, chain.connect_chunks(0, chunks, executor=executor))
+                if executor is not None:
+                    executor.shutdown()
+
     def test_doing_multiple_swaps_after_single_new_header(self):
         blockchain.blockchains[constants.net.GENESIS] = chain_u = Blockchain(
             config=self.config, forkpoint=0, parent=None,
@@ -458,3 +568,30 @@ class TestVerifyHeader(ElectrumTestCase):
         with self.assertRaises(InvalidHeader):
             self.header["nonce"] = 42
             Blockchain.verify_header(self.header, self.prev_hash, self.target)
+
+    def test_verify_raw_headers(self):
+        raw_header = bfh(self.valid_header)
+        prev_hash = bfh(self.prev_hash)[::-1]
+        kwargs = dict(start_height=100, prev_hash=prev_hash, target=self.target, check_pow=True)
+        self.assertEqual(sha256d(raw_header), verify_raw_headers(raw_header, **kwargs))
+        # expected header/hash
+        self.assertEqual(sha256d(raw_header), verify_raw_headers(
+            raw_header, **kwargs, expected_headers={100: raw_header}, expected_hashes={100: sha256d(raw_header)}))
+        with self.assertRaises(InvalidHeader):
+            verify_raw_headers(raw_header, **kwargs, expected_hashes={100: bytes(32)})
+        with self.assertRaises(InvalidHeader):
+            verify_raw_headers(raw_header, **kwargs, expected_headers={100: bytes(80)})
+        # prev hash mismatch
+        with self.assertRaises(InvalidHeader):
+            verify_raw_headers(raw_header, **(kwargs | dict(prev_hash=bytes(32))))
+        # target mismatch
+        with self.assertRaises(InvalidHeader):
+            verify_raw_headers(raw_header, **(kwargs | dict(target=Blockchain.bits_to_target(0x1d00eeee))))
+        verify_raw_headers(raw_header, **(kwargs | dict(target=Blockchain.bits_to_target(0x1d00eeee), check_pow=False)))
+        # insufficient pow
+        bad_header = raw_header[:76] + (42).to_bytes(4, 'little')
+        with self.assertRaises(InvalidHeader):
+            verify_raw_headers(bad_header, **kwargs)
+        # invalid length
+        with self.assertRaises(InvalidHeader):
+            verify_raw_headers(raw_header[:-1], **kwargs)
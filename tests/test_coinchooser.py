@@ -1,8 +1,10 @@
-from electrum.coinchooser import CoinChooserPrivacy
+from electrum import bitcoin
+from electrum.coinchooser import CoinChooserPrivacy, CoinChooserBnB, branch_and_bound
 from electrum.util import NotEnoughFunds
 from electrum.transaction import PartialTxInput, TxOutpoint, Transaction, PartialTxOutput
 from electrum.fee_policy import FeePolicy, FixedFeePolicy
 from functools import partial
+from unittest import mock
 from typing import Optional
 
 from . import ElectrumTestCase
@@ -33,6 +35,17 @@ class TestCoinChooser(ElectrumTestCase):
         )
         return output
 
+    @staticmethod
+    def get_dummy_coins(values, *, block_height: int = 100) -> list:
+        coins = []
+        for i, value in enumerate(values):
+            coin = PartialTxInput(prevout=TxOutpoint(txid=bitcoin.sha256(bytes([i])), out_idx=0))
+            coin._trusted_value_sats = value
+            coin._trusted_address = bitcoin.hash_to_segwit_addr(bitcoin.hash_160(bytes([i])), witver=0)
+            coin.block_height = block_height
+            coins.append(coin)
+        return coins
+
     def test_bucket_candidates_with_empty_buckets(self):
         def sufficient_funds(buckets, *, bucket_value_sum):
             return True
@@ -109,3 +122,114 @@ class TestCoinChooser(ElectrumTestCase):
         assert tx.get_fee() == 0, f"fee should be 0, is {tx.get_fee()}"
         assert len(tx.outputs()) == 2, f"expected 2 output got {len(tx.outputs())}"
         assert len(tx.inputs()) == 1, f"expected 1 input got {len(tx.inputs())}"
+
+    def test_branch_and_bound(self):
+        values = [5, 3, 8, 1, 3]
+        result = branch_and_bound(values, target=9, window=0)
+        self.assertEqual(9, sum(values[i] for i in result))
+        self.assertEqual(len(set(result)), len(result))
+        # smallest excess within the window wins
+        result = branch_and_bound([10, 7, 6], target=12, window=5)
+        self.assertEqual([1, 2], sorted(result))
+        # no subset in window
+        self.assertIsNone(branch_and_bound([10, 20], target=12, window=5))
+        self.assertIsNone(branch_and_bound([1, 2], target=4, window=100))
+        # candidates can be rejected by is_match
+        result = branch_and_bound(values, target=9, window=0, is_match=lambda idxs: 2 not in idxs)
+        self.assertEqual(9, sum(values[i] for i in result))
+        self.assertNotIn(2, result)
+        # search budget
+        self.assertIsNone(branch_and_bound(values, target=9, window=0, max_tries=1))
+
+    def test_bnb_make_tx_without_change(self):
+        fee_estimator = lambda size: int(2 * size)
+        coins = self.get_dummy_coins([300_000, 250_000, 5_000_000, 77_777])
+        # fixed fee: exact match
+        tx = CoinChooserBnB(enable_output_value_rounding=False).make_tx(
+            coins=coins,
+            inputs=[],
+            outputs=[self.get_dummy_txout_1(549_000)],
+            change_addrs=["bc1q2089yvkkyw7yq7m6a7lxt45n35c587hk4sgj7c"],
+            fee_estimator_vb=FixedFeePolicy(1000).estimate_fee,
+            dust_threshold=546,
+        )
+        self.assertEqual(1, len(tx.outputs()))
+        self.assertEqual(1000, tx.get_fee())
+        # feerate based fee: excess goes to the fee
+        tx = CoinChooserBnB(enable_output_value_rounding=False).make_tx(
+            coins=coins,
+            inputs=[],
+            outputs=[self.get_dummy_txout_1(549_300)],
+            change_addrs=["bc1q2089yvkkyw7yq7m6a7lxt45n35c587hk4sgj7c"],
+            fee_estimator_vb=fee_estimator,
+            dust_threshold=546,
+        )
+        self.assertEqual(1, len(tx.outputs()))
+        self.assertEqual(2, len(tx.inputs()))
+        self.assertGreaterEqual(tx.get_fee(), fee_estimator(tx.estimated_size()))
+        self.assertLess(tx.get_fee(), fee_estimator(tx.estimated_size()) + 546 + 100)
+
+    def test_bnb_make_tx_falls_back_to_privacy(self):
+        fee_estimator = lambda size: int(2 * size)
+        coins = self.get_dummy_coins([300_000, 250_000, 5_000_000, 77_777])
+        kwargs = dict(
+            coins=coins,
+            inputs=[],
+            outputs=[self.get_dummy_txout_1(4_000_000)],
+            change_addrs=["bc1q2089yvkkyw7yq7m6a7lxt45n35c587hk4sgj7c"],
+            fee_estimator_vb=fee_estimator,
+            dust_threshold=546,
+        )
+        tx = CoinChooserBnB(enable_output_value_rounding=False).make_tx(**kwargs)
+        tx2 = CoinChooserPrivacy(enable_output_value_rounding=False).make_tx(**kwargs)
+        self.assertEqual(2, len(tx.outputs()))
+        self.assertEqual([txin.prevout for txin in tx2.inputs()], [txin.prevout for txin in tx.inputs()])
+        self.assertEqual(tx2.outputs(), tx.outputs())
+        with self.assertRaises(NotEnoughFunds):
+            CoinChooserBnB(enable_output_value_rounding=False).make_tx(
+                **(kwargs | dict(outputs=[self.get_dummy_txout_1(6_000_000)])))
+
+    def test_bnb_prefers_confirmed_coins(self):
+        fee_estimator = FixedFeePolicy(1000).estimate_fee
+        # unconfirmed coins would make an exact match, but confirmed ones are enough
+        coins = self.get_dummy_coins([300_000, 250_000])
+        unconf_coins = self.get_dummy_coins([200_000, 350_000], block_height=0)[::-1]
+        for i, coin in enumerate(unconf_coins):
+            coin.prevout = TxOutpoint(txid=bitcoin.sha256(bytes([100 + i])), out_idx=0)
+            coin._trusted_address = bitcoin.hash_to_segwit_addr(bitcoin.hash_160(bytes([100 + i])), witver=0)
+        tx = CoinChooserBnB(enable_output_value_rounding=False).make_tx(
+            coins=coins + unconf_coins,
+            inputs=[],
+            outputs=[self.get_dummy_txout_1(449_000)],
+            change_addrs=["bc1q2089yvkkyw7yq7m6a7lxt45n35c587hk4sgj7c"],
+            fee_estimator_vb=fee_estimator,
+            dust_threshold=546,
+        )
+        self.assertTrue(all(txin.block_height == 100 for txin in tx.inputs()))
+        self.assertEqual(2, len(tx.outputs()))
+
+    def test_input_weight_cache_reused_across_fee_rates(self):
+        coins = self.get_dummy_coins([300_000, 250_000, 5_000_000, 77_777])
+        input_weight_cache = {}
+        txs = []
+        with mock.patch.object(Transaction, "estimated_input_weight",
+                               wraps=Transaction.estimated_input_weight) as estimated_input_weight:
+            for feerate in (1, 5, 20):
+                coin_chooser = CoinChooserPrivacy(
+                    enable_output_value_rounding=False, input_weight_cache=input_weight_cache)
+                txs.append(coin_chooser.make_tx(
+                    coins=coins,
+                    inputs=[],
+                    outputs=[self.get_dummy_txout_1(500_000)],
+                    change_addrs=["bc1q2089yvkkyw7yq7m6a7lxt45n35c587hk4sgj7c"],
+                    fee_estimator_vb=lambda size, feerate=feerate: int(feerate * size),
+                    dust_threshold=546,
+                ))
+            self.assertEqual(len(coins), estimated_input_weight.call_count)
+        self.assertEqual(len(coins), len(input_weight_cache))
+        # the selected coins do not depend on the fee rate here, the change does
+        fees = [tx.get_fee() for tx in txs]
+        self.assertEqual(fees, sorted(fees))
+        for tx in txs:
+            self.assertEqual(len(tx.outputs()), 2)
+            self.assertTrue(any(o.is_change for o in tx.outputs()))
@@ -1,9 +1,13 @@
 import asyncio
+from unittest import mock
+
 from aiorpcx import RPCError
 
-from electrum import util
+from electrum import util, bitcoin
 from electrum.bitcoin import COIN
-from electrum.interface import ServerAddr, PaddedRSTransport
+from electrum.interface import (ServerAddr, PaddedRSTransport, NotificationSession, RequestConcurrencyLimiter,
+                                RequestTimedOut)
+from electrum.rawtx_cache import RawTxCache
 from electrum.util import bfh
 from electrum.simple_config import SimpleConfig
 from electrum.transaction import Transaction, TxOutput
@@ -60,6 +64,105 @@ class TestServerAddr(ElectrumTestCase):
                          ServerAddr(host="2400:6180:0:d1::86b:e001", port=50001, protocol="t").to_friendly_name())
 
 
+class TestRequestConcurrencyLimiter(ElectrumTestCase):
+
+    async def _run_requests(self, limiter: RequestConcurrencyLimiter, num: int, *, delay: float = 0, exc=None, method=None):
+        max_in_flight = 0
+        async def request():
+            nonlocal max_in_flight
+            async with limiter.slot(method):
+                max_in_flight = max(max_in_flight, limiter.in_flight)
+                self.assertLessEqual(limiter.in_flight, limiter.limit)
+                await asyncio.sleep(delay)
+                if exc:
+                    raise exc
+        await asyncio.gather(*[request() for _ in range(num)], return_exceptions=True)
+        self.assertEqual(0, limiter.in_flight)
+        return max_in_flight
+
+    async def test_limit_grows_while_responses_are_fast(self):
+        limiter = RequestConcurrencyLimiter(max_limit=20)
+        self.assertEqual(RequestConcurrencyLimiter.INITIAL_LIMIT, limiter.limit)
+        await self._run_requests(limiter, 30)
+        self.assertEqual(20, limiter.limit)
+        self.assertEqual(20, await self._run_requests(limiter, 100))
+        self.assertEqual(20, limiter.limit)
+        self.assertIsNone(RequestConcurrencyLimiter(max_limit=20).get_learned_limit())
+        self.assertEqual(20, limiter.get_learned_limit())
+
+    async def test_additive_increase_after_first_decrease(self):
+        limiter = RequestConcurrencyLimiter(max_limit=100, initial_limit=10)
+        await self._run_requests(limiter, 20)
+        self.assertEqual(11, limiter.limit)  # ~1 per round-trip, instead of doubling
+
+    async def test_limit_is_cut_on_overload(self):
+        limiter = RequestConcurrencyLimiter(max_limit=100, initial_limit=16)
+        # a burst of failures of requests sent at the same time counts once
+        await self._run_requests(limiter, 16, exc=RequestTimedOut())
+        self.assertEqual(8, limiter.limit)
+        self.assertEqual(1, limiter.num_decreases)
+        await self._run_requests(limiter, 8, exc=RPCError(-102, "server busy"))
+        self.assertEqual(4, limiter.limit)
+        # other errors are normal answers
+        await self._run_requests(limiter, 4, exc=RPCError(1, "unknown txid"))
+        self.assertEqual(4, limiter.limit)
+        for _ in range(10):
+            limiter.on_overload()
+        self.assertEqual(RequestConcurrencyLimiter.MIN_LIMIT, limiter.limit)
+        self.assertEqual(1, await self._run_requests(limiter, 1))
+
+    async def test_limit_is_cut_on_slow_responses(self):
+        limiter = RequestConcurrencyLimiter(max_limit=100, initial_limit=10)
+        limiter.MIN_LATENCY_TARGET = 0.01
+        await self._run_requests(limiter, 1)
+        await self._run_requests(limiter, 1, delay=0.05)
+        self.assertEqual(9, limiter.limit)
+        stats = limiter.get_stats()
+        self.assertEqual(1, stats['decreases'])
+        self.assertLess(stats['min_latency_ms'], 10)
+
+    async def test_slow_responses_are_compared_per_method(self):
+        limiter = RequestConcurrencyLimiter(max_limit=100, initial_limit=10)
+        limiter.MIN_LATENCY_TARGET = 0.01
+        await self._run_requests(limiter, 1, method='server.ping')
+        # a method that is slower than another one is not slow
+        await self._run_requests(limiter, 1, delay=0.05, method='blockchain.estimatefee')
+        await self._run_requests(limiter, 1, delay=0.05, method='blockchain.estimatefee')
+        self.assertEqual(0, limiter.num_decreases)
+        # large responses are not slow either
+        await self._run_requests(limiter, 1, delay=0.05, method='blockchain.block.headers')
+        self.assertEqual(0, limiter.num_decreases)
+        self.assertEqual(10, limiter.limit)
+        # but a method that gets slower than it used to be is
+        await self._run_requests(limiter, 1, delay=0.5, method='blockchain.estimatefee')
+        self.assertEqual(1, limiter.num_decreases)
+        self.assertEqual(9, limiter.limit)
+
+    async def test_limit_is_cut_on_session_cost(self):
+        cost_fraction = 0.1
+        limiter = RequestConcurrencyLimiter(max_limit=100, initial_limit=10, get_cost_fraction=lambda: cost_fraction)
+        await self._run_requests(limiter, 1)
+        self.assertEqual(10, limiter.limit)
+        cost_fraction = 0.6
+        await self._run_requests(limiter, 1)
+        self.assertEqual(5, limiter.limit)
+
+    async def test_cancelled_waiter_passes_on_wakeup(self):
+        limiter = RequestConcurrencyLimiter(max_limit=1, initial_limit=1)
+        release = asyncio.Event()
+        async def request():
+            async with limiter.slot():
+                await release.wait()
+        tasks = [asyncio.create_task(request()) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        self.assertEqual((1, 2), (limiter.in_flight, len(limiter._waiters)))
+        release.set()
+        await asyncio.sleep(0)
+        tasks[1].cancel()  # its slot should go to the next waiter
+        await asyncio.wait_for(asyncio.gather(tasks[0], tasks[2]), timeout=1)
+        self.assertEqual((0, 0), (limiter.in_flight, len(limiter._waiters)))
+
+
 class TestInterface(ElectrumTestCase):
     REGTEST = True
 
@@ -112,6 +215,20 @@ class TestInterface(ElectrumTestCase):
         self.assertEqual(rawtx, self._toyserver.txs["bdae818ad3c1f261317738ae9284159bf54874356f186dbc7afd631dc1527fcb"].hex())
         self.assertEqual(self._get_server_session()._method_counts["blockchain.transaction.get"], 2)
 
+    async def test_transaction_get_uses_disk_cache(self):
+        self.config.NETWORK_RAWTX_CACHE_SIZE = 1
+        self.network.rawtx_cache = RawTxCache.from_config(self.config)
+        interface = await self._start_iface_and_wait_for_sync()
+        addr = bitcoin.script_to_address(bfh("00140297bde2689a3c79ffe050583b62f86f2d9dae54"))
+        funding_tx = await self._toyserver.ask_faucet([TxOutput.from_address_and_value(addr, 1 * COIN)])
+        rawtx = await interface.get_transaction(funding_tx.txid())
+        self.assertEqual(1, self._get_server_session()._method_counts["blockchain.transaction.get"])
+        self.assertEqual(bfh(rawtx), self.network.rawtx_cache.get(funding_tx.txid()))
+        # the in-memory cache of the interface is lost e.g. on reconnect, the disk cache is not
+        interface._rawtx_cache.clear()
+        self.assertEqual(rawtx, await interface.get_transaction(funding_tx.txid()))
+        self.assertEqual(1, self._get_server_session()._method_counts["blockchain.transaction.get"])
+
     async def test_transaction_broadcast(self):
         interface = await self._start_iface_and_wait_for_sync()
         rawtx1 = "020000000001010000000000000000000000000000000000000000000000000000000000000000ffffffff025200ffffffff0200f2052a010000001600140297bde2689a3c79ffe050583b62f86f2d9dae540000000000000000266a24aa21a9ede2f61c3f71d1defd3fa999dfa36953755c690689799962b48bebd836974e8cf90120000000000000000000000000000000000000000000000000000000000000000000000000"
@@ -126,6 +243,85 @@ class TestInterface(ElectrumTestCase):
         self.assertEqual(rawtx1, rawtx2)
         self.assertEqual(self._get_server_session()._method_counts["blockchain.transaction.get"], 0)
 
+    async def test_concurrent_requests_are_batched(self):
+        self.config.NETWORK_REQUEST_BATCH_SIZE = 3
+        interface = await self._start_iface_and_wait_for_sync()
+        scripthashes = [bytes([i]).hex() * 32 for i in range(5)]
+        with mock.patch.object(NotificationSession, "_send_batch", autospec=True,
+                               side_effect=NotificationSession._send_batch) as send_batch:
+            results = await asyncio.gather(
+                *[interface.get_history_for_scripthash(sh) for sh in scripthashes],
+                interface.session.send_request_batched('blockchain.transaction.get', ["deadbeef"*8]),
+                return_exceptions=True)
+        # 6 requests, in batches of at most 3
+        self.assertEqual([3, 3], [len(call.args[1]) for call in send_batch.call_args_list])
+        self.assertEqual([[]] * 5, results[:5])
+        # errors are passed to the caller of the failed request only
+        self.assertIsInstance(results[5], RPCError)
+        self.assertEqual(5, self._get_server_session()._method_counts["blockchain.scripthash.get_history"])
+        # batching can be disabled
+        self.config.NETWORK_REQUEST_BATCH_SIZE = 1
+        with mock.patch.object(NotificationSession, "_send_batch", autospec=True) as send_batch:
+            await asyncio.gather(*[interface.get_history_for_scripthash(sh) for sh in scripthashes])
+        send_batch.assert_not_called()
+        self.assertFalse(interface.got_disconnected.is_set())
+
+    async def test_concurrent_identical_requests_are_shared(self):
+        interface = await self._start_iface_and_wait_for_sync()
+        addr = bitcoin.script_to_address(bfh("00140297bde2689a3c79ffe050583b62f86f2d9dae54"))
+        funding_tx = await self._toyserver.ask_faucet([TxOutput.from_address_and_value(addr, 1 * COIN)])
+        sh = bitcoin.address_to_scripthash(addr)
+        interface._rawtx_cache.clear()
+        histories = await asyncio.gather(*[interface.get_history_for_scripthash(sh) for _ in range(5)])
+        rawtxs = await asyncio.gather(*[interface.get_transaction(funding_tx.txid()) for _ in range(5)])
+        self.assertEqual(1, self._get_server_session()._method_counts["blockchain.scripthash.get_history"])
+        self.assertEqual(1, self._get_server_session()._method_counts["blockchain.transaction.get"])
+        self.assertEqual([[{"height": 0, "tx_hash": funding_tx.txid(), "fee": 0}]] * 5, histories)
+        self.assertEqual([funding_tx.serialize()] * 5, rawtxs)
+        # errors are passed to all callers
+        results = await asyncio.gather(*[interface.get_transaction("deadbeef"*8) for _ in range(3)],
+                                       return_exceptions=True)
+        self.assertTrue(all(isinstance(res, RPCError) for res in results))
+        self.assertEqual(2, self._get_server_session()._method_counts["blockchain.transaction.get"])
+        self.assertIsNotNone(interface.request_limiter.get_stats()['min_latency_ms'])
+        # a caller getting cancelled does not affect the others
+        tasks = [asyncio.create_task(interface.get_history_for_scripthash(sh)) for _ in range(2)]
+        await asyncio.sleep(0)
+        tasks[0].cancel()
+        self.assertEqual(histories[0], await tasks[1])
+        self.assertEqual({}, interface.session._shared_requests)
+        self.assertFalse(interface.got_disconnected.is_set())
+
+    async def test_scripthash_subscriptions_are_refcounted(self):
+        interface = await self._start_iface_and_wait_for_sync()
+        session = interface.session
+        addr = bitcoin.script_to_address(bfh("00140297bde2689a3c79ffe050583b62f86f2d9dae54"))
+        sh = bitcoin.address_to_scripthash(addr)
+        queues = [asyncio.Queue() for _ in range(3)]
+        await asyncio.gather(*[session.subscribe('blockchain.scripthash.subscribe', [sh], q) for q in queues])
+        self.assertEqual(1, self._get_server_session()._method_counts["blockchain.scripthash.subscribe"])
+        self.assertEqual([[sh, None]] * 3, [q.get_nowait() for q in queues])
+        # notifications are fanned out to all subscribers
+        funding_tx = await self._toyserver.ask_faucet([TxOutput.from_address_and_value(addr, 1 * COIN)])
+        statuses = [await q.get() for q in queues]
+        self.assertEqual(1, len(set(status for _sh, status in statuses)))
+        self.assertIsNotNone(statuses[0][1])
+        # the server subscription is kept until the last subscriber is gone
+        session.unsubscribe(queues[0])
+        session.unsubscribe(queues[1])
+        await asyncio.sleep(0.05)
+        self.assertEqual(0, self._get_server_session()._method_counts["blockchain.scripthash.unsubscribe"])
+        self.assertIn(sh, self._get_server_session().subbed_scripthashes)
+        session.unsubscribe(queues[2])
+        await asyncio.wait(list(session._pending_unsubscribes.values()))
+        self.assertEqual(1, self._get_server_session()._method_counts["blockchain.scripthash.unsubscribe"])
+        self.assertNotIn(sh, self._get_server_session().subbed_scripthashes)
+        # subscribing again asks the server for the current status
+        await session.subscribe('blockchain.scripthash.subscribe', [sh], queues[0])
+        self.assertEqual(2, self._get_server_session()._method_counts["blockchain.scripthash.subscribe"])
+        self.assertEqual(statuses[0], await queues[0].get())
+        self.assertFalse(interface.got_disconnected.is_set())
+
     async def test_dont_request_gethistory_if_status_change_results_from_mempool_txs_simply_getting_mined(self):
         """After a new block is mined, we recv "blockchain.scripthash.subscribe" notifs.
         We opportunistically guess the scripthash status changed purely because touching mempool txs just got mined.
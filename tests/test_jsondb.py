@@ -120,6 +120,27 @@ class TestJsonDB(ElectrumTestCase):
         with self.assertRaises(JsonPatchException):
             data = jpatch.apply(data)
 
+    async def test_jsondb_lazy_sections(self):
+        data = {'a': {'x': {'b': 1}, 'y': [2]}, 'c': {'z': {'d': 3}}}
+        db = JsonDB(json.dumps(data), lazy_sections=['a'])
+        a = db.get_dict('a')
+        self.assertEqual(0, a.num_materialized())
+        self.assertEqual(['x', 'y'], list(a.keys()))
+        self.assertEqual(data, json.loads(db.dump()))
+        self.assertEqual(set(), db.get_touched_lazy_sections())
+        # access a single item
+        x = a['x']
+        self.assertEqual({'b': 1}, x)
+        self.assertEqual(1, a.num_materialized())
+        self.assertEqual({'a'}, db.get_touched_lazy_sections())
+        # materialized items are tracked like any other
+        x['b'] = 4
+        self.assertEqual(1, len(db.pending_changes))
+        a.pop('y')
+        self.assertEqual(2, len(db.pending_changes))
+        self.assertEqual({'x': {'b': 4}}, dict(a))
+        self.assertEqual({'a': {'x': {'b': 4}}, 'c': {'z': {'d': 3}}}, json.loads(db.dump()))
+
     async def test_jsondb_replace_after_remove(self):
         for pop_from_dict in [pop1_from_dict, pop2_from_dict]:
             with self.subTest(pop_from_dict):
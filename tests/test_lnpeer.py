@@ -38,7 +38,7 @@ from electrum.lntransport import LNPeerAddr
 from electrum.crypto import privkey_to_pubkey
 from electrum.lnutil import Keypair, PaymentFailure, LnFeatures, HTLCOwner, PaymentFeeBudget, RECEIVED
 from electrum.lnchannel import ChannelState, PeerState, Channel
-from electrum.lnrouter import LNPathFinder, PathEdge, LNPathInconsistent
+from electrum.lnrouter import LNPathFinder, PathEdge, LNPathInconsistent, PathFindingPool
 from electrum.channel_db import ChannelDB, InvalidGossipMsg
 from electrum.lnworker import LNWallet, NoPathFound, SentHtlcInfo, PaySession, LNPeerManager
 from electrum.lnmsg import encode_msg, decode_msg
@@ -2202,6 +2202,16 @@ class TestPeerForwarding(TestPeer):
         with self.assertRaises(PaymentDone):
             await self._run_mpp(graph, {})
 
+    async def test_payment_multipart_with_path_finding_pool(self):
+        graph = self.prepare_chans_and_peers_in_graph(self.GRAPH_DEFINITIONS['square_graph'])
+        alice_network = graph.workers['alice'].network
+        alice_network.path_finding_pool = PathFindingPool(alice_network.path_finder, num_workers=2)
+        try:
+            with self.assertRaises(PaymentDone):
+                await self._run_mpp(graph, {})
+        finally:
+            alice_network.path_finding_pool.shutdown()
+
     async def test_payment_multipart_with_hold_invoice(self):
         graph = self.prepare_chans_and_peers_in_graph(self.GRAPH_DEFINITIONS['square_graph'])
         with self.assertRaises(PaymentDone):
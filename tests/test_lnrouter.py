@@ -1,3 +1,5 @@
+import os
+import pickle
 import random
 import unittest
 from math import inf
@@ -6,7 +8,8 @@ from typing import Optional
 from os import urandom
 
 from electrum import util
-from electrum.channel_db import NodeInfo
+from electrum.channel_db import (NodeInfo, write_gossip_snapshot, read_gossip_snapshot, GossipSnapshotError,
+                                 ChannelDBSnapshot)
 from electrum.onion_message import is_onion_message_node
 from electrum.trampoline import (create_trampoline_onion, _allocate_fee_budget_among_route, PLACEHOLDER_FEE,
                                  get_trampoline_budget)
@@ -20,7 +23,7 @@ from electrum.constants import BitcoinTestnet
 from electrum.simple_config import SimpleConfig
 from electrum.lnrouter import (PathEdge, LiquidityHintMgr, DEFAULT_PENALTY_PROPORTIONAL_MILLIONTH,
                                DEFAULT_PENALTY_BASE_MSAT, fee_for_edge_msat, LNPaymentTRoute, TrampolineEdge,
-                               HINT_DURATION)
+                               HINT_DURATION, PathFindingPool, PathFindingRequest, LiquidityHintDecay)
 
 from . import ElectrumTestCase
 from .test_bitcoin import needs_test_with_all_chacha20_implementations
@@ -397,6 +400,68 @@ class Test_LNRouter(ElectrumTestCase):
             hint = liquidity_hints.get_hint(channel_id)
             self.assertEqual(5_000, hint.can_send(node_from < node_to))
 
+    def test_liquidity_hints_decay(self):
+        liquidity_hints = LiquidityHintMgr(decay=LiquidityHintDecay(max_age=3 * 600, half_life=600))
+        node_from, node_to = bytes(0), bytes(1)
+        channel_id = ShortChannelID.from_components(0, 0, 0)
+        mock_time = 1_000_000
+        with mock.patch.object(lnrouter, 'now', lambda: mock_time):
+            liquidity_hints.update_can_send(node_from, node_to, channel_id, amount_msat=400_000)
+            liquidity_hints.update_cannot_send(node_from, node_to, channel_id, amount_msat=1_000_000)
+            hint = liquidity_hints.get_hint(channel_id)
+            mock_time += 600
+            self.assertEqual(200_000, hint.can_send(node_from < node_to))
+            self.assertEqual(2_000_000, hint.cannot_send(node_from < node_to))
+            self.assertEqual(0, liquidity_hints.penalty(node_from, node_to, channel_id, amount_msat=200_000))
+            self.assertEqual(inf, liquidity_hints.penalty(node_from, node_to, channel_id, amount_msat=2_000_000))
+            # a weaker observation than the decayed one is recorded
+            liquidity_hints.update_can_send(node_from, node_to, channel_id, amount_msat=300_000)
+            self.assertEqual(300_000, hint.can_send(node_from < node_to))
+            mock_time += 3 * 600 + 1
+            self.assertEqual(None, hint.can_send(node_from < node_to))
+            self.assertEqual(None, hint.cannot_send(node_from < node_to))
+
+    def test_liquidity_hints_persistence(self):
+        path = os.path.join(self.electrum_path, 'liquidity_hints')
+        node_from, node_to = bytes(0), bytes(1)
+        old_channel = ShortChannelID.from_components(1, 0, 0)
+        new_channel = ShortChannelID.from_components(2, 0, 0)
+        mock_time = 1_000_000
+        with mock.patch.object(lnrouter, 'now', lambda: mock_time):
+            liquidity_hints = LiquidityHintMgr(path=path)
+            liquidity_hints.update_cannot_send(node_from, node_to, old_channel, amount_msat=1_000_000)
+            mock_time += HINT_DURATION // 2
+            liquidity_hints.update_can_send(node_from, node_to, new_channel, amount_msat=500_000)
+            liquidity_hints.add_htlc(node_from, node_to, new_channel)
+            liquidity_hints.save()
+            loaded = LiquidityHintMgr(path=path)
+            loaded.load()
+            self.assertEqual(1_000_000, loaded.get_hint(old_channel).cannot_send(node_from < node_to))
+            self.assertEqual(1_000_000, loaded.get_hint(old_channel).can_send(node_to < node_from))
+            self.assertEqual(500_000, loaded.get_hint(new_channel).can_send(node_from < node_to))
+            # in-flight htlcs are not persisted
+            self.assertEqual(0, loaded.num_inflight_htlcs(node_from, node_to, new_channel))
+            # expired hints are not loaded
+            mock_time += HINT_DURATION // 2 + 1
+            loaded = LiquidityHintMgr(path=path)
+            loaded.load()
+            self.assertEqual({new_channel}, set(loaded._liquidity_hints))
+            # a corrupted file is ignored
+            with open(path, 'r+b') as f:
+                f.truncate(20)
+            loaded = LiquidityHintMgr(path=path)
+            loaded.load()
+            self.assertEqual({}, loaded._liquidity_hints)
+            # so is a file that cannot be read
+            loaded = LiquidityHintMgr(path=self.electrum_path)  # a directory
+            loaded.load()
+            self.assertEqual({}, loaded._liquidity_hints)
+            # write errors are logged, and the hints are saved again next time
+            liquidity_hints.update_can_send(node_from, node_to, new_channel, amount_msat=600_000)
+            liquidity_hints.path = os.path.join(self.electrum_path, 'missing_dir', 'liquidity_hints')
+            liquidity_hints.save()
+            self.assertTrue(liquidity_hints._dirty)
+
     def test_reset_liquidity_hints_clears_inflight_htlcs(self):
         liquidity_hints = LiquidityHintMgr()
         node_from, node_to = bytes(0), bytes(1)
@@ -595,6 +660,142 @@ class Test_LNRouter(ElectrumTestCase):
         ], path)
 
 
+    async def test_routing_graph_incremental_updates(self):
+        self.prepare_graph()
+        amount_to_send = 100000
+
+        def find_path():
+            return self.path_finder.find_path_for_payment(
+                nodeA=node('a'),
+                nodeB=node('e'),
+                invoice_amount_msat=amount_to_send)
+        self.assertEqual([channel(3), channel(2)], [e.short_channel_id for e in find_path()])
+        # disable channel 2 in direction b->e
+        self.cdb.add_channel_update({'short_channel_id': channel(2), 'message_flags': b'\x00', 'channel_flags': b'\x02', 'cltv_expiry_delta': 99, 'htlc_minimum_msat': 250, 'fee_base_msat': 100, 'fee_proportional_millionths': 150, 'chain_hash': BitcoinTestnet.rev_genesis_bytes(), 'timestamp': 100}, verify=False)
+        self.assertEqual([channel(6), channel(5)], [e.short_channel_id for e in find_path()])
+        # add a cheap direct channel a-e
+        self.cdb.add_channel_announcements({
+            'node_id_1': node('a'), 'node_id_2': node('e'),
+            'bitcoin_key_1': node('a'), 'bitcoin_key_2': node('e'),
+            'short_channel_id': channel(8),
+            'chain_hash': BitcoinTestnet.rev_genesis_bytes(),
+            'len': 0, 'features': b''
+        }, trusted=True)
+        for flags in (b'\x00', b'\x01'):
+            self.cdb.add_channel_update({'short_channel_id': channel(8), 'message_flags': b'\x00', 'channel_flags': flags, 'cltv_expiry_delta': 10, 'htlc_minimum_msat': 250, 'fee_base_msat': 0, 'fee_proportional_millionths': 0, 'chain_hash': BitcoinTestnet.rev_genesis_bytes(), 'timestamp': 0}, verify=False)
+        self.assertEqual([channel(8)], [e.short_channel_id for e in find_path()])
+        # and remove it again
+        self.cdb.remove_channel(channel(8))
+        self.assertEqual([channel(6), channel(5)], [e.short_channel_id for e in find_path()])
+
+    async def test_routing_graph_rebuilt_during_search(self):
+        self.prepare_graph()
+        graph = self.path_finder.graph
+        num_calls = 0
+
+        def node_filter(node_id: bytes, node_info: 'NodeInfo'):
+            # rebuild the graph while the search is running, with a different numbering of edges and nodes
+            nonlocal num_calls
+            num_calls += 1
+            if num_calls == 2:
+                self.cdb.remove_channel(channel(1))
+                graph.on_graph_reset()
+                graph.sync()
+            return True
+
+        path = self.path_finder.find_path_for_payment(
+            nodeA=node('a'),
+            nodeB=node('e'),
+            invoice_amount_msat=100000,
+            node_filter=node_filter)
+        self.assertTrue(num_calls > 2)
+        self.assertEqual([channel(3), channel(2)], [e.short_channel_id for e in path])
+        self.assertEqual(set(graph.node_index), {node('a'), node('b'), node('c'), node('d'), node('e')})
+
+    async def test_route_cache(self):
+        self.prepare_graph()
+        cache = self.path_finder.route_cache
+
+        def find_route(amount_msat=100000):
+            route = self.path_finder.find_route(
+                nodeA=node('a'),
+                nodeB=node('e'),
+                invoice_amount_msat=amount_msat)
+            return [e.short_channel_id for e in route]
+        self.assertEqual([channel(3), channel(2)], find_route())
+        self.assertEqual({'entries': 1, 'hits': 0, 'misses': 1}, cache.get_stats())
+        # same destination, similar amount
+        self.assertEqual([channel(3), channel(2)], find_route(100001))
+        self.assertEqual({'entries': 1, 'hits': 1, 'misses': 1}, cache.get_stats())
+        # different amount bucket
+        find_route(50000)
+        self.assertEqual({'entries': 2, 'hits': 1, 'misses': 2}, cache.get_stats())
+        # learning that a channel on the path cannot forward evicts the entries using it
+        self.path_finder.liquidity_hints.update_cannot_send(node('b'), node('e'), channel(2), amount_msat=100)
+        self.assertEqual(0, cache.get_stats()['entries'])
+        self.assertEqual([channel(6), channel(5)], find_route())
+        # so does blacklisting
+        self.path_finder.add_edge_to_blacklist(channel(5))
+        self.assertEqual(0, cache.get_stats()['entries'])
+        self.assertEqual([channel(3), channel(1), channel(7)], find_route())
+        # and a policy change
+        self.cdb.add_channel_update({'short_channel_id': channel(7), 'message_flags': b'\x00', 'channel_flags': b'\x00', 'cltv_expiry_delta': 10, 'htlc_minimum_msat': 250, 'fee_base_msat': 100, 'fee_proportional_millionths': 151, 'chain_hash': BitcoinTestnet.rev_genesis_bytes(), 'timestamp': 100}, verify=False)
+        self.assertEqual(0, cache.get_stats()['entries'])
+        # a cached path with in-flight htlcs is not reused
+        route = self.path_finder.find_route(nodeA=node('a'), nodeB=node('e'), invoice_amount_msat=100000)
+        self.path_finder.update_num_inflight_htlcs(route, add_htlcs=True)
+        hits = cache.get_stats()['hits']
+        find_route()
+        self.assertEqual(hits, cache.get_stats()['hits'])
+
+    async def test_gossip_snapshot_roundtrip(self):
+        self.prepare_graph()
+        # make sure optional fields are exercised
+        key = (node('d'), channel(4))
+        self.cdb._policies[key] = self.cdb._policies[key]._replace(htlc_maximum_msat=10**9, raw=b'\x01' * 130)
+        self.cdb._channels[channel(1)] = self.cdb._channels[channel(1)]._replace(capacity_sat=10**6, raw=b'\x02' * 430)
+        path = self.cdb.snapshot_path
+        token = urandom(32)
+        write_gossip_snapshot(path, token, self.cdb._channels, self.cdb._policies, self.cdb._nodes)
+        channels, policies, nodes = read_gossip_snapshot(path, token)
+        self.assertEqual(self.cdb._channels, channels)
+        self.assertEqual(self.cdb._policies, policies)
+        self.assertEqual(self.cdb._nodes, nodes)
+        # a snapshot with a different token is stale
+        with self.assertRaises(GossipSnapshotError):
+            read_gossip_snapshot(path, urandom(32))
+        # a truncated snapshot is rejected
+        with open(path, 'r+b') as f:
+            f.truncate(100)
+        with self.assertRaises(GossipSnapshotError):
+            read_gossip_snapshot(path, token)
+
+    async def test_path_finding_pool(self):
+        self.prepare_graph()
+        snapshot = pickle.loads(pickle.dumps(ChannelDBSnapshot(self.cdb)))
+        self.assertEqual(self.cdb._channels.keys(), snapshot._channels.keys())
+        self.assertIsNone(snapshot.get_channel_info(channel(1)).raw)
+        self.assertEqual(self.cdb.get_channels_for_node(node('e')), snapshot.get_channels_for_node(node('e')))
+        # the liquidity hints and the blacklist of the parent are used by the workers
+        self.path_finder.liquidity_hints.update_cannot_send(node('b'), node('e'), channel(2), amount_msat=100)
+        self.path_finder.add_edge_to_blacklist(channel(5))
+        requests = [
+            PathFindingRequest(
+                nodeA=node('a'), nodeB=node('e'), invoice_amount_msat=amount_msat,
+                my_sending_channels={}, private_route_edges={})
+            for amount_msat in (50000, 100000)]
+        pool = PathFindingPool(self.path_finder, num_workers=2)
+        try:
+            paths = await pool.find_paths(requests)
+        finally:
+            pool.shutdown()
+        for request, path in zip(requests, paths):
+            expected = self.path_finder.find_path_for_payment(
+                nodeA=request.nodeA, nodeB=request.nodeB, invoice_amount_msat=request.invoice_amount_msat)
+            self.assertEqual([channel(3), channel(1), channel(7)], [e.short_channel_id for e in expected])
+            self.assertEqual(expected, path)
+
+
 def _tramp_edge(start: str, end: str, *, fee_base=PLACEHOLDER_FEE, fee_prop=PLACEHOLDER_FEE, cltv=576) -> TrampolineEdge:
     return TrampolineEdge(
         start_node=node(start),
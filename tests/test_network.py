@@ -1,13 +1,16 @@
 import asyncio
 import tempfile
+import threading
 import unittest
 from typing import List
 
 from electrum import constants
 from electrum.simple_config import SimpleConfig
 from electrum import blockchain
-from electrum.interface import Interface, ServerAddr, ChainResolutionMode
+from electrum.interface import Interface, ServerAddr, ChainResolutionMode, RequestTimedOut
+from electrum.network import Network
 from electrum.crypto import sha256
+from electrum.blockchain import CHUNK_SIZE, HEADER_SIZE, deserialize_header
 from electrum.util import OldTaskGroup
 from electrum import util
 
@@ -61,6 +64,9 @@ class MockNetwork:
         self.taskgroup = OldTaskGroup()
         self.proxy = None
 
+    def get_request_concurrency_hint(self, server):
+        return None
+
 class MockInterface(Interface):
     def __init__(self, config: SimpleConfig):
         self.config = config
@@ -267,3 +273,128 @@ class TestHeaderChainResolution(ElectrumTestCase):
 if __name__ == "__main__":
     constants.BitcoinRegtest.set_as_network()
     unittest.main()
+
+
+def _mock_raw_header(height: int, chain: str = 'a') -> bytes:
+    return (sha256(f"{chain}{height}") * 3)[:HEADER_SIZE]
+
+
+class MockChunkBlockchain:
+    """Accepts chunks of the 'a' chain, in order."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def connect_chunk(self, idx: int, data: bytes) -> bool:
+        if idx != len(self.chunks):
+            return False
+        start_height = idx * CHUNK_SIZE
+        num = len(data) // HEADER_SIZE
+        if data != b"".join(_mock_raw_header(h) for h in range(start_height, start_height + num)):
+            return False
+        self.chunks.append(idx)
+        return True
+
+    def connect_chunks(self, index0: int, chunks, *, executor=None) -> int:
+        for i, data in enumerate(chunks):
+            if not self.connect_chunk(index0 + i, data):
+                return i
+        return len(chunks)
+
+
+class MockHeaderServer:
+
+    def __init__(self, name: str, *, tip: int, blockchain=None, bad_chunks=(), broken: bool = False):
+        self.server = ServerAddr.from_str(f'{name}:50000:t')
+        self.tip = tip
+        self.blockchain = blockchain
+        self.bad_chunks = bad_chunks  # these are served from the 'b' chain
+        self.broken = broken
+        self.requested_chunks = []
+        self.requested_headers = []
+
+    def is_connected_and_ready(self) -> bool:
+        return True
+
+    async def get_block_headers(self, *, start_height: int, count: int, **kwargs):
+        await asyncio.sleep(0)
+        index = start_height // CHUNK_SIZE
+        self.requested_chunks.append(index)
+        if self.broken:
+            raise RequestTimedOut()
+        chain = 'b' if index in self.bad_chunks else 'a'
+        return [_mock_raw_header(h, chain) for h in range(start_height, min(start_height + count - 1, self.tip) + 1)]
+
+    async def get_block_header(self, height: int, *, mode: ChainResolutionMode) -> dict:
+        self.requested_headers.append(height)
+        return deserialize_header(_mock_raw_header(height), height)
+
+
+class MockHeaderSyncNetwork(MockNetwork):
+
+    MAX_HEADER_CHUNKS_PER_INTERFACE = 2
+    MAX_HEADER_CHUNKS = Network.MAX_HEADER_CHUNKS
+    _get_interfaces_for_header_sync = Network._get_interfaces_for_header_sync
+    fast_forward_chain = Network.fast_forward_chain
+    _get_headers_verify_executor = Network._get_headers_verify_executor
+    _connect_header_chunks = Network._connect_header_chunks
+    _headers_verify_executor = None
+
+    def __init__(self, config: SimpleConfig, interfaces):
+        super().__init__(config)
+        self.logger = util.get_logger(__name__)
+        self.interfaces_lock = threading.Lock()
+        self.interfaces = {iface.server: iface for iface in interfaces}
+
+
+class TestParallelHeaderSync(ElectrumTestCase):
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.config = SimpleConfig({'electrum_path': self.electrum_path})
+
+    async def test_chunks_spread_over_servers(self):
+        tip = 5 * CHUNK_SIZE + 100
+        primary = MockHeaderServer('primary', tip=tip, blockchain=MockChunkBlockchain())
+        helpers = [MockHeaderServer('helper1', tip=tip), MockHeaderServer('helper2', tip=tip + 1)]
+        lagging = MockHeaderServer('lagging', tip=tip - 1)
+        network = MockHeaderSyncNetwork(self.config, [primary, *helpers, lagging])
+        num_headers = await network.fast_forward_chain(primary, index0=0, tip=tip)
+        self.assertEqual(tip + 1, num_headers)
+        self.assertEqual([0, 1, 2, 3, 4, 5], primary.blockchain.chunks)
+        self.assertTrue(all(iface.requested_chunks for iface in [primary, *helpers]))
+        self.assertEqual([], lagging.requested_chunks)
+        self.assertEqual(list(range(6)), sorted(sum((iface.requested_chunks for iface in [primary, *helpers]), [])))
+        # the last header of each chunk from a helper is cross-checked with the primary
+        self.assertEqual(
+            sorted(min((idx + 1) * CHUNK_SIZE - 1, tip) for iface in helpers for idx in iface.requested_chunks),
+            sorted(primary.requested_headers))
+
+    async def test_only_failing_chunks_requested_again(self):
+        tip = 5 * CHUNK_SIZE + 100
+        primary = MockHeaderServer('primary', tip=tip, blockchain=MockChunkBlockchain())
+        bad_helper = MockHeaderServer('helper1', tip=tip, bad_chunks=range(100))
+        broken_helper = MockHeaderServer('helper2', tip=tip, broken=True)
+        network = MockHeaderSyncNetwork(self.config, [primary, bad_helper, broken_helper])
+        num_headers = await network.fast_forward_chain(primary, index0=0, tip=tip)
+        self.assertEqual(tip + 1, num_headers)
+        self.assertEqual([0, 1, 2, 3, 4, 5], primary.blockchain.chunks)
+        # each helper is dropped after its first failure, but can have other requests in flight
+        self.assertLessEqual(len(bad_helper.requested_chunks), network.MAX_HEADER_CHUNKS_PER_INTERFACE)
+        self.assertLessEqual(len(broken_helper.requested_chunks), network.MAX_HEADER_CHUNKS_PER_INTERFACE)
+        self.assertEqual(list(range(6)), sorted(primary.requested_chunks))
+
+    async def test_stops_at_chunk_that_does_not_connect(self):
+        tip = 5 * CHUNK_SIZE + 100
+        primary = MockHeaderServer('primary', tip=tip, blockchain=MockChunkBlockchain(), bad_chunks=[2])
+        network = MockHeaderSyncNetwork(self.config, [primary, MockHeaderServer('helper1', tip=tip)])
+        num_headers = await network.fast_forward_chain(primary, index0=0, tip=tip)
+        self.assertEqual(2 * CHUNK_SIZE, num_headers)
+        self.assertEqual([0, 1], primary.blockchain.chunks)
+
+    async def test_primary_error_is_raised(self):
+        tip = 3 * CHUNK_SIZE
+        primary = MockHeaderServer('primary', tip=tip, blockchain=MockChunkBlockchain(), broken=True)
+        network = MockHeaderSyncNetwork(self.config, [primary])
+        with self.assertRaises(RequestTimedOut):
+            await network.fast_forward_chain(primary, index0=0, tip=tip)
@@ -0,0 +1,79 @@
+import os
+
+from electrum.rawtx_cache import RawTxCache
+from electrum.simple_config import SimpleConfig
+from electrum.transaction import Transaction
+
+from . import ElectrumTestCase
+
+
+# coinbase-like txs that only differ in their scriptSig
+RAW_TXS = [bytes.fromhex(
+    "020000000001010000000000000000000000000000000000000000000000000000000000000000ffffffff02"
+    + f"{0x51 + i:02x}" + "00ffffffff0200f2052a010000001600140297bde2689a3c79ffe050583b62f86f2d9dae540000000000000000266a24aa21a9ede2f61c3f71d1defd3fa999dfa36953755c690689799962b48bebd836974e8cf90120000000000000000000000000000000000000000000000000000000000000000000000000")
+    for i in range(10)]
+
+
+class TestRawTxCache(ElectrumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.config = SimpleConfig({'electrum_path': self.electrum_path})
+        self.txids = [Transaction(raw).txid() for raw in RAW_TXS]
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(RawTxCache.from_config(self.config))
+        self.config.NETWORK_RAWTX_CACHE_SIZE = 1
+        cache = RawTxCache.from_config(self.config)
+        self.assertEqual(1_000_000, cache.max_size)
+
+    def test_put_and_get(self):
+        cache = RawTxCache(os.path.join(self.electrum_path, 'rawtx_cache'), max_size=10**6)
+        self.assertIsNone(cache.get(self.txids[0]))
+        cache.put(self.txids[0], RAW_TXS[0])
+        self.assertEqual(RAW_TXS[0], cache.get(self.txids[0]))
+        self.assertIsNone(cache.get("not a txid"))
+        # entries are kept across instances
+        cache2 = RawTxCache(cache.path, max_size=10**6)
+        self.assertEqual(RAW_TXS[0], cache2.get(self.txids[0]))
+
+    def test_corrupted_entry_is_removed(self):
+        cache = RawTxCache(os.path.join(self.electrum_path, 'rawtx_cache'), max_size=10**6)
+        cache.put(self.txids[0], RAW_TXS[1])  # does not match txid
+        cache.put(self.txids[1], RAW_TXS[1][:-1])  # truncated
+        self.assertIsNone(cache.get(self.txids[0]))
+        self.assertIsNone(cache.get(self.txids[1]))
+        self.assertEqual([], list(cache._list_entries()))
+
+    def test_size_is_bounded(self):
+        tx_size = len(RAW_TXS[0])
+        cache = RawTxCache(os.path.join(self.electrum_path, 'rawtx_cache'), max_size=5 * tx_size)
+        for txid, raw in zip(self.txids, RAW_TXS):
+            cache.put(txid, raw)
+            self.assertEqual(RAW_TXS[0], cache.get(self.txids[0]))  # tx 0 is used the most recently
+        total_size = sum(size for _path, size, _mtime in cache._list_entries())
+        self.assertLessEqual(total_size, 5 * tx_size)
+        self.assertEqual(total_size, cache._total_size)
+        self.assertEqual(RAW_TXS[0], cache.get(self.txids[0]))
+        self.assertEqual(RAW_TXS[9], cache.get(self.txids[9]))
+        self.assertIsNone(cache.get(self.txids[1]))
+
+    def test_lru_order_is_kept_across_instances(self):
+        tx_size = len(RAW_TXS[0])
+        path = os.path.join(self.electrum_path, 'rawtx_cache')
+        max_size = int(5.8 * tx_size)  # room for 5 txs after eviction
+        cache = RawTxCache(path, max_size=max_size)
+        for i, (txid, raw) in enumerate(zip(self.txids[:5], RAW_TXS)):
+            cache.put(txid, raw)
+            # the LRU order is read from the mtimes. tx 0 is used the most recently
+            os.utime(cache._get_entry_path(txid), (1000 + i, 1000 + i))
+        os.utime(cache._get_entry_path(self.txids[0]), (2000, 2000))
+        cache = RawTxCache(path, max_size=max_size)
+        cache.put(self.txids[5], RAW_TXS[5])
+        self.assertEqual(5 * tx_size, cache._total_size)
+        self.assertEqual(RAW_TXS[0], cache.get(self.txids[0]))
+        self.assertIsNone(cache.get(self.txids[1]))
+        # entries removed by someone else are dropped from the index
+        os.unlink(cache._get_entry_path(self.txids[2]))
+        self.assertIsNone(cache.get(self.txids[2]))
+        self.assertEqual(4 * tx_size, cache._total_size)
@@ -2,13 +2,18 @@ import shutil
 import tempfile
 import os
 import json
+import base64
 from typing import Optional
 import asyncio
 import inspect
 
 import electrum
 from electrum.wallet_db import WalletDBUpgrader, WalletDB, WalletRequiresUpgrade, WalletRequiresSplit
+from electrum.wallet_sql_db import SqlWalletDB
+from electrum.storage import WalletStorage
+from electrum.util import WalletFileException, is_hex_str
 from electrum.wallet import Wallet
+from electrum.transaction import PartialTransaction
 from electrum import constants
 from electrum import util
 from electrum.plugin import Plugins
@@ -325,6 +330,148 @@ class TestStorageUpgrade(WalletTestCase):
         wallet_str = self._get_wallet_str()
         await self._upgrade_storage(wallet_str)
 
+    def _assert_same_history(self, db1: WalletDB, db2: WalletDB):
+        # note: other fields might depend on the time the wallet was started
+        d1, d2 = json.loads(db1.dump()), json.loads(db2.dump())
+        for name in ('transactions', ) + SqlWalletDB.SQL_SECTIONS:
+            self.assertEqual(d1[name], d2[name])
+
+    @as_testnet
+    async def test_lazy_load_sections(self):
+        with open(self.get_wallet_file_path("client_4_5_2_9dk_with_ln"), "r") as f:
+            wallet_str = f.read()
+        db = WalletDB(wallet_str, storage=None, upgrade=True)
+        lazy_db = WalletDB(wallet_str, storage=None, upgrade=True, lazy_load=True)
+        self.assertEqual(set(), lazy_db.get_touched_lazy_sections())
+        self.assertEqual(0, lazy_db.transactions.num_materialized())
+        # dumping writes back unconverted values as they are
+        self._assert_same_history(db, lazy_db)
+        self.assertEqual(0, lazy_db.transactions.num_materialized())
+        # items are converted one at a time, on access
+        txid = lazy_db.list_transactions()[0]
+        self.assertEqual(db.get_transaction(txid).serialize(), lazy_db.get_transaction(txid).serialize())
+        self.assertEqual(1, lazy_db.transactions.num_materialized())
+        self.assertEqual({'transactions'}, lazy_db.get_touched_lazy_sections())
+        await self._sanity_check_upgraded_db(db)
+        await self._sanity_check_upgraded_db(lazy_db)
+        self._assert_same_history(db, lazy_db)
+
+    @as_testnet
+    async def test_lazy_load_open_wallet(self):
+        with open(self.get_wallet_file_path("client_4_5_2_9dk_with_ln"), "r") as f:
+            wallet_str = f.read()
+        db = WalletDB(wallet_str, storage=None, upgrade=True, lazy_load=True)
+        num_txs = len(db.transactions)
+        self.assertTrue(num_txs > 10)
+        wallet = Wallet(db, config=self.config)
+        # opening the wallet only needs the txs of the lightning channels
+        num_channels = len(wallet.lnworker.channels)
+        self.assertTrue(db.transactions.num_materialized() <= 2 * num_channels)
+        self.assertTrue(db.transactions.num_materialized() < num_txs)
+        self.assertTrue(len(wallet.get_full_history()) > 0)
+        await wallet.stop()
+
+    @as_testnet
+    async def test_transactions_stored_as_base64(self):
+        with open(self.get_wallet_file_path("client_4_5_2_9dk_with_ln"), "r") as f:
+            wallet_str = f.read()
+        db = WalletDB(wallet_str, storage=None, upgrade=True)
+        txs = json.loads(db.dump())['transactions']
+        self.assertTrue(len(txs) > 0)
+        for txid, raw in txs.items():
+            self.assertFalse(is_hex_str(raw))
+            tx = db.get_transaction(txid)
+            self.assertEqual(txid, tx.txid())
+            if isinstance(tx, PartialTransaction):  # stored as base64 psbt
+                self.assertEqual(raw, tx.serialize())
+            else:
+                self.assertEqual(base64.b64decode(raw).hex(), tx.serialize())
+
+    @as_testnet
+    async def test_sql_history(self):
+        with open(self.get_wallet_file_path("client_4_5_2_9dk_with_ln"), "r") as f:
+            wallet_str = f.read()
+        db = WalletDB(wallet_str, storage=None, upgrade=True)
+        await self._sanity_check_upgraded_db(db)
+        # migrate history into sqlite
+        with open(self.wallet_path, "w") as f:
+            f.write(wallet_str)
+        storage = WalletStorage(self.wallet_path)
+        sql_db = SqlWalletDB(storage.read(), storage=storage, upgrade=True)
+        await self._sanity_check_upgraded_db(sql_db)
+        self._assert_same_history(db, sql_db)
+        self.assertTrue(os.path.exists(SqlWalletDB.get_sql_path(self.wallet_path)))
+        with open(self.wallet_path, "r") as f:
+            self.assertNotIn('"txo"', f.read())
+        # reopen
+        storage = WalletStorage(self.wallet_path)
+        sql_db = SqlWalletDB(storage.read(), storage=storage)
+        self._assert_same_history(db, sql_db)
+        txid = db.list_transactions()[0]
+        for addr in db.get_txo_addresses(txid):
+            self.assertEqual(db.get_txo_addr(txid, addr), sql_db.get_txo_addr(txid, addr))
+        self.assertEqual(db.get_verified_tx(txid), sql_db.get_verified_tx(txid))
+        # history is not in the wallet file
+        with self.assertRaises(WalletFileException):
+            WalletDB(storage.read(), storage=storage)
+
+    def _migrate_to_sql(self) -> SqlWalletDB:
+        with open(self.get_wallet_file_path("client_4_5_2_9dk_with_ln"), "r") as f:
+            wallet_str = f.read()
+        with open(self.wallet_path, "w") as f:
+            f.write(wallet_str)
+        storage = WalletStorage(self.wallet_path)
+        return SqlWalletDB(storage.read(), storage=storage, upgrade=True)
+
+    @as_testnet
+    async def test_sql_history_missing_file(self):
+        sql_db = self._migrate_to_sql()
+        self.assertTrue(len(sql_db.list_transactions()) > 0)
+        sql_db.write()
+        os.unlink(SqlWalletDB.get_sql_path(self.wallet_path))
+        # the wallet opens with an empty history, to be fetched again
+        storage = WalletStorage(self.wallet_path)
+        sql_db = SqlWalletDB(storage.read(), storage=storage)
+        self.assertEqual([], sql_db.list_transactions())
+        self.assertEqual([], sql_db.get_history())
+        self.assertTrue(os.path.exists(SqlWalletDB.get_sql_path(self.wallet_path)))
+
+    @as_testnet
+    async def test_sql_history_ahead_of_wallet_file(self):
+        sql_db = self._migrate_to_sql()
+        sql_db.write()
+        addr = sql_db.get_history()[0]
+        txid = 'ab' * 32
+        sql_db.add_txo_addr(txid, addr, 0, 1000, False)
+        sql_db.set_addr_history(addr, sql_db.get_addr_history(addr) + [(txid, 0)])
+        # crash after committing the sql file, before writing the wallet file
+        sql_db._commit()
+        storage = WalletStorage(self.wallet_path)
+        sql_db = SqlWalletDB(storage.read(), storage=storage)
+        self.assertNotIn(txid, sql_db.list_txo())
+        self.assertFalse(sql_db.is_addr_in_history(addr))
+        self.assertTrue(len(sql_db.get_history()) > 0)
+
+    @as_testnet
+    async def test_sql_history_encrypted_storage(self):
+        with open(self.get_wallet_file_path("client_4_5_2_9dk_with_ln"), "r") as f:
+            db = WalletDB(f.read(), storage=None, upgrade=True)
+        sql_db = self._migrate_to_sql()
+        wallet = Wallet(sql_db, config=self.config)
+        wallet.update_password(None, "secret", encrypt_storage=True)
+        await wallet.stop()
+        self.assertFalse(os.path.exists(SqlWalletDB.get_sql_path(self.wallet_path)))
+        self.assertNotIsInstance(wallet.db, SqlWalletDB)
+        self._assert_same_history(db, wallet.db)
+        # the history was moved into the encrypted wallet file
+        storage = WalletStorage(self.wallet_path)
+        self.assertTrue(storage.is_encrypted())
+        storage.decrypt("secret")
+        sql_db = SqlWalletDB(storage.read(), storage=storage)
+        self.assertNotIsInstance(sql_db, SqlWalletDB)
+        self._assert_same_history(db, sql_db)
+        self.assertFalse(os.path.exists(SqlWalletDB.get_sql_path(self.wallet_path)))
+
     @as_regtest
     async def test_upgrade_from_client_4_6_0_with_unfulfilled_htlcs(self):
         # tests unfulfilled_htlcs conversion in 62->63. seed_version is 60.
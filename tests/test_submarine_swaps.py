@@ -407,6 +407,9 @@ class TestSwapClaim(ElectrumTestCase):
         self.assertIn(swap.payment_hash, self.wallet.lnworker.hold_invoice_callbacks)
         # the txbatcher pays the lockup address
         await self.wait_until(lambda: len(self.utxos_at_lockup_address(swap)) == 1)
+        # the funding tx is added to the wallet as a local tx before it gets broadcast
+        funding_txid = self.utxos_at_lockup_address(swap)[0].txid.hex()
+        await self.wait_until(lambda: funding_txid in self.server.txs)
         await self.mine_blocks(1)
         await self.sm._claim_swap(swap)
         txin = self.adb.get_addr_outputs(swap.lockup_address)[swap._funding_prevout]
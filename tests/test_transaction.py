@@ -1,3 +1,4 @@
+import copy
 import json
 import os
 from typing import NamedTuple, Union
@@ -141,6 +142,105 @@ class TestTransaction(ElectrumTestCase):
 
         self.assertEqual(tx.serialize(), signed_blob)
 
+    def test_tx_deserialize_materializes_scripts_lazily(self):
+        tx = transaction.Transaction(signed_segwit_blob)
+        tx.deserialize()
+        txin = tx.inputs()[0]
+        self.assertIsInstance(txin._witness, transaction._LazyBytes)
+        self.assertEqual(
+            construct_witness([
+                bfh('30440220789c7d47f876638c58d98733c30ae9821c8fa82b470285dcdf6db5994210bf9f02204163418bbc44af701212ad42d884cc613f3d3d831d2d0cc886f767cca6e0235e01'),
+                bfh('03083a6dc250816d771faa60737bfe78b23ad619f6b458e0a1f1688e3a0605e79c')]),
+            txin.witness)
+        self.assertIsInstance(txin._witness, bytes)
+        self.assertEqual(b'', txin.script_sig)
+        tx2 = copy.deepcopy(tx)
+        self.assertEqual(signed_segwit_blob, tx2.serialize_to_network())
+        self.assertEqual(tx.txid(), tx2.txid())
+
+    def test_parse_prevouts_and_output_values(self):
+        for raw in (signed_blob, v2_blob, signed_segwit_blob):
+            tx = transaction.Transaction(raw)
+            prevouts, values = tx.get_prevouts_and_output_values()
+            self.assertIsNone(tx._inputs)  # not deserialized
+            self.assertEqual([txin.prevout for txin in tx.inputs()], prevouts)
+            self.assertEqual([txout.value for txout in tx.outputs()], values)
+            self.assertEqual((prevouts, values), tx.get_prevouts_and_output_values())
+        with self.assertRaises(transaction.SerializationError):
+            transaction.parse_prevouts_and_output_values(bfh(signed_blob)[:-10])
+
+    def _create_tx_with_many_inputs(self, num_inputs: int):
+        privkeys = [ECPrivkey(bytes([i + 1]) * 32) for i in range(num_inputs)]
+        script_types = ['p2pkh' if i % 2 else 'p2wpkh' for i in range(num_inputs)]
+        descs = [descriptor.get_singlesig_descriptor_from_legacy_leaf(
+                     pubkey=privkey.get_public_key_hex(), script_type=script_type)
+                 for privkey, script_type in zip(privkeys, script_types)]
+        dummy_txin = PartialTxInput(prevout=TxOutpoint(bytes([1]) * 32, 0))
+        dummy_txin.script_sig = b''
+        funding_tx = PartialTransaction.from_io(
+            [dummy_txin],
+            [PartialTxOutput(scriptpubkey=desc.expand().output_script, value=10_000) for desc in descs],
+            BIP69_sort=False)
+        funding_tx = Transaction(funding_tx.serialize_to_network(include_sigs=False))
+        inputs = []
+        for i, desc in enumerate(descs):
+            txin = PartialTxInput(prevout=TxOutpoint(bfh(funding_tx.txid()), i))
+            txin.utxo = funding_tx
+            txin.script_descriptor = desc
+            inputs.append(txin)
+        outputs = [PartialTxOutput(scriptpubkey=descs[0].expand().output_script, value=10_000 * num_inputs - 5000)]
+        tx = PartialTransaction.from_io(inputs, outputs, locktime=0, BIP69_sort=False)
+        keypairs = {privkey.get_public_key_bytes(): privkey.get_secret_bytes() for privkey in privkeys}
+        return tx, keypairs
+
+    def test_legacy_preimage_uses_shared_serialization(self):
+        tx, keypairs = self._create_tx_with_many_inputs(5)
+        sighash_cache = transaction.SighashCache()
+        for txin_index in (1, 3):
+            txin = tx.inputs()[txin_index]
+            self.assertFalse(txin.is_segwit())
+            preimage_script = txin.get_scriptcode_for_sighash()
+            expected = (
+                int.to_bytes(tx.version, length=4, byteorder="little")
+                + bitcoin.var_int(len(tx.inputs()))
+                + b"".join(txin2.serialize_to_network(script_sig=preimage_script if k == txin_index else b"")
+                           for k, txin2 in enumerate(tx.inputs()))
+                + bitcoin.var_int(len(tx.outputs()))
+                + b"".join(o.serialize_to_network() for o in tx.outputs())
+                + int.to_bytes(tx.locktime, length=4, byteorder="little")
+                + int.to_bytes(transaction.Sighash.ALL, length=4, byteorder="little"))
+            self.assertEqual(expected, tx.serialize_preimage(txin_index, sighash_cache=sighash_cache))
+            self.assertEqual(expected, tx.serialize_preimage(txin_index))
+
+    def test_sign_many_inputs_in_thread_pool(self):
+        tx1, keypairs = self._create_tx_with_many_inputs(10)
+        tx2 = copy.deepcopy(tx1)
+        tx1.sign(keypairs)
+        tx2.sign(keypairs, num_workers=3)
+        self.assertTrue(tx1.is_complete())
+        for txin_index, txin in enumerate(tx1.inputs()):
+            (pubkey, sig), = txin.sigs_ecdsa.items()
+            self.assertTrue(tx1.verify_sig_for_txin(txin_index=txin_index, pubkey_bytes=pubkey, sig=sig))
+        self.assertEqual(tx1.serialize(), tx2.serialize())
+
+    def test_deepcopy_network_tx(self):
+        tx = Transaction(signed_segwit_blob)
+        tx.deserialize()
+        tx2 = copy.deepcopy(tx)
+        self.assertIsNone(tx2._inputs)  # copied lazily
+        self.assertEqual(tx.txid(), tx2.txid())
+        self.assertEqual(signed_segwit_blob, tx2.serialize())
+        # the copy is independent
+        tx2.locktime = 1
+        self.assertEqual(signed_segwit_blob, tx.serialize())
+        # per-input info that is not part of the serialization is kept
+        tx.inputs()[0].block_height = 100
+        tx.inputs()[0].spent_height = 200
+        tx2 = copy.deepcopy(tx)
+        self.assertEqual(100, tx2.inputs()[0].block_height)
+        self.assertEqual(200, tx2.inputs()[0].spent_height)
+        self.assertIsNot(tx.inputs()[0], tx2.inputs()[0])
+
     def test_estimated_tx_size(self):
         tx = transaction.Transaction(signed_blob)
 
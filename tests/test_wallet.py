@@ -10,16 +10,16 @@ import asyncio
 from unittest import mock
 from pathlib import Path
 
-from electrum.storage import WalletStorage
+from electrum.storage import WalletStorage, StorageEncryptionVersion
 from electrum.wallet_db import FINAL_SEED_VERSION
 from electrum.wallet import (Abstract_Wallet, Standard_Wallet, create_new_wallet,
                              Imported_Wallet, Wallet)
 from electrum.exchange_rate import ExchangeBase, FxThread
-from electrum.util import TxMinedInfo, InvalidPassword
+from electrum.util import TxMinedInfo, InvalidPassword, WalletFileException
 from electrum.bitcoin import COIN
 from electrum.wallet_db import WalletDB, JsonDB
 from electrum.simple_config import SimpleConfig
-from electrum import util, storage
+from electrum import util, storage, pubkey_cache
 from electrum.daemon import Daemon
 from electrum.invoices import PR_UNPAID, PR_PAID, PR_UNCONFIRMED
 from electrum.transaction import tx_from_any
@@ -111,6 +111,86 @@ class TestWalletStorage(WalletTestCase):
         db = JsonDB(storage.read(), storage=storage)
         self.assertEqual(db.get("c"), "d")
 
+    async def test_encrypted_storage_appends_sealed_journal_records(self):
+        def open_db():
+            storage = WalletStorage(self.wallet_path, allow_partial_writes=True)
+            self.assertTrue(storage.is_encrypted_with_user_pw())
+            storage.decrypt("pw")
+            return JsonDB(storage.read(), storage=storage)
+        storage = WalletStorage(self.wallet_path, allow_partial_writes=True)
+        storage.set_password("pw", enc_version=StorageEncryptionVersion.USER_PASSWORD)
+        db = JsonDB('', storage=storage)
+        db.put("a", "x" * 1000)
+        db.write()
+        # reopen, so that the file is large enough for appending
+        db = open_db()
+        self.assertFalse(db.storage.should_do_full_write_next())
+        with open(self.wallet_path, "r") as f:
+            contents = f.read()
+        db.put("b", "c")
+        db.write()
+        with open(self.wallet_path, "r") as f:
+            contents2 = f.read()
+        self.assertTrue(contents2.startswith(contents + "\n"))
+        self.assertNotIn('"b"', contents2)
+        # a record truncated by a crash is dropped on load
+        with open(self.wallet_path, "a") as f:
+            f.write("\nQklFMQ")
+        db = open_db()
+        self.assertEqual(db.get("b"), "c")
+        # the journal was consolidated on load
+        with open(self.wallet_path, "r") as f:
+            self.assertNotIn("\n", f.read())
+        db.put("d", "e")
+        db.write()
+        db = open_db()
+        self.assertEqual(db.get("b"), "c")
+        self.assertEqual(db.get("d"), "e")
+        # wrong password
+        storage = WalletStorage(self.wallet_path, allow_partial_writes=True)
+        with self.assertRaises(InvalidPassword):
+            storage.decrypt("wrong")
+
+    async def test_encrypted_storage_journal_records_are_chained(self):
+        def open_db():
+            storage = WalletStorage(self.wallet_path, allow_partial_writes=True)
+            storage.decrypt("pw")
+            return JsonDB(storage.read(), storage=storage)
+        storage = WalletStorage(self.wallet_path, allow_partial_writes=True)
+        storage.set_password("pw", enc_version=StorageEncryptionVersion.USER_PASSWORD)
+        db = JsonDB('', storage=storage)
+        db.put("a", os.urandom(1000).hex())
+        db.write()
+        db = open_db()
+        for key in ("b", "c", "d"):
+            db.put(key, key)
+            db.write()
+        with open(self.wallet_path, "r") as f:
+            blob, *records = f.read().split("\n")
+        self.assertEqual(3, len(records))
+        db = open_db()
+        self.assertEqual(db.get("d"), "d")
+
+        def check_raises(lines):
+            with open(self.wallet_path, "w") as f:
+                f.write("\n".join(lines))
+            storage = WalletStorage(self.wallet_path, allow_partial_writes=True)
+            with self.assertRaises(WalletFileException):
+                storage.decrypt("pw")
+        # dropped, reordered and replayed records
+        check_raises([blob, records[0], records[2]])
+        check_raises([blob, records[1], records[0], records[2]])
+        check_raises([blob] + records + [records[2]])
+        # a complete last record that does not authenticate
+        length, _, sealed = records[2].partition(":")
+        check_raises([blob, records[0], records[1], f"{length}:{sealed[:-8]}{'A' * 8}"])
+        # but a truncated one is dropped
+        with open(self.wallet_path, "w") as f:
+            f.write("\n".join([blob, records[0], records[1], records[2][:-8]]))
+        db = open_db()
+        self.assertEqual(db.get("c"), "c")
+        self.assertEqual(db.get("d"), None)
+
     async def test_storage_imported_add_privkeys_persistence_test(self):
         text = ' '.join([
             'p2wpkh:L4jkdiXszG26SUYvwwJhzGwg37H2nLhrbip7u6crmgNeJysv5FHL',
@@ -462,3 +542,79 @@ class TestWalletPassword(WalletTestCase):
         with self.assertRaises(InvalidPassword):
             wallet.check_password("wrong password")
         wallet.check_password("1234")
+
+
+class TestPubkeyCache(WalletTestCase):
+
+    def _open_wallet(self):
+        storage = WalletStorage(self.wallet_path)
+        db = WalletDB(storage.read(), storage=storage, upgrade=True)
+        return Wallet(db, config=self.config)
+
+    async def test_pubkeys_are_cached_across_reopens(self):
+        self.config.WALLET_PUBKEY_CACHE = True
+        text = 'zpub6nydoME6CFdJtMpzHW5BNoPz6i6XbeT9qfz72wsRqGdgGEYeivso6xjfw8cGcCyHwF7BNW4LDuHF35XrZsovBLWMF4qXSjmhTXYiHbWqGLt'
+        d = restore_wallet_from_text__for_unittest(text, path=self.wallet_path, gap_limit=5, config=self.config)
+        wallet = d['wallet']  # type: Standard_Wallet
+        addresses = wallet.get_addresses()
+        await wallet.stop()
+        cache_path = self.wallet_path + '.pubkeys'
+        self.assertTrue(os.path.exists(cache_path))
+
+        with mock.patch.object(wallet.keystore.__class__, '_derive_pubkeys') as mock_derive:
+            wallet = self._open_wallet()
+            mock_derive.assert_not_called()
+        self.assertEqual(addresses, wallet.get_addresses())
+        self.assertEqual(len(addresses), len(wallet.keystore.get_cached_pubkeys()))
+        wallet.try_detecting_internal_addresses_corruption()
+
+        # a corrupted cache file is ignored
+        with open(cache_path, 'r+b') as f:
+            f.seek(-40, os.SEEK_END)
+            f.write(b'\x00')
+        wallet = self._open_wallet()
+        self.assertEqual(addresses, wallet.get_addresses())
+        self.assertEqual(0, len(wallet.keystore.get_cached_pubkeys()))
+
+        # the cache file is removed when the wallet file gets encrypted
+        wallet.update_password(None, "1234", encrypt_storage=True)
+        self.assertFalse(os.path.exists(cache_path))
+
+    async def test_corrupted_section_is_skipped(self):
+        class FakeKeystore:
+            def __init__(self, mpk, pubkeys):
+                self.mpk, self.pubkeys = mpk, pubkeys
+            def get_master_public_key(self):
+                return self.mpk
+            def get_cached_pubkeys(self):
+                return self.pubkeys
+        ks1 = FakeKeystore('xpub1', {(0, 0): b'\x02' * 33})
+        ks2 = FakeKeystore('xpub2', {(0, 0): b'\x03' * 33, (1, 5): b'\x02' * 33})
+        data = bytearray(pubkey_cache.serialize_pubkey_cache([ks1, ks2]))
+        self.assertEqual({ks1: ks1.pubkeys, ks2: ks2.pubkeys}, pubkey_cache.deserialize_pubkey_cache(bytes(data), [ks1, ks2]))
+        section1_size = 32 + 4 + (6 + 33)
+        data[len(pubkey_cache.MAGIC) + section1_size] ^= 1  # mac of the first section
+        self.assertEqual({ks2: ks2.pubkeys}, pubkey_cache.deserialize_pubkey_cache(bytes(data), [ks1, ks2]))
+        with self.assertRaises(pubkey_cache.PubkeyCacheFileException):
+            pubkey_cache.deserialize_pubkey_cache(bytes(data[:-1]), [ks1, ks2])
+
+    async def test_save_errors_are_logged(self):
+        self.config.WALLET_PUBKEY_CACHE = True
+        text = 'zpub6nydoME6CFdJtMpzHW5BNoPz6i6XbeT9qfz72wsRqGdgGEYeivso6xjfw8cGcCyHwF7BNW4LDuHF35XrZsovBLWMF4qXSjmhTXYiHbWqGLt'
+        d = restore_wallet_from_text__for_unittest(text, path=self.wallet_path, gap_limit=5, config=self.config)
+        wallet = d['wallet']  # type: Standard_Wallet
+        wallet._pubkey_cache_path = os.path.join(self.electrum_path, 'missing_dir', 'wallet.pubkeys')
+        await wallet.stop()
+        self.assertEqual(0, wallet._num_pubkeys_in_cache_file)
+
+    async def test_pubkey_cache_size_follows_number_of_addresses(self):
+        text = 'zpub6nydoME6CFdJtMpzHW5BNoPz6i6XbeT9qfz72wsRqGdgGEYeivso6xjfw8cGcCyHwF7BNW4LDuHF35XrZsovBLWMF4qXSjmhTXYiHbWqGLt'
+        d = restore_wallet_from_text__for_unittest(text, path=None, gap_limit=5, config=self.config)
+        wallet = d['wallet']  # type: Standard_Wallet
+        self.assertEqual(10**4, wallet.keystore._pubkey_cache.maxsize)
+        wallet.change_gap_limit(12_000)
+        wallet.synchronize()
+        num_addresses = len(wallet.get_addresses())
+        self.assertGreater(num_addresses, 12_000)
+        self.assertGreaterEqual(wallet.keystore._pubkey_cache.maxsize, num_addresses)
+        self.assertEqual(num_addresses, len(wallet.keystore.get_cached_pubkeys()))
@@ -5,13 +5,15 @@ import tempfile
 from typing import Sequence
 import asyncio
 import copy
+from collections import defaultdict
 
 from electrum import bitcoin, keystore, bip32, slip39
 from electrum.wallet_db import WalletDB
 from electrum.storage import WalletStorage
 from electrum import SimpleConfig
 from electrum import util
-from electrum.address_synchronizer import TX_HEIGHT_UNCONFIRMED, TX_HEIGHT_UNCONF_PARENT, TX_HEIGHT_LOCAL, TX_HEIGHT_FUTURE
+from electrum.address_synchronizer import (TX_HEIGHT_UNCONFIRMED, TX_HEIGHT_UNCONF_PARENT, TX_HEIGHT_LOCAL, TX_HEIGHT_FUTURE,
+                                          _HistoryIndex)
 from electrum.wallet import (sweep, Multisig_Wallet, Standard_Wallet, Imported_Wallet,
                              Abstract_Wallet, CannotBumpFee, BumpFeeStrategy,
                              TransactionPotentiallyDangerousException,
@@ -4543,6 +4545,82 @@ class TestWalletHistory_SimpleRandomOrder(ElectrumTestCase):
             w.adb.receive_tx_callback(tx, tx_height=TX_HEIGHT_UNCONFIRMED)
         self.assertEqual(27633300, sum(w.get_balance()))
 
+    @staticmethod
+    def _compute_history_from_scratch(adb, domain):
+        tx_deltas = defaultdict(int)
+        for addr in domain:
+            for txid in adb.get_address_history(addr):
+                tx_deltas[txid] += adb.get_tx_delta(txid, addr)
+        txids = sorted(tx_deltas, key=lambda txid: (*adb._get_tx_sort_key(txid), txid))
+        history = []
+        balance = 0
+        for txid in txids:
+            balance += tx_deltas[txid]
+            history.append((txid, tx_deltas[txid], balance))
+        return history
+
+    async def test_history_is_maintained_incrementally(self):
+        w = self.create_old_wallet()
+        domain = w.get_addresses()
+        def get_history(**kwargs):
+            return [(item.txid, item.delta, item.balance) for item in w.adb.get_history(domain, **kwargs)]
+        order = [2, 12, 7, 9, 11, 10, 16, 6, 17, 1, 13, 15, 5, 8, 4, 0, 14, 18, 3]
+        for n, i in enumerate(order):
+            tx = Transaction(self.transactions[self.txid_list[i]])
+            w.adb.receive_tx_callback(tx, tx_height=1_230_000 + n % 5 if n % 3 else TX_HEIGHT_UNCONFIRMED)
+            self.assertEqual(self._compute_history_from_scratch(w.adb, domain), get_history())
+        history = get_history()
+        self.assertEqual(27633300, history[-1][2])
+        self.assertEqual(len(history), w.adb.get_history_len(domain))
+        # pagination
+        self.assertEqual(history[3:7], get_history(offset=3, limit=4))
+        # height range: unconfirmed txs are kept by from_height, dropped by to_height
+        in_range = [item.txid for item in w.adb.get_history(domain)
+                    if item.tx_mined_status.height() <= 0 or item.tx_mined_status.height() >= 1_230_002]
+        self.assertEqual(in_range, [x[0] for x in get_history(from_height=1_230_002)])
+        in_range = [item.txid for item in w.adb.get_history(domain)
+                    if 0 < item.tx_mined_status.height() < 1_230_002]
+        self.assertEqual(in_range, [x[0] for x in get_history(to_height=1_230_002)])
+        # queries for other domains
+        addr = domain[0]
+        self.assertEqual(self._compute_history_from_scratch(w.adb, [addr]),
+                         [(item.txid, item.delta, item.balance) for item in w.adb.get_history([addr])])
+        self.assertEqual(self._compute_history_from_scratch(w.adb, domain), get_history())
+        with mock.patch.object(_HistoryIndex, 'MAX_DOMAIN_CHANGE', 0):
+            # a large change of a smaller domain does not evict the index of the wallet
+            self.assertEqual(self._compute_history_from_scratch(w.adb, [addr]),
+                             [(item.txid, item.delta, item.balance) for item in w.adb.get_history([addr])])
+            self.assertEqual(set(domain), w.adb._history_index.domain)
+        # removing a tx (and its children)
+        w.adb.remove_transaction(self.txid_list[order[0]])
+        self.assertEqual(self._compute_history_from_scratch(w.adb, domain), get_history())
+
+    async def test_utxo_index_is_maintained_incrementally(self):
+        w = self.create_old_wallet()
+        domain = w.get_addresses()
+        def check_utxo_index():
+            for addr in domain:
+                received, sent = w.adb.get_addr_io(addr)
+                unspent = {prevout for prevout in received if prevout not in sent}
+                self.assertEqual(unspent, {prevout.to_str() for prevout in w.adb.get_addr_utxo(addr)})
+                self.assertEqual(set(received), {prevout.to_str() for prevout in w.adb.get_addr_outputs(addr)})
+                self.assertEqual(sum(v for height, pos, v, is_cb in received.values()), w.adb.get_addr_received(addr))
+                self.assertEqual(len(sent) > 0, w.adb.is_used_as_from_address(addr))
+                self.assertEqual(not unspent, w.adb.is_empty(addr))
+            self.assertEqual(sum(w.adb.get_balance(domain)),
+                             sum(coin.value_sats() for coin in w.adb.get_utxos(domain)))
+        # add txs in an order where spending txs come before the txs they spend from
+        order = [2, 12, 7, 9, 11, 10, 16, 6, 17, 1, 13, 15, 5, 8, 4, 0, 14, 18, 3]
+        for n, i in enumerate(order):
+            tx = Transaction(self.transactions[self.txid_list[i]])
+            w.adb.receive_tx_callback(tx, tx_height=1_230_000 + n if n % 3 else TX_HEIGHT_UNCONFIRMED)
+            check_utxo_index()
+        self.assertEqual(27633300, sum(w.adb.get_balance(domain)))
+        # removing txs (and their children) gives the coins back
+        for i in order[::4]:
+            w.adb.remove_transaction(self.txid_list[i])
+            check_utxo_index()
+
 
 class TestWalletHistory_EvilGapLimit(ElectrumTestCase):
     TESTNET = True
@@ -4599,6 +4677,12 @@ class TestWalletHistory_EvilGapLimit(ElectrumTestCase):
                                    {})
         w.synchronize()
         self.assertEqual(9999788, sum(w.get_balance()))
+        # addresses were derived in batches, up to the gap limit beyond HD index 25
+        receiving_addresses = w.get_receiving_addresses()
+        self.assertEqual(26 + 20, len(receiving_addresses))
+        for n in (0, 1, 25, 45):
+            self.assertEqual(w.derive_address(0, n), receiving_addresses[n])
+        self.assertEqual(w.get_change_addresses(), list(w.derive_addresses(1, 0, w.gap_limit_for_change)))
 
 
 class TestWalletHistory_DoubleSpend(ElectrumTestCase):
@@ -7,6 +7,7 @@ import asyncio
 from electrum import blockchain, util
 from electrum.blockchain import Blockchain
 from electrum.interface import Interface, ServerAddr
+from electrum.rawtx_cache import RawTxCache
 from electrum.simple_config import SimpleConfig
 from electrum.transaction import Transaction
 from electrum.util import OldTaskGroup
@@ -33,6 +34,7 @@ class ToyNetwork:
         self.bhi_lock = asyncio.Lock()
         self.interface = None  # type: Interface | None
         self.relay_fee = None  # type: int | None  # sat/kbyte, set from the server on connect
+        self.rawtx_cache = RawTxCache.from_config(config)
 
     async def connect(self, server: ToyServer, *, client_name: str = None) -> Interface:
         """connect to server, and wait until we have synced its headers"""
@@ -63,6 +65,8 @@ class ToyNetwork:
         pass
     async def switch_lagging_interface(self):
         pass
+    def get_request_concurrency_hint(self, server: ServerAddr) -> int | None:
+        return None
     def blockchain(self) -> Blockchain:
         return self.interface.blockchain
     def get_local_height(self) -> int:
@@ -475,6 +475,7 @@ class ToyServerSession(aiorpcx.RPCSession, Logger):
             'blockchain.block.header': self._handle_block_header,
             'blockchain.block.headers': self._handle_block_headers,
             'blockchain.scripthash.subscribe': self._handle_scripthash_subscribe,
+            'blockchain.scripthash.unsubscribe': self._handle_scripthash_unsubscribe,
             'blockchain.scripthash.get_history': self._handle_scripthash_get_history,
             'blockchain.transaction.get': self._handle_transaction_get,
             'blockchain.transaction.broadcast': self._handle_transaction_broadcast,
@@ -576,6 +577,12 @@ class ToyServerSession(aiorpcx.RPCSession, Logger):
         hist = self.svr.calc_sh_history(sh)
         return history_status(hist)
 
+    async def _handle_scripthash_unsubscribe(self, sh: str) -> bool:
+        if sh not in self.subbed_scripthashes:
+            return False
+        self.subbed_scripthashes.discard(sh)
+        return True
+
     async def _handle_scripthash_get_history(self, sh: str) -> Sequence[dict]:
         hist_tuples = self.svr.calc_sh_history(sh)
         hist_dicts = [{"height": height, "tx_hash": txid} for (txid, height) in hist_tuples]